@@ -0,0 +1,220 @@
+# numeric_engine.py
+"""
+Template-based engine for NUMERIC_VALUE questions.
+
+The product is resolved with `similarity_search`, the question is mapped to
+one of a fixed set of aggregates (min/max/avg price, member count, shop count)
+with optional warranty/city filters, and the number is read with a
+parameterized query. Unfiltered questions are answered from
+`product_offer_stats`; filtered ones aggregate `member_total`.
+
+When the product is not resolved confidently or the question does not match
+exactly one template, `answer` returns None and the caller falls back to the
+LLM (TorobInfoAgent).
+"""
+import os
+import re
+import time
+from decimal import Decimal
+from collections import OrderedDict
+from typing import Optional, Union, List, Tuple
+from sql.db_pool import connection
+from sql.offer_stats import get_offer_stats
+from sql.similarity_search_db import similarity_search
+from utils.utils import preprocess_persian
+
+NUMERIC_ENGINE_MIN_SIMILARITY = float(os.getenv("NUMERIC_ENGINE_MIN_SIMILARITY", 0.75))
+NUMERIC_ENGINE_CACHE_SIZE = int(os.getenv("NUMERIC_ENGINE_CACHE_SIZE", 2048))
+NUMERIC_ENGINE_CACHE_TTL = float(os.getenv("NUMERIC_ENGINE_CACHE_TTL", 600))  # seconds
+
+_SEP = r"[\s\u200c]?"  # space or zero-width non-joiner between word parts
+
+PRICE_WORDS = re.compile(r"قیمت|ارزان|گران|تومان|ریال")
+COUNT_WORDS = re.compile(r"تعداد|چند")  # not "چقدر" ("how much"): it asks for a price as often as a count
+
+METRIC_PATTERNS = {
+    "min_price": re.compile(rf"کم{_SEP}ترین|ارزان{_SEP}ترین|حداقل|پایین{_SEP}ترین"),
+    "max_price": re.compile(rf"بیش{_SEP}ترین|گران{_SEP}ترین|حداکثر|بالا{_SEP}ترین"),
+    "avg_price": re.compile(r"میانگین|متوسط"),
+    "shop_count": re.compile(r"فروشگاه|مغازه|فروشنده"),
+    "member_count": re.compile(r"عضو"),
+}
+PRICE_METRICS = {"min_price", "max_price", "avg_price"}
+COUNT_METRICS = {"shop_count", "member_count"}
+
+NO_WARRANTY = re.compile(rf"(بدون|فاقد|نداشته\s?باشه|ندارد|نداره){_SEP}(ضمانت|گارانتی)|(ضمانت|گارانتی)\s?(نداشته|ندارد|نداره)")
+WARRANTY = re.compile(r"ضمانت|گارانتی")
+# Filters we do not have templates for
+UNSUPPORTED = re.compile(r"امتیاز|ستاره|رنگ|ویژگی")
+# Price comparisons and ranges ("کمتر از 10 میلیون", "زیر 5 میلیون", "بین ... تا ...") are filters too;
+# "کمترین" / "ارزان‌ترین" are metrics, not comparisons
+COMPARISON = re.compile(
+    rf"(کم|بیش|پایین|بالا){_SEP}تر\s*از|(ارزان|ارزون|گران|گرون){_SEP}تر(?!ین)"
+    r"|(?<!\w)(زیر|بالای|بین)(?!\w)"
+)
+
+# Aggregates over member_total for filtered questions
+METRIC_SQL = {
+    "min_price": "MIN(mt.price)",
+    "max_price": "MAX(mt.price)",
+    "avg_price": "AVG(mt.price)::double precision",
+    "member_count": "COUNT(*)",
+    "shop_count": "COUNT(DISTINCT mt.shop_id)",
+}
+
+Number = Union[int, float]
+
+
+class NumericQueryEngine:
+    def __init__(self, min_similarity: float = NUMERIC_ENGINE_MIN_SIMILARITY,
+                 cache_size: int = NUMERIC_ENGINE_CACHE_SIZE, cache_ttl: float = NUMERIC_ENGINE_CACHE_TTL):
+        self.min_similarity = min_similarity
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: OrderedDict[tuple, tuple[float, Optional[Number]]] = OrderedDict()
+        self._cities: Optional[List[Tuple[str, re.Pattern]]] = None
+
+        self.requests = 0
+        self.answered = 0
+        self.fallbacks: dict[str, int] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # ------ Question parsing ------
+    async def _city_names(self) -> List[Tuple[str, re.Pattern]]:
+        """(name, whole-token pattern of the normalized name), longest first."""
+        if self._cities is None:
+            async with connection() as conn:
+                cur = await conn.execute("SELECT name FROM cities WHERE name IS NOT NULL")
+                rows = await cur.fetchall()
+            # Longest first so e.g. "اسلامشهر" wins over "اسلام"
+            names = sorted({row[0] for row in rows}, key=len, reverse=True)
+            self._cities = [
+                (name, re.compile(rf"(?<!\w){re.escape(preprocess_persian(name))}(?!\w)"))
+                for name in names if preprocess_persian(name)
+            ]
+        return self._cities
+
+    async def parse(self, text: str) -> Tuple[Optional[dict], Optional[str]]:
+        """Map a question to (template, None), or (None, reason) if no single template fits."""
+        text = preprocess_persian(text)
+        if UNSUPPORTED.search(text) or COMPARISON.search(text):
+            return None, "unsupported_filter"
+
+        metrics = {name for name, pattern in METRIC_PATTERNS.items() if pattern.search(text)}
+        # A price question without min/max/avg ("قیمت ... چقدر است") has no template: never answer it with a count
+        if PRICE_WORDS.search(text) and not metrics & PRICE_METRICS:
+            return None, "ambiguous_template"
+        if metrics & PRICE_METRICS and not PRICE_WORDS.search(text):
+            metrics -= PRICE_METRICS
+        if metrics & COUNT_METRICS and not COUNT_WORDS.search(text):
+            metrics -= COUNT_METRICS
+        # "shop" also appears in price questions ("... in shops with warranty"): prices win
+        if metrics & PRICE_METRICS:
+            metrics -= COUNT_METRICS
+        # "member" is more specific than "shop"
+        if metrics == {"shop_count", "member_count"}:
+            metrics = {"member_count"}
+        if len(metrics) != 1:
+            return None, "no_template" if not metrics else "ambiguous_template"
+
+        has_warranty = None
+        if NO_WARRANTY.search(text):
+            has_warranty = False
+        elif WARRANTY.search(text):
+            has_warranty = True
+
+        city = None
+        for name, pattern in await self._city_names():
+            if pattern.search(text):
+                city = name
+                break
+
+        return {"metric": metrics.pop(), "has_warranty": has_warranty, "city": city}, None
+
+    # ------ Query execution ------
+    async def _compute(self, base_random_key: str, metric: str,
+                       has_warranty: Optional[bool], city: Optional[str]) -> Optional[Number]:
+        if has_warranty is None and city is None:
+            stats = await get_offer_stats(base_random_key)
+            if stats is None:
+                return 0 if metric in COUNT_METRICS else None
+            return stats[metric]
+        if has_warranty is True and city is None and metric == "shop_count":
+            stats = await get_offer_stats(base_random_key)
+            return stats["warranty_shop_count"] if stats is not None else 0
+
+        sql = f"SELECT {METRIC_SQL[metric]} FROM member_total mt WHERE mt.base_random_key = %(base_random_key)s"
+        params = {"base_random_key": base_random_key}
+        if has_warranty is not None:
+            sql += " AND mt.has_warranty = %(has_warranty)s"
+            params["has_warranty"] = has_warranty
+        if city is not None:
+            sql += " AND mt.city = %(city)s"
+            params["city"] = city
+        async with connection() as conn:
+            cur = await conn.execute(sql, params)
+            return (await cur.fetchone())[0]
+
+    async def lookup(self, base_random_key: str, metric: str,
+                     has_warranty: Optional[bool] = None, city: Optional[str] = None) -> Optional[Number]:
+        key = (base_random_key, metric, has_warranty, city)
+        item = self._cache.get(key)
+        if item is not None and time.monotonic() - item[0] <= self.cache_ttl:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return item[1]
+        self.cache_misses += 1
+        value = await self._compute(base_random_key, metric, has_warranty, city)
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return value
+
+    # ------ Entry point ------
+    async def answer(self, question: str, candidates: Optional[list] = None) -> Optional[Number]:
+        """
+        Answer a NUMERIC_VALUE question, or return None to fall back to the LLM.
+        `candidates` are similarity_search results already computed for the question.
+        """
+        self.requests += 1
+        template, reason = await self.parse(question)
+        if template is None:
+            return self._fallback(reason)
+
+        if not candidates:
+            candidates = await similarity_search(preprocess_persian(question), top_k=5)
+        if not candidates or candidates[0][2] < self.min_similarity:
+            return self._fallback("product_not_resolved")
+        base_random_key = candidates[0][0]
+
+        value = await self.lookup(base_random_key, **template)
+        if value is None:
+            return self._fallback("no_value")
+        if isinstance(value, Decimal):
+            value = int(value) if value == value.to_integral_value() else float(value)
+        if isinstance(value, float):
+            value = round(value, 3)
+        self.answered += 1
+        print(f"[NUMERIC_ENGINE] {base_random_key} {template} -> {value}")
+        return value
+
+    def _fallback(self, reason: str) -> None:
+        self.fallbacks[reason] = self.fallbacks.get(reason, 0) + 1
+        print(f"[NUMERIC_ENGINE] Fallback to LLM: {reason}")
+        return None
+
+    def stats(self) -> dict:
+        lookups = self.cache_hits + self.cache_misses
+        n_fallbacks = sum(self.fallbacks.values())
+        return {
+            "requests": self.requests,
+            "answered": self.answered,
+            "fallbacks": dict(self.fallbacks),
+            "fallback_rate": round(n_fallbacks / self.requests, 4) if self.requests else 0.0,
+            "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+numeric_engine = NumericQueryEngine()
@@ -9,16 +9,23 @@ from pydantic_ai import Agent, ModelSettings, UsageLimits
 from pydantic_ai.models.openai import OpenAIChatModel
 from pydantic_ai.providers.openai import OpenAIProvider
 from prompt.prompts import *
-from sql.similarity_search_db import similarity_search, find_candidate_shops, similarity_search_cat, similarity_search_image
+from sql.hybrid_search import HYBRID_SEARCH
+from sql.name_index import name_index
+from sql.similarity_search_db import similarity_search, similarity_search_many, similarity_by_keys, find_candidate_shops, similarity_search_cat, similarity_search_image
 from sql.sql_utils import execute_sql, top_features_summary
 from sql.sql_utils import get_chat_history, get_base_id_and_index
 from utils.utils import preprocess_persian
 from sql.sql_utils import load_extra_info
-from utils.utils import extract_media_type_and_bytes
+from sql.offer_stats import get_product_offer_stats
+from agents.numeric_engine import numeric_engine
+from utils.image_ingest import IngestedImage, ingest_data_uri
+from utils.http_client import get_http_client, close_http_client
 from pydantic_core import to_jsonable_python
 from pydantic_ai.messages import ModelMessagesTypeAdapter  
 import json
+import asyncio
 from pathlib import Path
+from utils.timing import StageTimer
 
 history_folder = Path("./history")
 history_folder.mkdir(parents=True, exist_ok=True)
@@ -44,8 +51,14 @@ def load_history(path: str = "chat_history.json"):
 # Load environment
 # ------------------------
 load_dotenv()
-top_features = top_features_summary()
-print(top_features)
+_top_features: Optional[str] = None
+
+def get_top_features() -> str:
+    """Top feature keys for the conversation prompt, queried once when the agent is built."""
+    global _top_features
+    if _top_features is None:
+        _top_features = top_features_summary()
+    return _top_features
 
 API_KEY = os.getenv("API_KEY")
 BASE_URL = os.getenv("BASE_URL")
@@ -222,6 +235,7 @@ class TorobAgentBase:
         temperature: float = 0.0001,
         max_tokens: int = 1024,
         examples: Optional[List[str]] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
     ):
         self.examples = examples or []
 
@@ -230,7 +244,7 @@ class TorobAgentBase:
             provider=OpenAIProvider(
                 base_url=BASE_URL,
                 api_key=API_KEY,
-                http_client=httpx.AsyncClient()
+                http_client=http_client or get_http_client()
             ),
             settings=ModelSettings(temperature=temperature, max_tokens=max_tokens)
         )
@@ -256,10 +270,11 @@ class TorobAgentBase:
             input_text +=  "\n\n Here are some examples:\n\n" + "\n\n".join(selected_examples)
 
         if image_b64:
-            image_bytes, media_type = extract_media_type_and_bytes(image_b64)
+            # Downscaled JPEG from the shared ingestion stage instead of the full upload
+            image = image_b64 if isinstance(image_b64, IngestedImage) else await asyncio.to_thread(ingest_data_uri, image_b64)
             user_message = [
                 input_text,
-                BinaryContent(data=image_bytes, media_type=media_type),
+                BinaryContent(data=image.llm_bytes, media_type=image.llm_media_type),
             ]
         else:
             user_message = input_text
@@ -338,11 +353,11 @@ class TorobCompareAgent(TorobAgentBase):
                 + ADDITIONAL_NOTES
                 + "\nYou have access to the following tools:"
                 + "\n"
-                + similarity_search_tool + "\n" + execute_query_tool
+                + similarity_search_tool + "\n" + similarity_search_many_tool + "\n" + execute_query_tool
                 + "\nBelow is structure of data in database:"
                 + schema_prompt
             ),
-            tools=[similarity_search, execute_sql],
+            tools=[similarity_search, similarity_search_many, execute_sql],
             output_type=CompareResponse,
         )
 
@@ -389,11 +404,11 @@ class TorobInfoAgent(TorobAgentBase):
                 + SQL_NOTES
                 + "\nYou have access to the following tools:"
                 + "\n"
-                + similarity_search_tool + "\n" + execute_query_tool
+                + similarity_search_tool + "\n" + offer_stats_tool + "\n" + execute_query_tool
                 + "\nBelow is structure of data in database:"
                 + schema_prompt
             ),
-            tools=[similarity_search, execute_sql],
+            tools=[similarity_search, get_product_offer_stats, execute_sql],
             output_type=NumericResponse,
         )
 
@@ -414,7 +429,7 @@ class TorobConversationAgent(TorobAgentBase):
                 + schema_prompt 
                 + "\n"
                 + extra_features_sys
-                + "\n" + top_features
+                + "\n" + get_top_features()
             ),
             tools=[find_candidate_shops],
             output_type=ConversationResponse,
@@ -460,11 +475,13 @@ class TorobImageSearchAgent(TorobAgentBase):
                 image_search_system_prompt
                 + "\nYou have access to the following tools:"
                 + "\n" + similarity_search_tool
+                + "\n" + similarity_search_many_tool
                 + "\n" + execute_query_tool
             ),
             output_type=ImageResponseSearch,
             tools=[similarity_search_image, 
-                   similarity_search],
+                   similarity_search,
+                   similarity_search_many],
         )
 
 
@@ -511,29 +528,67 @@ class TorobScenarioAgent(TorobAgentBase):
 
     def __init__(self, scenario: str, examples: Optional[List[str]] = None):
         scenario_upper = scenario.upper()
+        if scenario_upper not in self.ALLOWED_SCENARIOS:
+            raise ValueError(f"Unknown scenario: {scenario}")
 
-        # Map scenario to the corresponding agent class
-        if scenario_upper == "PRODUCT_FEATURE":
-            agent = TorobFeatureAgent()
-        elif scenario_upper == "PRODUCTS_COMPARE":
-            agent = TorobCompareAgent()
-        elif scenario_upper == "PRODUCT_SEARCH":
-            agent = TorobProductSearchAgent()
-        elif scenario_upper == "NUMERIC_VALUE":
-            agent = TorobInfoAgent()
-        elif scenario_upper == "CONVERSATION":
-            agent = TorobConversationAgent()
-        elif scenario_upper == "IMAGE_TOPIC":
-            agent = TorobImageClassifierAgent()
-        elif scenario_upper == "IMAGE_SEARCH":
-            agent = TorobImageSearchAgent()
-        elif scenario_upper == "IMAGE_ALL":
-            agent = TorobImageAllAgent()
+        # Reuse the agent built once by the registry
+        agent = agent_registry.get(scenario_upper)
 
         # Copy attributes from the selected agent
         self.__dict__.update(agent.__dict__)
         self.examples = examples or []
 
+
+# ------------------------
+# Agent Registry
+# ------------------------
+class TorobAgentRegistry:
+    """
+    Process-wide cache of Torob agents.
+
+    Each agent (model, provider, pydantic-ai Agent and its system prompt) is
+    built once and reused by every request; all of them share the HTTP client
+    from `get_http_client()`.
+    """
+
+    AGENT_CLASSES = {
+        "CLASSIFIER": TorobClassifierAgent,
+        "IMAGE_TASK_CLASSIFIER": TorobImageTaskClassifierAgent,
+        "PRODUCT_FEATURE": TorobFeatureAgent,
+        "PRODUCTS_COMPARE": TorobCompareAgent,
+        "PRODUCT_SEARCH": TorobProductSearchAgent,
+        "NUMERIC_VALUE": TorobInfoAgent,
+        "CONVERSATION": TorobConversationAgent,
+        "IMAGE_TOPIC": TorobImageClassifierAgent,
+        "IMAGE_SEARCH": TorobImageSearchAgent,
+        "IMAGE_ALL": TorobImageAllAgent,
+    }
+
+    def __init__(self):
+        self._agents: Dict[str, TorobAgentBase] = {}
+
+    def build(self):
+        """Build every agent up front (called from the app lifespan)."""
+        for name in self.AGENT_CLASSES:
+            self.get(name)
+        print(f"[AGENTS] Registry built: {', '.join(self._agents)}")
+
+    def get(self, name: str) -> TorobAgentBase:
+        name = name.upper()
+        agent = self._agents.get(name)
+        if agent is None:
+            agent = self.AGENT_CLASSES[name]()
+            self._agents[name] = agent
+        return agent
+
+    async def aclose(self):
+        """Drop the cached agents and close the shared HTTP client."""
+        self._agents.clear()
+        await close_http_client()
+
+
+agent_registry = TorobAgentRegistry()
+
 # ------------------------
 # Torob Hybrid Agent
 # ------------------------
@@ -546,8 +601,8 @@ class TorobHybridAgent(TorobAgentBase):
             system_prompt="Dummy prompt for hybrid agent",
         )
 
-        # Initialize specialized agents
-        self.image_agent_classifier = TorobImageTaskClassifierAgent()
+        # Specialized agents come from the shared registry
+        self.image_agent_classifier = agent_registry.get("IMAGE_TASK_CLASSIFIER")
 
     async def run(self, input_dict: dict, usage_limits: Optional[Any] = None, 
                   use_initial_similarity_search: bool = True):
@@ -570,6 +625,8 @@ class TorobHybridAgent(TorobAgentBase):
 
             # --- Step 1: Handle image request ---
             if user_image:
+                # Decode once; the CLIP search and the image LLM call share the result
+                user_image = await asyncio.to_thread(ingest_data_uri, user_image)
                 # result, scenario_label = await self.image_agent_classifier.run(
                 #     input_text=instruction,
                 #     # image_b64=user_image,
@@ -581,7 +638,7 @@ class TorobHybridAgent(TorobAgentBase):
                 scenario_label = "IMAGE_ALL"
 
                 # Top similar products -> w.r.t image
-                search_res = similarity_search_image(user_image, top_k = 5)
+                search_res = await similarity_search_image(user_image, top_k = 5)
                 rks = [res[0] for res in search_res]
                 persian_names = [res[1] for res in search_res]
                 cats = [res[2] for res in search_res]
@@ -601,7 +658,7 @@ class TorobHybridAgent(TorobAgentBase):
 
                 full_instruction = similarity_top5 + "\n\n" + instruction
 
-                scenario_agent = TorobScenarioAgent(scenario_label)
+                scenario_agent = agent_registry.get(scenario_label)
                 result, agent_response = await scenario_agent.run(input_text= full_instruction,
                                                                 image_b64 = user_image,
                                                                 usage_limits=usage_limits, 
@@ -611,19 +668,36 @@ class TorobHybridAgent(TorobAgentBase):
                 return result, output_dict
 
             chat_id = input_dict["chat_id"]
-            base_id, chat_index = get_base_id_and_index(chat_id)   # your existing function
-            history = get_chat_history(base_id)[-4:]
+            timer = StageTimer()
+            preprocessed_instruction = preprocess_persian(instruction)
+
+            # --- Stage 1: session lookup (everything below depends on base_id) ---
+            base_id, chat_index = await timer.run("session", get_base_id_and_index(chat_id))
             info_chat_index = max(1,chat_index-1)
-            extra_info = load_extra_info(base_id, info_chat_index)
+            # Only a new session (no history yet) goes through the classifier;
+            # follow-up turns are always CONVERSATION and skip the initial search.
+            is_new_session = chat_index == 1
+            run_initial_search = use_initial_similarity_search and is_new_session
+
+            # --- Stage 2: history, extra info, classification and initial search run concurrently ---
+            classifier_task = search_task = None
+            async with asyncio.TaskGroup() as tg:
+                history_task = tg.create_task(timer.run("history", get_chat_history(base_id)))
+                extra_info_task = tg.create_task(timer.run("extra_info", load_extra_info(base_id, info_chat_index)))
+                if is_new_session:
+                    classifier_task = tg.create_task(timer.run("classifier", self._classify(instruction, usage_limits)))
+                if run_initial_search:
+                    search_task = tg.create_task(timer.run("similarity_search", self._initial_similarity_search(preprocessed_instruction)))
+            history = history_task.result()[-4:]
+            extra_info = extra_info_task.result()
 
             # # --- Step 2: Determine scenario ---
-            if not history:
-                classifier_agent = TorobClassifierAgent()
-                _, class_out = await classifier_agent.run(instruction, usage_limits=usage_limits)
-                scenario_label = class_out.classification
+            if classifier_task is not None:
+                scenario_label = classifier_task.result()
                 print(scenario_label)
             else:
                 scenario_label = 'CONVERSATION'
+            if history:
                 history_text = "\n".join(
                     [f"Input No.({(i+1)}): {h['message']}\nResponse No.({(i+1)}): {h['response']}" for i,h in enumerate(history)]
                 )
@@ -641,24 +715,31 @@ class TorobHybridAgent(TorobAgentBase):
                 extra_info_text = "\n".join([f"{k} = {v}" for k,v in  extra_info.items()])
                 prompt += f"Turn ({info_chat_index}) Parameters:" + "\n\n"  + extra_info_text + "\n\n"
 
-            scenario_agent = TorobScenarioAgent(scenario_label)
-            # Step 1: preprocess input
-            preprocessed_instruction = preprocess_persian(instruction)
+            scenario_agent = agent_registry.get(scenario_label)
+
+            # Initial similarity search ran speculatively; drop it for CONVERSATION
+            candidates = []
+            if search_task is not None and scenario_label not in ['CONVERSATION']:
+                candidates = search_task.result()
+
+            # NUMERIC_VALUE: try the deterministic template engine before the LLM
+            if scenario_label == 'NUMERIC_VALUE':
+                value = await timer.run("numeric_engine", numeric_engine.answer(preprocessed_instruction, candidates))
+                if value is not None:
+                    output_dict = normalize_to_shopping_response(NumericResponse(value=value))
+                    output_dict["base_id"] = base_id
+                    output_dict["chat_index"] = chat_index
+                    output_dict["timings"] = timer.summary()
+                    print("[TIMINGS]", output_dict["timings"])
+                    return None, output_dict
 
-            # Step 2: optionally run similarity search
             similarity_text = ""
-            if use_initial_similarity_search and (scenario_label not in ['CONVERSATION']):
-                try:
-                    candidates = similarity_search(preprocessed_instruction, top_k=5, probes=20)
-                    if candidates[0][-1] > 0.7:
-                        # candidates is expected to be list[tuple[str, str, float]]
-                        rows = []
-                        for rk, name, score in candidates:
-                            rows.append(f"{rk} -> {name} -> similarity: {score:.4f}")
-                        similarity_text = "\n".join(rows)
-                        print("Similarity search results:\n", similarity_text)
-                except Exception as e:
-                    print(f"Similarity search failed: {e}")
+            if candidates and candidates[0][-1] > 0.7:
+                # candidates is expected to be list[tuple[str, str, float]]
+                similarity_text = "\n".join(
+                    f"{rk} -> {name} -> similarity: {score:.4f}" for rk, name, score in candidates
+                )
+                print("Similarity search results:\n", similarity_text)
             if similarity_text:  
                 # Add initial similarity optionally
                 prompt += "\n\nInitial Similarity Search Candidates:\n" + similarity_text
@@ -668,17 +749,24 @@ class TorobHybridAgent(TorobAgentBase):
             prompt_prefix = f"Input ({chat_index}): " if scenario_label in ['CONVERSATION'] else "Input: "
             prompt += prompt_prefix + preprocessed_instruction
             # --- Step 3: Run the chosen scenario agent ---
-            result, agent_response = await scenario_agent.run(prompt, 
+            result, agent_response = await timer.run("scenario_agent", scenario_agent.run(prompt, 
                                                               usage_limits=usage_limits, 
                                                               few_shot=few_shot,
                                                             #   message_history= message_history
-                                                              )
+                                                              ))
             # if scenario_label in ['CONVERSATION']:
             #     current_messages = result.new_messages()
             #     print(current_messages)
             #     save_history(current_messages, local_path)
             # --- Step 4: Normalize output ---
             output_dict = normalize_to_shopping_response(agent_response)
+            # Session info, so the caller can persist the turn without looking it up again
+            output_dict["base_id"] = base_id
+            output_dict["chat_index"] = chat_index
+            # Per-stage timings and LLM usage; kept in the logged output, dropped from the API response
+            output_dict["timings"] = timer.summary()
+            output_dict["usage"] = agent_usage(result)
+            print("[TIMINGS]", output_dict["timings"], "[USAGE]", output_dict["usage"])
             return result, output_dict
 
         except Exception as e:
@@ -690,6 +778,40 @@ class TorobHybridAgent(TorobAgentBase):
             )
             return None, dict(error_response)
 
+    async def _classify(self, instruction: str, usage_limits: Optional[Any] = None) -> str:
+        classifier_agent = agent_registry.get("CLASSIFIER")
+        _, class_out = await classifier_agent.run(instruction, usage_limits=usage_limits)
+        return class_out.classification
+
+    async def _initial_similarity_search(self, preprocessed_instruction: str) -> list:
+        """Return the initial similarity_search candidates ([] on failure)."""
+        # A pasted product title is matched in memory, without the vector search
+        try:
+            match = name_index.match(preprocessed_instruction)
+            if match:
+                matches, exact = match
+                print("[NAME_INDEX] Matched:", matches[0], "exact" if exact else "trigram")
+                if exact:
+                    return matches
+                # Trigram scores are not cosine similarities: rescore the candidates before
+                # they reach the similarity thresholds of the prompts and the numeric engine
+                rescored = await similarity_by_keys(preprocessed_instruction, [row[0] for row in matches])
+                if rescored:
+                    return rescored
+            return await similarity_search(preprocessed_instruction, top_k=5)
+        except Exception as e:
+            print(f"Similarity search failed: {e}")
+            return []
+
+def agent_usage(result) -> dict:
+    """LLM requests and tool calls of one agent run, plus the retrieval mode it used."""
+    usage = result.usage()
+    return {
+        "requests": usage.requests,
+        "tool_calls": getattr(usage, "tool_calls", None),
+        "retrieval": "hybrid" if HYBRID_SEARCH else "vector",
+    }
+
 def normalize_to_shopping_response(output_obj: BaseModel) -> ShoppingResponse:
     """
     Converts any scenario agent output to a ShoppingResponse.
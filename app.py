@@ -7,9 +7,23 @@ from fastapi import FastAPI, HTTPException
 from fastapi import Request
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from sql.similarity_search_db import similarity_search, similarity_search_image
+from sql.similarity_search_db import similarity_search, similarity_search_image, embedding_batcher, search_stats
 from sql.sql_utils import init_logs_table, insert_log, insert_chat, get_latest_chat_history, create_member_total_view
-from agents.torob_agents import TorobHybridAgent
+from sql.db_pool import init_pool, close_pool, pool_stats
+from sql.write_queue import chat_writer
+from sql.embedding_cache import init_embedding_cache_table, embedding_cache
+from sql.member_total_maintenance import refresh_loop, MEMBER_TOTAL_REFRESH_INTERVAL
+from sql.shop_planner import planner_stats
+from sql.local_index import local_product_index
+from sql.category_index import category_index
+from sql.hybrid_search import hybrid_search_stats
+from sql.name_index import name_index
+from sql.category_partitions import load_partitions, partition_stats, PARTITIONED_SEARCH
+from sql.clip_provider import clip_provider, clip_batcher, CLIP_WARMUP
+from utils.image_ingest import image_ingest_stats
+from sql.image_cache import image_cache
+from agents.numeric_engine import numeric_engine
+from agents.torob_agents import TorobHybridAgent, agent_registry
 from pydantic_ai import UsageLimits
 
 # Load environment variables
@@ -22,15 +36,41 @@ MODEL_NAME = "gpt-4.1-mini"
 # create_member_total_view()
 
 # ------ Lifespan Context ------
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    init_logs_table()
+    await init_pool()
+    await init_logs_table()
+    await init_embedding_cache_table()
+    await embedding_cache.preload()
+    chat_writer.start()
+    agent_registry.build()
+    local_product_index.maybe_reload(force=True)
+    await category_index.load()
+    await name_index.load()
+    if PARTITIONED_SEARCH:
+        await load_partitions()
+    if CLIP_WARMUP:
+        # Load CLIP and run one forward pass before serving, off the event loop
+        await asyncio.to_thread(clip_provider.warm_up)
+    refresh_task = None
+    if MEMBER_TOTAL_REFRESH_INTERVAL > 0:
+        refresh_task = asyncio.create_task(refresh_loop(MEMBER_TOTAL_REFRESH_INTERVAL))
     yield
-    # Shutdown (if needed)
-    # e.g., close connections
+    # Shutdown: drain buffered chats/logs before closing the pool
+    if refresh_task is not None:
+        # Wait for the refresh loop to let go of its connection before the pool closes
+        refresh_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await refresh_task
+    await asyncio.to_thread(clip_batcher.close)
+    await chat_writer.stop()
+    await embedding_cache.drain()
+    await close_pool()
+    await agent_registry.aclose()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -56,7 +96,29 @@ usage_limits = UsageLimits(request_limit=30, tool_calls_limit=30, output_tokens_
 
 myagent = TorobHybridAgent()
 
-# ------ Endpoint ------
+# ------ Endpoints ------
+@app.get("/stats")
+async def stats():
+    """Runtime counters of the caches, queues and engines."""
+    return {
+        "db_pool": pool_stats(),
+        "write_queue": chat_writer.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "embedding_batcher": embedding_batcher.stats(),
+        "candidate_planner": dict(planner_stats),
+        "similarity_search": search_stats(),
+        "local_index": local_product_index.stats(),
+        "category_index": category_index.stats(),
+        "hybrid_search": hybrid_search_stats(),
+        "name_index": name_index.stats(),
+        "partitions": dict(partition_stats),
+        "clip": clip_provider.stats(),
+        "clip_batcher": clip_batcher.stats(),
+        "image_ingest": image_ingest_stats(),
+        "image_cache": image_cache.stats(),
+        "numeric_engine": numeric_engine.stats(),
+    }
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(req: ChatRequest):
     try:
@@ -70,7 +132,7 @@ async def chat(req: ChatRequest):
 
         # Similarity Search DB
         if input_dict['chat_id'] == 'retrieve_similar':
-            results = similarity_search(content, top_k = 5, probes=10)
+            results = await similarity_search(content, top_k = 5)
             rks = [res[0] for res in results]
             names = [res[1] for res in results]
             similarities = [f"{res[2]:.4f}" for res in results]
@@ -88,7 +150,7 @@ async def chat(req: ChatRequest):
         #     return resp
         # Return chat logs
         if input_dict['chat_id'] == 'check_chat_log':
-            resp = get_latest_chat_history(content)
+            resp = await get_latest_chat_history(content)
             return ChatResponse(message = str(resp))
 
         # very small defensive check
@@ -130,9 +192,12 @@ async def chat(req: ChatRequest):
                                                 use_initial_similarity_search=True)
         print("[OUTPUT]", output_dict)
         extra_info = output_dict.pop("extra_info", None)  # remove from output_dict
-        insert_chat(input_dict, output_dict, extra_info=extra_info)
+        base_id = output_dict.pop("base_id", None)
+        chat_index = output_dict.pop("chat_index", None)
+        await insert_chat(input_dict, output_dict, extra_info=extra_info,
+                          base_id=base_id, chat_index=chat_index)
         # print(result.all_messages())
-        insert_log(input_dict, output_dict)
+        await insert_log(input_dict, output_dict)
         # Remove `finished` from the output dict before returning
         output_dict.pop("finished", None)
         return output_dict
@@ -0,0 +1,95 @@
+# bench_candidate_shops.py
+"""
+Compare the filter_first and ann_first strategies of find_candidate_shops
+across filter combinations, and show which one the planner picks.
+
+Usage:
+    python benchmarks/bench_candidate_shops.py --repeat 5 --top-k 5
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import argparse
+import asyncio
+import statistics
+from time import perf_counter
+import pandas as pd
+from sql.db_pool import init_pool, close_pool
+from sql.similarity_search_db import search_candidate_shops
+
+QUERIES = [
+    "گوشی موبایل سامسونگ",
+    "یخچال فریزر",
+    "کفش ورزشی مردانه",
+    "لپ تاپ ایسوس",
+    "فرش ماشینی ۷۰۰ شانه",
+]
+
+FILTER_SETS = {
+    "none": {},
+    "price_band": {"price_min": 1_000_000, "price_max": 20_000_000},
+    "warranty": {"has_warranty": True},
+    "city": {"city": "تهران"},
+    "city+warranty+score": {"city": "تهران", "has_warranty": True, "score": 4},
+    "brand": {"brand_title": "سامسونگ"},
+    "feature": {"feature_keys": ["رنگ"], "feature_values": ["مشکی"]},
+}
+
+
+async def timed(query, top_k, strategy, filters):
+    t0 = perf_counter()
+    results, plan_info = await search_candidate_shops(query, top_k=top_k, strategy=strategy, **filters)
+    return (perf_counter() - t0) * 1000, results, plan_info
+
+
+async def main(repeat: int, top_k: int):
+    await init_pool()
+    rows = []
+    try:
+        for filter_name, filters in FILTER_SETS.items():
+            for query in QUERIES:
+                # Warm the embedding cache so only the SQL is measured
+                await search_candidate_shops(query, top_k=top_k, strategy="filter_first", **filters)
+
+                latencies = {}
+                keys = {}
+                for strategy in ("filter_first", "ann_first"):
+                    samples = []
+                    for _ in range(repeat):
+                        ms, results, plan_info = await timed(query, top_k, strategy, filters)
+                        samples.append(ms)
+                    latencies[strategy] = statistics.median(samples)
+                    keys[strategy] = {r["member_random_key"] for r in results}
+                    if strategy == "ann_first":
+                        ann_limit, ann_effective = plan_info["ann_limit"], plan_info["strategy"]
+
+                _, _, auto_plan = await timed(query, top_k, None, filters)
+                overlap = len(keys["filter_first"] & keys["ann_first"]) / max(1, len(keys["filter_first"]))
+                rows.append({
+                    "filters": filter_name,
+                    "query": query,
+                    "est_rows": auto_plan["estimated_rows"],
+                    "planner": auto_plan["strategy"],
+                    "filter_first_ms": round(latencies["filter_first"], 1),
+                    "ann_first_ms": round(latencies["ann_first"], 1),
+                    "ann_limit": ann_limit,
+                    "ann_fell_back": ann_effective != "ann_first",
+                    "overlap": round(overlap, 2),
+                })
+    finally:
+        await close_pool()
+
+    df = pd.DataFrame(rows)
+    pd.set_option("display.width", 200)
+    print(df.to_string(index=False))
+    print("\nMedian latency per filter set (ms):")
+    print(df.groupby("filters")[["filter_first_ms", "ann_first_ms"]].median().to_string())
+    faster = (df["filter_first_ms"] < df["ann_first_ms"]).map({True: "filter_first", False: "ann_first"})
+    print(f"\nPlanner picked the faster strategy in {(faster == df['planner']).mean():.0%} of cases")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.repeat, args.top_k))
@@ -0,0 +1,83 @@
+# bench_clip_backends.py
+"""
+CPU throughput and memory of the CLIP image encoder backends.
+
+Each backend runs in a fresh interpreter (so peak RSS is its own): the model
+is loaded and warmed up, then `--repeat` batches of every batch size are
+embedded. Reports load time, ms per batch, images/s and peak RSS. Run
+`python -m sql.clip_export export [--int8]` first for the onnx backend and
+`python -m sql.clip_export parity --backend <name>` for accuracy.
+
+Usage:
+    python benchmarks/bench_clip_backends.py [--backends torch torch_int8 onnx] [--batch-sizes 1 8]
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import json
+import argparse
+import subprocess
+import pandas as pd
+from sql.clip_provider import CLIP_BACKENDS, CLIP_ONNX_PATH
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+BACKEND_PROBE = """
+import json, resource, statistics
+from time import perf_counter
+from PIL import Image
+from sql.clip_provider import ClipProvider
+provider = ClipProvider(backend={backend!r}, onnx_path={onnx_path!r})
+t0 = perf_counter()
+provider.warm_up()
+load_s = perf_counter() - t0
+images = [Image.new("RGB", (640, 480), (i * 37 % 256, i * 91 % 256, i * 13 % 256)) for i in range(max({batch_sizes}))]
+rows = []
+for batch_size in {batch_sizes}:
+    samples = []
+    for _ in range({repeat}):
+        t0 = perf_counter()
+        provider.embed_images(images[:batch_size])
+        samples.append(perf_counter() - t0)
+    ms = statistics.median(samples) * 1000
+    rows.append({{"batch_size": batch_size, "batch_ms": ms, "images_per_s": batch_size / ms * 1000}})
+print("@@" + json.dumps({{"load_s": load_s, "rows": rows,
+                          "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+"""
+
+
+def run_backend(backend: str, batch_sizes: list, repeat: int, onnx_path: str) -> dict:
+    code = BACKEND_PROBE.format(backend=backend, onnx_path=onnx_path, batch_sizes=batch_sizes, repeat=repeat)
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("@@")]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "probe failed")
+    return json.loads(lines[-1][2:])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", choices=CLIP_BACKENDS, default=list(CLIP_BACKENDS))
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--onnx-path", default=CLIP_ONNX_PATH)
+    args = parser.parse_args()
+
+    rows = []
+    for backend in args.backends:
+        try:
+            result = run_backend(backend, args.batch_sizes, args.repeat, args.onnx_path)
+        except RuntimeError as e:
+            print(f"{backend}: {e}")
+            continue
+        for row in result["rows"]:
+            rows.append({
+                "backend": backend,
+                "load_s": round(result["load_s"], 2),
+                "batch_size": row["batch_size"],
+                "batch_ms": round(row["batch_ms"], 1),
+                "images_per_s": round(row["images_per_s"], 1),
+                "rss_mb": round(result["rss_mb"], 1),
+            })
+
+    pd.set_option("display.width", 200)
+    print(pd.DataFrame(rows).to_string(index=False))
@@ -0,0 +1,141 @@
+# bench_compact_embeddings.py
+"""
+Compare the full-precision product_embed index with the compact indexes
+(halfvec / truncated / binary + NumPy rerank): index size, build time,
+memory, recall@k against exact search and p50/p99 latency.
+
+"Memory" is the index size (what must stay in shared_buffers / page cache
+for the index to be fast) plus the rerank working set per query
+(candidates x 1536 float32).
+
+Usage:
+    python benchmarks/bench_compact_embeddings.py --mode halfvec --mode binary
+    python benchmarks/bench_compact_embeddings.py --build --candidates 100 200 400
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import argparse
+import asyncio
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import psycopg
+from sql.db_pool import DB_CONFIG, init_pool, close_pool, connection
+from sql.similarity_search_db import get_embedding
+from sql.vector_index import VECTOR_INDEX_TYPE, apply_search_settings, build_vector_index, vector_index_status
+from sql.compact_embeddings import (
+    COMPACT_MODES, EMBEDDING_DIM, build_compact_index, compact_index_name, compact_search,
+)
+from benchmarks.bench_vector_index import QUERIES
+
+FULL_SQL = """
+    SELECT random_key
+    FROM product_embed
+    ORDER BY embedding <=> %(query_vector)b
+    LIMIT %(top_k)s
+"""
+
+
+def index_size(name: str) -> int:
+    with psycopg.connect(**DB_CONFIG) as conn:
+        row = conn.execute("SELECT pg_relation_size(to_regclass(%s))", (name,)).fetchone()
+    return row[0] or 0
+
+
+async def timed(fn, repeat: int):
+    await fn()  # warm-up
+    latencies, keys = [], None
+    for _ in range(repeat):
+        t0 = perf_counter()
+        keys = await fn()
+        latencies.append((perf_counter() - t0) * 1000)
+    return keys, latencies
+
+
+async def run_full(vector, top_k: int, exact: bool = False):
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            if exact:
+                await cur.execute("SET LOCAL enable_indexscan = off")
+            else:
+                await apply_search_settings(cur)
+            await cur.execute(FULL_SQL, {"query_vector": vector, "top_k": top_k})
+            return [row[0] for row in await cur.fetchall()]
+
+
+async def run_compact(vector, top_k: int, mode: str, candidates: int):
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            rows = await compact_search(cur, vector, top_k, mode=mode, candidates=candidates)
+    return [row[0] for row in rows]
+
+
+def summarize(name, truth, results, latencies, size, build_s, rerank_bytes, top_k):
+    recall = np.mean([len(t & set(r)) / max(1, len(t)) for t, r in zip(truth, results)])
+    return {
+        "variant": name,
+        "index_mb": round(size / 2**20, 1),
+        "build_s": build_s,
+        "rerank_kb": round(rerank_bytes / 1024, 1),
+        f"recall@{top_k}": round(float(recall), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+    }
+
+
+async def main(modes, top_k: int, repeat: int, candidates_list, build: bool):
+    index_type = VECTOR_INDEX_TYPE
+    build_times = {}
+    if build:
+        build_times["full"] = build_vector_index("product_embed", index_type, concurrently=False,
+                                                 drop_other=False)["build_seconds"]
+        for mode in modes:
+            build_times[mode] = build_compact_index(mode, index_type, concurrently=False)["build_seconds"]
+
+    full_index = next((row["index"] for row in vector_index_status(["product_embed"])), None)
+    await init_pool()
+    rows = []
+    try:
+        vectors = [await get_embedding(q) for q in QUERIES]
+        truth = [set(await run_full(v, top_k, exact=True)) for v in vectors]
+
+        results, latencies = [], []
+        for v in vectors:
+            keys, ms = await timed(lambda: run_full(v, top_k), repeat)
+            results.append(keys)
+            latencies += ms
+        rows.append(summarize(f"full ({index_type})", truth, results, latencies,
+                              index_size(full_index) if full_index else 0, build_times.get("full"), 0, top_k))
+
+        for mode in modes:
+            size = index_size(compact_index_name(mode, index_type))
+            if not size:
+                print(f"[SKIP] {mode}: no compact index (run with --build)")
+                continue
+            for candidates in candidates_list:
+                results, latencies = [], []
+                for v in vectors:
+                    keys, ms = await timed(lambda: run_compact(v, top_k, mode, candidates), repeat)
+                    results.append(keys)
+                    latencies += ms
+                rows.append(summarize(f"{mode} x{candidates}", truth, results, latencies, size,
+                                      build_times.get(mode), candidates * EMBEDDING_DIM * 4, top_k))
+    finally:
+        await close_pool()
+
+    df = pd.DataFrame(rows)
+    pd.set_option("display.width", 200)
+    print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=COMPACT_MODES, action="append",
+                        help="Compact mode to compare (repeatable, default: all)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[100, 200, 400])
+    parser.add_argument("--build", action="store_true",
+                        help="Build missing indexes first and report their build time (blocking builds)")
+    args = parser.parse_args()
+    asyncio.run(main(args.mode or list(COMPACT_MODES), args.top_k, args.repeat, args.candidates, args.build))
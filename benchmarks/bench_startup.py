@@ -0,0 +1,126 @@
+# bench_startup.py
+"""
+Startup cost of the service modules and first-request latency of the image path.
+
+Every measurement runs in a fresh interpreter, so import caches of one step do
+not hide the cost of the next. For each module it reports the import time,
+peak RSS and whether torch was imported; for CLIP it compares the first image
+embedding without warm-up (load + first forward pass on the request) with the
+same request after `clip_provider.warm_up()`.
+
+Usage:
+    python benchmarks/bench_startup.py [--image photo.jpg] [--repeat 3]
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import json
+import base64
+import argparse
+import statistics
+import subprocess
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+MODULES = [
+    "sql.similarity_search_db",
+    "agents.torob_agents",
+    "app",
+]
+
+IMPORT_PROBE = """
+import json, sys, resource
+from time import perf_counter
+t0 = perf_counter()
+import {module}
+seconds = perf_counter() - t0
+print("@@" + json.dumps({{
+    "seconds": seconds,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "torch": "torch" in sys.modules,
+}}))
+"""
+
+CLIP_PROBE = """
+import json, sys
+from time import perf_counter
+from sql.clip_provider import clip_provider
+data_uri = sys.stdin.read()
+warm_up_s = 0.0
+if {warm}:
+    t0 = perf_counter()
+    clip_provider.warm_up()
+    warm_up_s = perf_counter() - t0
+t0 = perf_counter()
+clip_provider.embed_base64_image(data_uri)
+first = perf_counter() - t0
+t0 = perf_counter()
+clip_provider.embed_base64_image(data_uri)
+print("@@" + json.dumps({{"warm_up_s": warm_up_s, "first_ms": first * 1000,
+                          "second_ms": (perf_counter() - t0) * 1000}}))
+"""
+
+
+def run_probe(code: str, stdin: str = "") -> dict:
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, input=stdin,
+                          capture_output=True, text=True)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith("@@")]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "probe failed")
+    return json.loads(lines[-1][2:])
+
+
+def image_data_uri(path: str) -> str:
+    if path:
+        with open(path, "rb") as f:
+            return "data:image/jpeg;base64," + base64.b64encode(f.read()).decode()
+    from io import BytesIO
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", (640, 480), (200, 80, 40)).save(buffer, format="JPEG")
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def bench_imports(repeat: int) -> pd.DataFrame:
+    rows = []
+    for module in MODULES:
+        try:
+            samples = [run_probe(IMPORT_PROBE.format(module=module)) for _ in range(repeat)]
+        except RuntimeError as e:
+            rows.append({"module": module, "error": str(e)})
+            continue
+        rows.append({
+            "module": module,
+            "import_s": round(statistics.median(s["seconds"] for s in samples), 2),
+            "rss_mb": round(max(s["rss_mb"] for s in samples), 1),
+            "torch_imported": samples[0]["torch"],
+        })
+    return pd.DataFrame(rows)
+
+
+def bench_clip(data_uri: str, repeat: int) -> pd.DataFrame:
+    rows = []
+    for warm in (False, True):
+        samples = [run_probe(CLIP_PROBE.format(warm=warm), stdin=data_uri) for _ in range(repeat)]
+        rows.append({
+            "warm_up": warm,
+            "warm_up_s": round(statistics.median(s["warm_up_s"] for s in samples), 2),
+            "first_request_ms": round(statistics.median(s["first_ms"] for s in samples), 1),
+            "second_request_ms": round(statistics.median(s["second_ms"] for s in samples), 1),
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", default="", help="Image file for the CLIP requests (default: generated)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-clip", action="store_true")
+    args = parser.parse_args()
+
+    pd.set_option("display.width", 200)
+    print("Import cost (fresh interpreter per sample):")
+    print(bench_imports(args.repeat).to_string(index=False))
+    if not args.skip_clip:
+        print("\nFirst image request latency:")
+        print(bench_clip(image_data_uri(args.image), args.repeat).to_string(index=False))
@@ -0,0 +1,135 @@
+# bench_vector_index.py
+"""
+Recall@k and latency of the ANN index on the embedding tables, swept over
+`ivfflat.probes` / `hnsw.ef_search`.
+
+Ground truth is an exact search (index scans disabled). The query set is
+fixed: QUERIES for the text tables, and a REPEATABLE sample of stored vectors
+for image_embedding. Only the SQL is timed.
+
+Build the index type to test first, e.g.
+    python -m sql.vector_index build --type hnsw
+
+Usage:
+    python benchmarks/bench_vector_index.py --top-k 5 --repeat 5
+    python benchmarks/bench_vector_index.py --table product_embed --ef-search 20 40 80 160
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import argparse
+import asyncio
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from sql.db_pool import init_pool, close_pool, connection
+from sql.similarity_search_db import get_embedding
+from sql.vector_adapter import as_vector
+from sql.vector_index import VECTOR_TABLES, apply_search_settings, vector_index_status
+
+QUERIES = [
+    "گوشی موبایل سامسونگ",
+    "یخچال فریزر",
+    "کفش ورزشی مردانه",
+    "لپ تاپ ایسوس",
+    "فرش ماشینی ۷۰۰ شانه",
+    "هدفون بی سیم",
+    "ماشین لباسشویی ال جی",
+    "کتاب داستان کودک",
+    "ساعت هوشمند",
+    "میز تحریر چوبی",
+]
+IMAGE_SAMPLE_SIZE = 20
+
+KEY_COLUMNS = {
+    "product_embed": "random_key",
+    "image_embedding": "random_key",
+    "categories": "title",
+}
+
+
+async def query_vectors(table: str) -> list:
+    if table != "image_embedding":
+        return [await get_embedding(q) for q in QUERIES]
+    async with connection() as conn:
+        cur = await conn.execute(
+            "SELECT embedding FROM image_embedding TABLESAMPLE SYSTEM (1) REPEATABLE (42) "
+            "WHERE embedding IS NOT NULL LIMIT %s",
+            (IMAGE_SAMPLE_SIZE,), binary=True,
+        )
+        return [as_vector(row[0]) for row in await cur.fetchall()]
+
+
+async def search(table: str, vector, top_k: int, exact: bool = False, probes=None, ef_search=None):
+    sql = f"""
+        SELECT {KEY_COLUMNS[table]}
+        FROM {table}
+        ORDER BY {VECTOR_TABLES[table]} <=> %(query_vector)b
+        LIMIT %(top_k)s
+    """
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            if exact:
+                await cur.execute("SET LOCAL enable_indexscan = off")
+            else:
+                await apply_search_settings(cur, probes=probes, ef_search=ef_search)
+            t0 = perf_counter()
+            await cur.execute(sql, {"query_vector": vector, "top_k": top_k})
+            rows = await cur.fetchall()
+            ms = (perf_counter() - t0) * 1000
+    return [row[0] for row in rows], ms
+
+
+async def main(tables, top_k: int, repeat: int, probes_list, ef_search_list):
+    await init_pool()
+    rows = []
+    try:
+        indexes = {row["table"]: row for row in vector_index_status(tables)}
+        for table in tables:
+            index = indexes.get(table)
+            if index is None:
+                print(f"[SKIP] {table}: no ANN index")
+                continue
+            vectors = await query_vectors(table)
+            truth, exact_ms = [], []
+            for v in vectors:
+                keys, ms = await search(table, v, top_k, exact=True)
+                truth.append(set(keys))
+                exact_ms.append(ms)
+
+            settings = ([{"probes": p} for p in probes_list] if index["type"] == "ivfflat"
+                        else [{"ef_search": ef} for ef in ef_search_list])
+            for setting in settings:
+                recalls, latencies = [], []
+                for v, expected in zip(vectors, truth):
+                    await search(table, v, top_k, **setting)  # warm-up
+                    for _ in range(repeat):
+                        keys, ms = await search(table, v, top_k, **setting)
+                        latencies.append(ms)
+                    recalls.append(len(expected & set(keys)) / max(1, len(expected)))
+                rows.append({
+                    "table": table,
+                    "index": index["type"],
+                    "setting": ", ".join(f"{k}={v}" for k, v in setting.items()),
+                    f"recall@{top_k}": round(float(np.mean(recalls)), 3),
+                    "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                    "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+                    "exact_p50_ms": round(float(np.percentile(exact_ms, 50)), 2),
+                })
+    finally:
+        await close_pool()
+
+    df = pd.DataFrame(rows)
+    pd.set_option("display.width", 200)
+    print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", choices=list(VECTOR_TABLES), action="append",
+                        help="Table to benchmark (repeatable, default: all)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 5, 10, 20, 40])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 20, 40, 80, 160])
+    args = parser.parse_args()
+    asyncio.run(main(args.table or list(VECTOR_TABLES), args.top_k, args.repeat, args.probes, args.ef_search))
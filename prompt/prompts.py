@@ -126,11 +126,18 @@ You are an AI assistant that receives user message (with image) and must classif
 
 
 similarity_search_tool = """
-similarity_search(query: str, top_k: int = 5, probes: int = 20) -> list[tuple[str, str, float]]:
+similarity_search(query: str, top_k: int = 5) -> list[tuple[str, str, float]]:
    Performs a semantic similarity search in the products database using pgvector embeddings.  
    Returns a list of tuples: (random_key, persian_name, similarity_score).  
    → Use this when retrieving product random_key(s) from user queries, even if the product name is slightly different.  
-   → `top_k` controls how many candidates to retrieve; `probes` controls recall vs. speed.  
+   → `top_k` controls how many candidates to retrieve. Do not pass `probes`; search settings are chosen automatically.  
+   → Optional `category` (category title) restricts the search to that product category.  
+"""
+
+similarity_search_many_tool = """
+similarity_search_many(queries: list[str], top_k: int = 5) -> list[list[tuple[str, str, float]]]:
+   Same as similarity_search, for several product names at once (one list of (random_key, persian_name, similarity_score) per query, in input order).
+   → Prefer this over repeated similarity_search calls when the user mentions more than one product.
 """
 
 execute_query_tool = """
@@ -139,6 +146,15 @@ execute_sql(query: str) -> list[RealDictRow]:
    → Run SQL directly.
 """
 
+offer_stats_tool = """
+get_product_offer_stats(base_random_key: str) -> dict:
+   Returns precomputed price/offer statistics of one base product in a single lookup:
+   min_price, max_price, avg_price, median_price, member_count (تعداد عضو),
+   shop_count (تعداد فروشگاه), warranty_shop_count (فروشگاه های دارای ضمانت),
+   city_member_counts and city_shop_counts (per-city counts, keyed by city name).
+   → Prefer this over execute_sql when the question is one of these values.
+"""
+
 find_candidate_shops_tool = """
 Tool Name: find_candidate_shops
 
@@ -199,7 +215,7 @@ SIMILARITY_SEARCH_NOTES = """
   • A very low score (e.g., ≤ 0.4) means the result is almost certainly not relevant.  
   • Scores in the middle require judgment — check the product name/content.  
 - Pick the best matching product only if it is a reasonable match. 
-- Never give up too soon. If no reasonable match is found, try `similarity_search` with a different query (product name) or parameters (top_k or probes) until a match is found.
+- Never give up too soon. If no reasonable match is found, try `similarity_search` with a different query (product name) or a larger top_k until a match is found.
 """
 SQL_NOTES = """
 ### SQL Query Guidelines:
@@ -220,7 +236,7 @@ You are handling PRODUCT_SEARCH queries.
 - Firstly, utilize the inital similarity seach results given to you, and resolve the base_random_key (max 1).
 - Or if it's unclear, do the following:
     + Extract the full Persian product name exactly as written (brand, model, size, color, etc.).
-    + Use similarity_search(query, top_k=5, probes=20) to find the best matching base product.
+    + Use similarity_search(query, top_k=5) to find the best matching base product.
     + Fill base_random_keys with the best match (max 1).
 """
 
@@ -230,7 +246,7 @@ You are handling PRODUCT_FEATURE queries.
 - Firstly, utilize the inital similarity seach results if given to you, and resolve the product's base_random_key.
 - If unclear or initial similarties not given, then do the following:
     + Extract the full Persian product name exactly as written.
-    + Resolve the product via similarity_search(query, top_k=5, probes=20).
+    + Resolve the product via similarity_search(query, top_k=5).
 - Retrieve the requested attribute (often in extra_features or another table via SQL).
    → If attribute is in `extra_features`, parse as needed.  
    → IMPORTANT: Keep and return the **Original** term used in data for the value of property.
@@ -244,7 +260,7 @@ SYSTEM_PROMPT_NUMERIC_VALUE = """
 You are handling NUMERIC_VALUE queries.
 
 - Resolve the product using initial similarity results given to you
-- But if no initial similarity is given or if they are unclear, then use the tool similarity_search(query, top_k=5, probes=20).
+- But if no initial similarity is given or if they are unclear, then use the tool similarity_search(query, top_k=5).
 - Use SQL (execute_sql) to compute numeric values (lowest کمترین, highest بیشترین, average متوسط, counts تعداد, Number of Shops (فروشگاه ها), Number of members (عضو ها), etc.).
 - Return numeric results in message as a clean numeric string (int or float-parsable).
 - Preserve at least 3 decimal places even if they are .000 for float types.  
@@ -192,8 +192,8 @@ async def run_shopping_agent(
 
         # Step 0.5: fetch chat history
         chat_id = input_dict["chat_id"]
-        base_id, chat_index = get_base_id_and_index(chat_id)   # your existing function
-        history = get_chat_history(base_id)[-4:]
+        base_id, chat_index = await get_base_id_and_index(chat_id)   # your existing function
+        history = (await get_chat_history(base_id))[-4:]
 
         # Convert to readable string for the LLM
         history_text = ""
@@ -210,7 +210,7 @@ async def run_shopping_agent(
         similarity_text = ""
         if use_initial_similarity_search and (history_text==""):
             try:
-                candidates = similarity_search(preprocessed_instruction, top_k=5, probes=20)
+                candidates = await similarity_search(preprocessed_instruction, top_k=5, probes=20)
                 if candidates[0][-1] > 0.7:
                     # candidates is expected to be list[tuple[str, str, float]]
                     rows = []
@@ -0,0 +1,158 @@
+# category_index.py
+"""
+In-memory cosine search over the categories table.
+
+The category set is small and changes rarely, so the embeddings are loaded
+once into a contiguous, row-normalized float32 matrix; a query is then one
+matrix-vector product plus `argpartition` (a batch of queries is one
+matrix-matrix product). A cheap fingerprint of the table is re-checked every
+CATEGORY_RELOAD_INTERVAL seconds and the matrix is reloaded when it changes.
+
+The category tree is loaded alongside, so a query (or a category title from
+the image path) can be mapped to its top-level category, which selects the
+product_embed partition to search (see `sql.category_partitions`).
+"""
+import os
+import asyncio
+from time import monotonic
+from typing import Optional, List, Dict, Tuple
+import numpy as np
+from sql.db_pool import connection
+from sql.vector_adapter import as_vector
+
+CATEGORY_RELOAD_INTERVAL = float(os.getenv("CATEGORY_RELOAD_INTERVAL", 300))  # seconds
+# Minimum similarity of the best category for `predict_top_category` to commit to a partition
+PARTITION_MIN_CATEGORY_SCORE = float(os.getenv("PARTITION_MIN_CATEGORY_SCORE", 0.45))
+
+FINGERPRINT_SQL = """
+    SELECT count(*), md5(string_agg(title || ':' || md5(embedding::text), ',' ORDER BY title))
+    FROM categories
+    WHERE embedding IS NOT NULL
+"""
+
+
+class CategoryIndex:
+    def __init__(self, reload_interval: float = CATEGORY_RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self.titles: List[str] = []
+        self.roots: List[Optional[int]] = []          # top-level category id of each matrix row
+        self.root_codes = np.zeros(0, dtype=np.int64)  # same, as an array (-1 = no top-level category)
+        self.matrix: Optional[np.ndarray] = None
+        self.root_of: Dict[int, Optional[int]] = {}
+        self.root_by_title: Dict[str, int] = {}
+        self.root_ids: set = set()
+        self._fingerprint = None
+        self._next_check = 0.0
+        self._lock = asyncio.Lock()
+        self.loads = 0
+
+    async def load(self):
+        """(Re)load the category matrix from the database."""
+        async with connection() as conn:
+            cur = await conn.execute(FINGERPRINT_SQL)
+            fingerprint = await cur.fetchone()
+            cur = await conn.execute(
+                "SELECT id, title, embedding FROM categories WHERE embedding IS NOT NULL ORDER BY title",
+                binary=True,
+            )
+            rows = await cur.fetchall()
+            cur = await conn.execute("SELECT id, parent_id, title FROM categories")
+            tree = await cur.fetchall()
+        root_of = _top_level_map(tree)
+        root_by_title = {title: root_of[cid] for cid, _, title in tree if title and root_of.get(cid) is not None}
+        roots = [root_of.get(row[0]) for row in rows]
+        root_codes = np.asarray([-1 if r is None else r for r in roots], dtype=np.int64)
+        titles = [row[1] for row in rows]
+        matrix = np.stack([as_vector(row[2]) for row in rows]) if rows else np.zeros((0, 1), np.float32)
+        matrix = np.ascontiguousarray(matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12),
+                                      dtype=np.float32)
+        # Swap both together so a concurrent search never sees mismatched titles/rows
+        self.titles, self.roots, self.root_codes, self.matrix = titles, roots, root_codes, matrix
+        self.root_of, self.root_by_title, self.root_ids = root_of, root_by_title, set(root_of.values())
+        self._fingerprint = tuple(fingerprint)
+        self._next_check = monotonic() + self.reload_interval
+        self.loads += 1
+        print(f"[CATEGORY_INDEX] Loaded {len(titles)} categories")
+
+    async def ensure_fresh(self):
+        """Load on first use, then reload only if the table fingerprint changed."""
+        if self.matrix is not None and monotonic() < self._next_check:
+            return
+        async with self._lock:
+            if self.matrix is None:
+                await self.load()
+                return
+            if monotonic() < self._next_check:
+                return
+            async with connection() as conn:
+                cur = await conn.execute(FINGERPRINT_SQL)
+                fingerprint = tuple(await cur.fetchone())
+            if fingerprint != self._fingerprint:
+                await self.load()
+            else:
+                self._next_check = monotonic() + self.reload_interval
+
+    def search_many(self, query_vectors: np.ndarray, top_k: int = 5) -> List[List[Dict]]:
+        """Top-k categories for each row of `query_vectors`, in the similarity_search_cat format."""
+        titles, matrix = self.titles, self.matrix
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-12)
+        k = min(top_k, len(titles))
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+        scores = queries @ matrix.T  # (n_queries, n_categories)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row_scores, idx in zip(scores, top):
+            idx = idx[np.argsort(-row_scores[idx])]
+            results.append([
+                {"category": titles[i], "similarity": round(float(row_scores[i]), 4)}
+                for i in idx
+            ])
+        return results
+
+    def search(self, query_vector: np.ndarray, top_k: int = 5) -> List[Dict]:
+        return self.search_many(as_vector(query_vector)[None, :], top_k)[0]
+
+    def predict_top_category(self, query_vector: np.ndarray) -> Tuple[Optional[int], float]:
+        """
+        (top-level category of the best matching category, margin), or (None, 0.0) if the match is weak.
+        The margin is the best score minus the best score of a category under another top-level one.
+        """
+        titles, roots, root_codes, matrix = self.titles, self.roots, self.root_codes, self.matrix
+        if matrix is None or not len(titles):
+            return None, 0.0
+        query = as_vector(query_vector)
+        scores = matrix @ (query / (np.linalg.norm(query) + 1e-12))
+        best = int(np.argmax(scores))
+        if scores[best] < PARTITION_MIN_CATEGORY_SCORE:
+            return None, 0.0
+        others = scores[root_codes != root_codes[best]]
+        margin = float(scores[best] - others.max()) if len(others) else 1.0
+        return roots[best], margin
+
+    def resolve_top_category(self, category) -> Optional[int]:
+        """Top-level category id of a category title or id (any level), None if unknown."""
+        if isinstance(category, int) or (isinstance(category, str) and category.strip().isdigit()):
+            return self.root_of.get(int(category))
+        return self.root_by_title.get(str(category).strip())
+
+    def stats(self) -> dict:
+        return {"categories": len(self.titles), "top_level": len(self.root_ids), "loads": self.loads}
+
+
+def _top_level_map(tree: list) -> Dict[int, Optional[int]]:
+    """category id -> id of its top-level ancestor, from (id, parent_id, title) rows."""
+    parent = {cid: pid for cid, pid, _ in tree}
+    roots: Dict[int, Optional[int]] = {}
+    for cid in parent:
+        seen, node = set(), cid
+        # A category whose parent is missing (NULL, 0, -1, ...) is top-level
+        while parent.get(node) in parent and node not in seen:
+            seen.add(node)
+            node = parent[node]
+        roots[cid] = node
+    return roots
+
+
+category_index = CategoryIndex()
@@ -0,0 +1,205 @@
+# category_partitions.py
+"""
+Product and image embeddings partitioned by top-level category.
+
+`top_category_id` is added to product_embed and image_embedding and filled
+from base_products.category_id walked up to its top-level ancestor. Every
+top-level category with at least PARTITION_MIN_ROWS rows gets its own
+partial ANN index (`... WHERE top_category_id = <id>`), so a filtered search
+only walks that partition's graph / lists. Smaller partitions are searched
+exactly through a btree on top_category_id.
+
+Usage:
+    python -m sql.category_partitions setup          # add + backfill top_category_id
+    python -m sql.category_partitions build-indexes  # partial ANN index per large partition
+    python -m sql.category_partitions status
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import argparse
+from time import perf_counter
+from typing import Optional
+import psycopg
+from psycopg import sql
+from sql.db_pool import DB_CONFIG, connection
+from sql.vector_index import VECTOR_INDEX_TYPE, INDEX_TYPES, HNSW_M, HNSW_EF_CONSTRUCTION, apply_search_settings
+
+PARTITIONED_SEARCH = os.getenv("PARTITIONED_SEARCH", "0") == "1"
+PARTITION_MIN_ROWS = int(os.getenv("PARTITION_MIN_ROWS", 5000))
+# A predicted (not caller-given) partition is searched alone only when the best category beats the
+# best category of every other top-level one by this margin; otherwise the partition result is merged
+# with the global search. Ambiguous queries land in the wrong partition, so raising it trades latency
+# for recall (0 = always trust the prediction).
+PARTITION_MIN_MARGIN = float(os.getenv("PARTITION_MIN_MARGIN", 0.05))
+
+PARTITION_TABLES = {
+    # table -> key column joined to base_products.random_key
+    "product_embed": "random_key",
+    "image_embedding": "random_key",
+}
+
+TOP_CATEGORY_CTE = """
+WITH RECURSIVE tree AS (
+    SELECT c.id, c.id AS root_id
+    FROM categories c
+    WHERE c.parent_id IS NULL OR NOT EXISTS (SELECT 1 FROM categories p WHERE p.id = c.parent_id)
+    UNION ALL
+    SELECT c.id, t.root_id
+    FROM categories c
+    JOIN tree t ON c.parent_id = t.id
+)
+"""
+
+# Top-level categories that have a partial ANN index, per table (see `load_partitions`)
+indexed_partitions: dict = {table: set() for table in PARTITION_TABLES}
+
+partition_stats = {
+    "partitioned": 0,
+    "predicted": 0,
+    "exact_partition": 0,
+    "merged": 0,
+}
+
+
+def partition_index_name(table: str, top_category_id: int, index_type: str) -> str:
+    return f"{table}_cat{top_category_id}_{index_type}_idx"
+
+
+# ------ Setup ------
+def setup_partitions(only_missing: bool = False):
+    """Add top_category_id to the embedding tables and (re)fill it. Re-run after loading new products."""
+    with psycopg.connect(**DB_CONFIG, autocommit=True) as conn:
+        for table, key in PARTITION_TABLES.items():
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS top_category_id INTEGER")
+            t0 = perf_counter()
+            cur = conn.execute(
+                TOP_CATEGORY_CTE + f"""
+                UPDATE {table} e
+                SET top_category_id = t.root_id
+                FROM base_products bp
+                JOIN tree t ON t.id = bp.category_id
+                WHERE bp.random_key = e.{key}
+                  AND e.top_category_id IS DISTINCT FROM t.root_id
+                """ + (" AND e.top_category_id IS NULL" if only_missing else "")
+            )
+            print(f"[PARTITIONS] {table}: {cur.rowcount} rows updated in {perf_counter() - t0:.1f}s")
+            conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_top_category_idx "
+                         f"ON {table} (top_category_id)")
+            conn.execute(f"ANALYZE {table}")
+
+
+def build_partition_indexes(index_type: str = VECTOR_INDEX_TYPE, min_rows: int = PARTITION_MIN_ROWS,
+                            concurrently: bool = True) -> list:
+    """Create a partial ANN index for every top-level category with at least `min_rows` rows."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"index_type must be one of {INDEX_TYPES}")
+    created = []
+    concurrent = " CONCURRENTLY" if concurrently else ""
+    with psycopg.connect(**DB_CONFIG, autocommit=True) as conn:
+        for table in PARTITION_TABLES:
+            sizes = conn.execute(
+                f"SELECT top_category_id, count(*) FROM {table} "
+                f"WHERE top_category_id IS NOT NULL AND embedding IS NOT NULL "
+                f"GROUP BY top_category_id HAVING count(*) >= %s ORDER BY 2 DESC",
+                (min_rows,),
+            ).fetchall()
+            for top_category_id, rows in sizes:
+                name = partition_index_name(table, top_category_id, index_type)
+                options = (f"(lists = {max(1, rows // 1000)})" if index_type == "ivfflat"
+                           else f"(m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})")
+                t0 = perf_counter()
+                conn.execute(
+                    f"CREATE INDEX{concurrent} IF NOT EXISTS {name} ON {table} "
+                    f"USING {index_type} (embedding vector_cosine_ops) WITH {options} "
+                    f"WHERE top_category_id = {int(top_category_id)}"
+                )
+                print(f"[PARTITIONS] {name} ({rows} rows) in {perf_counter() - t0:.1f}s")
+                created.append(name)
+    return created
+
+
+def partition_status() -> list[dict]:
+    with psycopg.connect(**DB_CONFIG) as conn:
+        rows = conn.execute(
+            """
+            SELECT tablename, indexname, pg_size_pretty(pg_relation_size(indexname::regclass))
+            FROM pg_indexes
+            WHERE tablename = ANY(%s) AND indexname ~ '_cat[0-9]+_'
+            ORDER BY tablename, indexname
+            """,
+            (list(PARTITION_TABLES),),
+        ).fetchall()
+    return [{"table": t, "index": n, "size": s} for t, n, s in rows]
+
+
+# ------ Search ------
+async def load_partitions():
+    """Find which top-level categories have a partial ANN index (called at startup)."""
+    async with connection() as conn:
+        cur = await conn.execute(
+            "SELECT tablename, substring(indexname from '_cat([0-9]+)_')::int "
+            "FROM pg_indexes WHERE tablename = ANY(%s) AND indexname ~ '_cat[0-9]+_'",
+            (list(PARTITION_TABLES),),
+        )
+        rows = await cur.fetchall()
+    found = {table: set() for table in PARTITION_TABLES}
+    for table, top_category_id in rows:
+        found[table].add(top_category_id)
+    indexed_partitions.update(found)
+    print(f"[PARTITIONS] Indexed partitions: { {t: len(ids) for t, ids in found.items()} }")
+
+
+async def partition_search(cur, table: str, select: sql.Composable, query_vector, top_k: int,
+                           top_category_id: int, probes: Optional[int] = None,
+                           ef_search: Optional[int] = None) -> list:
+    """
+    ORDER BY distance LIMIT top_k within one top-level category.
+    The category id is inlined as a literal so the planner can match the partial index.
+    """
+    partitioned = top_category_id in indexed_partitions.get(table, set())
+    if partitioned:
+        await apply_search_settings(cur, probes=probes, ef_search=ef_search)
+        partition_stats["partitioned"] += 1
+    else:
+        # Small partition: exact distances over the rows found through the btree
+        await apply_search_settings(cur, force_index=False)
+        await cur.execute("SET LOCAL enable_indexscan = off")
+        partition_stats["exact_partition"] += 1
+    await cur.execute(
+        sql.SQL("""
+            SELECT {select}
+            FROM {table}
+            WHERE top_category_id = {top_category_id}
+            ORDER BY embedding <=> %(query_vector)b
+            LIMIT %(top_k)s
+        """).format(select=select, table=sql.Identifier(table), top_category_id=sql.Literal(int(top_category_id))),
+        {"query_vector": query_vector, "top_k": top_k},
+    )
+    return await cur.fetchall()
+
+
+def merge_results(partition_rows: list, global_rows: list, top_k: int) -> list:
+    """Union of two [(random_key, ..., similarity), ...] lists, best similarity first, one row per key."""
+    best = {}
+    for row in partition_rows + global_rows:
+        if row[0] not in best or row[-1] > best[row[0]][-1]:
+            best[row[0]] = row
+    return sorted(best.values(), key=lambda row: row[-1], reverse=True)[:top_k]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Top-level category partitions of the embedding tables")
+    parser.add_argument("command", choices=["setup", "build-indexes", "status"])
+    parser.add_argument("--type", choices=INDEX_TYPES, default=VECTOR_INDEX_TYPE)
+    parser.add_argument("--min-rows", type=int, default=PARTITION_MIN_ROWS)
+    parser.add_argument("--only-missing", action="store_true", help="Only fill rows without top_category_id")
+    parser.add_argument("--blocking", action="store_true",
+                        help="Do not use CONCURRENTLY (faster, but locks the table)")
+    args = parser.parse_args()
+
+    if args.command == "setup":
+        setup_partitions(only_missing=args.only_missing)
+    elif args.command == "build-indexes":
+        build_partition_indexes(args.type, args.min_rows, concurrently=not args.blocking)
+    for row in partition_status():
+        print(row)
@@ -0,0 +1,159 @@
+# clip_export.py
+"""
+Export the CLIP image encoder to ONNX and check backend parity.
+
+`export` writes the vision tower + projection (pixel_values -> image_embeds,
+dynamic batch axis) to CLIP_ONNX_PATH; with --int8 the graph is additionally
+quantized with ONNX Runtime dynamic int8 quantization and the quantized file
+is written next to it (`*.int8.onnx`). Point CLIP_ONNX_PATH at the file to
+serve.
+
+`parity` re-embeds a deterministic sample of product images with a backend
+and compares them with the fp32 vectors stored in image_embedding. It fails
+(exit code 1) when the mean cosine similarity is below --min-cosine or any
+image is below --min-cosine-any.
+
+Usage:
+    python -m sql.clip_export export [--int8]
+    python -m sql.clip_export parity --backend onnx [--samples 200]
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import argparse
+from io import BytesIO
+from time import perf_counter
+import numpy as np
+import httpx
+import psycopg
+from PIL import Image
+from pgvector.psycopg import register_vector
+from sql.db_pool import DB_CONFIG
+from sql.vector_adapter import as_vector
+from sql.clip_provider import CLIP_MODEL_NAME, CLIP_ONNX_PATH, CLIP_BACKEND, CLIP_BACKENDS, ClipProvider
+
+CLIP_PARITY_MIN_COSINE = float(os.getenv("CLIP_PARITY_MIN_COSINE", 0.99))
+CLIP_PARITY_MIN_COSINE_ANY = float(os.getenv("CLIP_PARITY_MIN_COSINE_ANY", 0.95))
+ONNX_OPSET = 17
+
+
+# ------ Export ------
+def export_onnx(path: str = CLIP_ONNX_PATH, model_name: str = CLIP_MODEL_NAME, int8: bool = False) -> str:
+    """Export pixel_values -> image_embeds to `path`. Returns the path of the file to serve."""
+    import torch
+    from transformers import CLIPModel
+
+    class ImageEncoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model.get_image_features(pixel_values=pixel_values)
+
+    model = CLIPModel.from_pretrained(model_name).eval()
+    size = model.config.vision_config.image_size
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    t0 = perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(
+            ImageEncoder(model),
+            (torch.randn(1, 3, size, size),),
+            path,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+        )
+    print(f"[CLIP_EXPORT] {path} ({os.path.getsize(path) / 2**20:.0f} MB) in {perf_counter() - t0:.1f}s")
+    if not int8:
+        return path
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    int8_path = path[:-len(".onnx")] + ".int8.onnx" if path.endswith(".onnx") else path + ".int8"
+    quantize_dynamic(path, int8_path, weight_type=QuantType.QInt8)
+    print(f"[CLIP_EXPORT] {int8_path} ({os.path.getsize(int8_path) / 2**20:.0f} MB)")
+    return int8_path
+
+
+# ------ Parity ------
+def fetch_parity_sample(samples: int) -> list:
+    """(random_key, image_url, stored fp32 embedding) for a deterministic sample of products."""
+    with psycopg.connect(**DB_CONFIG) as conn:
+        register_vector(conn)
+        with conn.cursor(binary=True) as cur:
+            cur.execute(
+                """
+                SELECT ie.random_key, bp.image_url, ie.embedding
+                FROM image_embedding ie
+                JOIN base_products bp ON bp.random_key = ie.random_key
+                WHERE bp.image_url IS NOT NULL AND ie.embedding IS NOT NULL
+                ORDER BY md5(ie.random_key)
+                LIMIT %s
+                """,
+                (samples,),
+            )
+            return cur.fetchall()
+
+
+def download_images(rows: list) -> list:
+    """(random_key, PIL image, stored embedding) for every row whose image could be fetched."""
+    images = []
+    with httpx.Client(timeout=20, follow_redirects=True) as client:
+        for random_key, url, embedding in rows:
+            try:
+                response = client.get(url)
+                response.raise_for_status()
+                image = Image.open(BytesIO(response.content)).convert("RGB")
+            except Exception as e:
+                print(f"[CLIP_EXPORT] Skipping {random_key}: {e}")
+                continue
+            images.append((random_key, image, as_vector(embedding)))
+    return images
+
+
+def check_parity(backend: str = CLIP_BACKEND, samples: int = 200, batch_size: int = 16,
+                 onnx_path: str = CLIP_ONNX_PATH, min_cosine: float = CLIP_PARITY_MIN_COSINE,
+                 min_cosine_any: float = CLIP_PARITY_MIN_COSINE_ANY) -> dict:
+    items = download_images(fetch_parity_sample(samples))
+    if not items:
+        raise RuntimeError("no images could be downloaded for the parity check")
+    provider = ClipProvider(backend=backend, onnx_path=onnx_path)
+    provider.load()
+    vectors = np.concatenate([
+        provider.embed_images([image for _, image, _ in items[i:i + batch_size]])
+        for i in range(0, len(items), batch_size)
+    ])
+    stored = np.stack([embedding for _, _, embedding in items])
+    stored = stored / (np.linalg.norm(stored, axis=1, keepdims=True) + 1e-12)
+    cosines = np.sum(vectors * stored, axis=1)
+    worst = int(np.argmin(cosines))
+    report = {
+        "backend": backend,
+        "images": len(items),
+        "mean_cosine": round(float(cosines.mean()), 5),
+        "p5_cosine": round(float(np.percentile(cosines, 5)), 5),
+        "min_cosine": round(float(cosines[worst]), 5),
+        "worst_random_key": items[worst][0],
+    }
+    report["passed"] = report["mean_cosine"] >= min_cosine and report["min_cosine"] >= min_cosine_any
+    print(f"[CLIP_EXPORT] Parity: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CLIP image encoder export and parity check")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--path", default=CLIP_ONNX_PATH)
+    parser.add_argument("--int8", action="store_true", help="Also write a dynamically quantized int8 graph")
+    parser.add_argument("--backend", choices=CLIP_BACKENDS, default=CLIP_BACKEND)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--min-cosine", type=float, default=CLIP_PARITY_MIN_COSINE)
+    parser.add_argument("--min-cosine-any", type=float, default=CLIP_PARITY_MIN_COSINE_ANY)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.path, int8=args.int8)
+    else:
+        result = check_parity(args.backend, args.samples, onnx_path=args.path, min_cosine=args.min_cosine,
+                              min_cosine_any=args.min_cosine_any)
+        sys.exit(0 if result["passed"] else 1)
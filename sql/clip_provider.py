@@ -0,0 +1,307 @@
+# clip_provider.py
+"""
+Lazily loaded CLIP image encoder.
+
+The encoder backend (CLIP_BACKEND) is imported only when the first image has
+to be embedded (or when `warm_up()` is called from the app lifespan), so
+processes that only serve text never pay for torch. Warm-up is opt-in: set
+CLIP_WARMUP=1 on the workers that serve images so the first image request
+does not pay for loading the model; elsewhere an image request still works,
+it just loads the model first.
+
+Request-path callers go through `clip_batcher`: images from concurrent chats
+are collected for up to CLIP_MAX_WAIT_MS and decoded + embedded in one
+forward pass on a dedicated worker thread, so the event loop is never
+blocked by the encoder.
+
+Backends (all return the unnormalized image_embeds of the same model):
+    torch       fp32 transformers CLIPModel (default)
+    torch_int8  Linear layers dynamically quantized to int8 (CPU)
+    onnx        ONNX Runtime over `python -m sql.clip_export export` (optionally --int8)
+
+Usage:
+    from sql.clip_provider import clip_batcher, clip_provider
+    vector = await clip_batcher.embed(data_uri)             # async, batched (data URI or IngestedImage)
+    vector = clip_provider.embed_base64_image(data_uri)     # sync, np.ndarray[float32]
+"""
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Optional, List, Union
+import numpy as np
+from PIL import Image
+from utils.image_ingest import IngestedImage, ingest_data_uri
+
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "openai/clip-vit-base-patch32")
+CLIP_WARMUP = os.getenv("CLIP_WARMUP", "0") == "1"
+CLIP_BACKENDS = ("torch", "torch_int8", "onnx")
+CLIP_BACKEND = os.getenv("CLIP_BACKEND", "torch")
+CLIP_ONNX_PATH = os.getenv("CLIP_ONNX_PATH", "models/clip_image.onnx")
+CLIP_NUM_THREADS = int(os.getenv("CLIP_NUM_THREADS", 0))          # intra-op threads, 0 = backend default
+CLIP_MAX_BATCH_SIZE = int(os.getenv("CLIP_MAX_BATCH_SIZE", 16))
+CLIP_MAX_WAIT_MS = float(os.getenv("CLIP_MAX_WAIT_MS", 10))
+
+# Blank image for the warm-up forward pass
+_WARMUP_IMAGE = Image.new("RGB", (224, 224), (255, 255, 255))
+
+
+# ------ Encoder backends ------
+class TorchClipEncoder:
+    """fp32 CLIP vision tower + projection, or int8 dynamically quantized Linear layers (CPU only)."""
+
+    def __init__(self, model_name: str, quantize: bool = False):
+        import torch
+        from transformers import CLIPModel, CLIPProcessor
+
+        if CLIP_NUM_THREADS > 0:
+            torch.set_num_threads(CLIP_NUM_THREADS)
+        self.device = "cuda" if torch.cuda.is_available() and not quantize else "cpu"
+        model = CLIPModel.from_pretrained(model_name).eval()
+        if quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model.to(self.device)
+        self.processor = CLIPProcessor.from_pretrained(model_name)
+        self.embedding_dim = model.config.projection_dim
+        self._torch = torch
+
+    def encode(self, images: List[Image.Image]) -> np.ndarray:
+        with self._torch.no_grad():
+            inputs = self.processor(images=images, return_tensors="pt", padding=True).to(self.device)
+            embedding = self.model.get_image_features(**inputs)
+        return embedding.cpu().numpy()
+
+
+class OnnxClipEncoder:
+    """ONNX Runtime session over the graph written by `python -m sql.clip_export export` (no torch)."""
+
+    def __init__(self, model_name: str, path: str):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("CLIP_BACKEND=onnx needs onnxruntime (pip install onnxruntime)") from e
+        from transformers import CLIPImageProcessor
+
+        if not os.path.exists(path):
+            raise RuntimeError(f"{path} not found, run `python -m sql.clip_export export` first")
+        options = ort.SessionOptions()
+        if CLIP_NUM_THREADS > 0:
+            options.intra_op_num_threads = CLIP_NUM_THREADS
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.processor = CLIPImageProcessor.from_pretrained(model_name)
+        self.device = "cpu"
+        self.embedding_dim = self.session.get_outputs()[0].shape[-1]
+
+    def encode(self, images: List[Image.Image]) -> np.ndarray:
+        pixels = self.processor(images=images, return_tensors="np")["pixel_values"].astype(np.float32)
+        return self.session.run(["image_embeds"], {"pixel_values": pixels})[0]
+
+
+def create_encoder(backend: str, model_name: str = CLIP_MODEL_NAME, onnx_path: str = CLIP_ONNX_PATH):
+    if backend == "torch":
+        return TorchClipEncoder(model_name)
+    if backend == "torch_int8":
+        return TorchClipEncoder(model_name, quantize=True)
+    if backend == "onnx":
+        return OnnxClipEncoder(model_name, onnx_path)
+    raise ValueError(f"CLIP backend must be one of {CLIP_BACKENDS}")
+
+
+class ClipProvider:
+    """Loads the CLIP encoder on first use; safe to call from several threads."""
+
+    def __init__(self, model_name: str = CLIP_MODEL_NAME, backend: str = CLIP_BACKEND,
+                 onnx_path: str = CLIP_ONNX_PATH):
+        self.model_name = model_name
+        self.backend = backend
+        self.onnx_path = onnx_path
+        self.encoder = None
+        self.device: Optional[str] = None
+        self.embedding_dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self.load_seconds = 0.0
+        self.warmup_seconds = 0.0
+        self.images = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self.encoder is not None
+
+    def load(self):
+        """Import the backend (torch/transformers or onnxruntime) and load the model (no-op once loaded)."""
+        if self.encoder is not None:
+            return
+        with self._lock:
+            if self.encoder is not None:
+                return
+            t0 = perf_counter()
+            print(f"[CLIP] Loading {self.model_name} ({self.backend})...")
+            encoder = create_encoder(self.backend, self.model_name, self.onnx_path)
+            self.device, self.embedding_dim = encoder.device, encoder.embedding_dim
+            self.encoder = encoder  # set last: `loaded` means fully usable
+            self.load_seconds = perf_counter() - t0
+            print(f"[CLIP] Loaded on {self.device} in {self.load_seconds:.1f}s, embedding dim {self.embedding_dim}")
+
+    def warm_up(self):
+        """Load the model and run one forward pass so the first request does not pay for it."""
+        self.load()
+        t0 = perf_counter()
+        self._forward([_WARMUP_IMAGE])
+        self.warmup_seconds = perf_counter() - t0
+        print(f"[CLIP] Warm-up forward pass in {self.warmup_seconds * 1000:.0f} ms")
+
+    def _forward(self, images: List[Image.Image]) -> np.ndarray:
+        embedding = np.asarray(self.encoder.encode(images), dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding, axis=1, keepdims=True) + 1e-12)
+
+    def embed_images(self, images: List[Image.Image]) -> np.ndarray:
+        """Normalized CLIP embeddings of PIL images in one forward pass, shape (n, embedding_dim)."""
+        self.load()
+        self.images += len(images)
+        return self._forward(images)
+
+    def embed_image(self, image: Image.Image) -> np.ndarray:
+        """Normalized CLIP embedding of a PIL image, shape (embedding_dim,)."""
+        return self.embed_images([image])[0]
+
+    def embed_base64_image(self, data_uri: str) -> np.ndarray:
+        """Convert a single base64 data URI to a normalized CLIP embedding."""
+        return self.embed_image(ingest_data_uri(data_uri).clip_image)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "model": self.model_name,
+            "backend": self.backend,
+            "device": self.device,
+            "load_seconds": round(self.load_seconds, 2),
+            "warmup_ms": round(self.warmup_seconds * 1000, 1),
+            "images": self.images,
+        }
+
+
+class ClipBatcher:
+    """
+    Async front end of a ClipProvider that micro-batches concurrent images.
+
+    Calls to `embed` are collected for up to `max_wait_ms` (or until
+    `max_batch_size` images are waiting); each batch is decoded through
+    `utils.image_ingest` (skipped for already ingested images) and embedded
+    on a single dedicated worker thread (torch releases the GIL during the
+    forward pass), so batches run one at a time and never on the event loop.
+    Each caller awaits its own vector.
+    """
+
+    def __init__(
+        self,
+        provider: ClipProvider,
+        max_batch_size: int = CLIP_MAX_BATCH_SIZE,
+        max_wait_ms: float = CLIP_MAX_WAIT_MS,
+    ):
+        self.provider = provider
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip")
+        self._pending: list[tuple[Union[str, IngestedImage], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: set[asyncio.Task] = set()
+
+        self.requests = 0
+        self.queued = 0         # images handed to the worker and not finished yet
+        self.batches = 0
+        self.images = 0
+        self.errors = 0
+        self.batch_ms_total = 0.0
+        self.batch_ms_max = 0.0
+
+    async def embed(self, image: Union[str, IngestedImage]) -> np.ndarray:
+        """CLIP embedding of one image (data URI or IngestedImage), batched with concurrent callers."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((image, future))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        while batch:
+            chunk, batch = batch[:self.max_batch_size], batch[self.max_batch_size:]
+            self.queued += len(chunk)
+            task = asyncio.create_task(self._send(chunk))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    def _run_batch(self, items: List[Union[str, IngestedImage]]) -> list:
+        """Worker thread: decode every image, embed the decodable ones together."""
+        t0 = perf_counter()
+        decoded = []
+        for item in items:
+            try:
+                image = item if isinstance(item, IngestedImage) else ingest_data_uri(item)
+                decoded.append(image.clip_image)
+            except Exception as e:  # a bad image fails only its own caller
+                decoded.append(e)
+        images = [d for d in decoded if not isinstance(d, Exception)]
+        vectors = iter(self.provider.embed_images(images) if images else [])
+        results = [d if isinstance(d, Exception) else next(vectors) for d in decoded]
+        ms = (perf_counter() - t0) * 1000
+        self.batch_ms_total += ms
+        self.batch_ms_max = max(self.batch_ms_max, ms)
+        return results
+
+    async def _send(self, batch: list[tuple[Union[str, IngestedImage], asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, self._run_batch, [item for item, _ in batch])
+            self.batches += 1
+            self.images += len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    self.errors += 1
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            self.errors += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.queued -= len(batch)
+
+    def close(self):
+        """Stop the worker thread once the batch in progress is done (blocking; called at shutdown)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "queue_depth": len(self._pending) + self.queued,
+            "batches": self.batches,
+            "images": self.images,
+            "errors": self.errors,
+            "avg_batch_size": round(self.images / self.batches, 2) if self.batches else 0.0,
+            "avg_batch_ms": round(self.batch_ms_total / self.batches, 1) if self.batches else 0.0,
+            "max_batch_ms": round(self.batch_ms_max, 1),
+        }
+
+
+clip_provider = ClipProvider()
+clip_batcher = ClipBatcher(clip_provider)
+
+
+def embed_base64_image(data_uri: str) -> np.ndarray:
+    return clip_provider.embed_base64_image(data_uri)
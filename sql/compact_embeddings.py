@@ -0,0 +1,158 @@
+# compact_embeddings.py
+"""
+Compact ANN indexes on product_embed with full-precision rerank.
+
+The table keeps its full `vector(1536)` column; the compact representation
+lives only in an expression index, so no data is duplicated:
+- halfvec:   embedding::halfvec(1536)               (2 bytes per dimension)
+- truncated: subvector(embedding, 1, N)::vector(N)  (text-embedding-3 vectors
+             keep most of their quality when truncated, cosine ignores the norm)
+- binary:    binary_quantize(embedding)::bit(1536)  (1 bit per dimension, Hamming)
+
+A search takes COMPACT_CANDIDATES rows from the compact index, then reranks
+them in NumPy with the full-precision vectors and keeps `top_k`.
+
+Usage:
+    python -m sql.compact_embeddings build --mode halfvec [--type hnsw]
+    python -m sql.compact_embeddings status
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import argparse
+from time import perf_counter
+from typing import Optional
+import numpy as np
+import psycopg
+from sql.db_pool import DB_CONFIG
+from sql.vector_adapter import as_vector
+from sql.vector_index import INDEX_TYPES, VECTOR_INDEX_TYPE, IVFFLAT_LISTS, HNSW_M, HNSW_EF_CONSTRUCTION, apply_search_settings
+
+COMPACT_MODES = ("halfvec", "truncated", "binary")
+
+COMPACT_SEARCH_MODE = os.getenv("COMPACT_SEARCH_MODE", "")            # "" = search the full-precision index
+COMPACT_DIMENSIONS = int(os.getenv("COMPACT_DIMENSIONS", 256))        # truncated mode only
+COMPACT_CANDIDATES = int(os.getenv("COMPACT_CANDIDATES", 200))        # rows reranked in NumPy
+EMBEDDING_DIM = 1536  # text-embedding-3-small
+
+
+def compact_expressions(mode: str, dims: int = COMPACT_DIMENSIONS) -> dict:
+    """Indexed expression, query expression, distance operator and opclass of a mode."""
+    if mode == "halfvec":
+        return {
+            "column": f"(embedding::halfvec({EMBEDDING_DIM}))",
+            "query": f"%(query_vector)b::halfvec({EMBEDDING_DIM})",
+            "operator": "<=>",
+            "opclass": "halfvec_cosine_ops",
+        }
+    if mode == "truncated":
+        return {
+            "column": f"(subvector(embedding, 1, {dims})::vector({dims}))",
+            "query": f"subvector(%(query_vector)b, 1, {dims})::vector({dims})",
+            "operator": "<=>",
+            "opclass": "vector_cosine_ops",
+        }
+    if mode == "binary":
+        return {
+            "column": f"(binary_quantize(embedding)::bit({EMBEDDING_DIM}))",
+            "query": f"binary_quantize(%(query_vector)b)::bit({EMBEDDING_DIM})",
+            "operator": "<~>",
+            "opclass": "bit_hamming_ops",
+        }
+    raise ValueError(f"mode must be one of {COMPACT_MODES}")
+
+
+def compact_index_name(mode: str, index_type: str) -> str:
+    return f"product_embed_{mode}_{index_type}_idx"
+
+
+def build_compact_index(mode: str, index_type: str = VECTOR_INDEX_TYPE, concurrently: bool = True) -> dict:
+    """Create the compact expression index for `mode`. Returns its name, size and build time."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"index_type must be one of {INDEX_TYPES}")
+    expr = compact_expressions(mode)
+    name = compact_index_name(mode, index_type)
+    concurrent = " CONCURRENTLY" if concurrently else ""
+
+    with psycopg.connect(**DB_CONFIG, autocommit=True) as conn:
+        if index_type == "ivfflat":
+            rows = conn.execute("SELECT count(*) FROM product_embed").fetchone()[0]
+            options = f"(lists = {IVFFLAT_LISTS or max(1, rows // 1000)})"
+        else:
+            options = f"(m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+        t0 = perf_counter()
+        conn.execute(
+            f"CREATE INDEX{concurrent} IF NOT EXISTS {name} ON product_embed "
+            f"USING {index_type} ({expr['column']} {expr['opclass']}) WITH {options}"
+        )
+        build_s = perf_counter() - t0
+        conn.execute("ANALYZE product_embed")
+        size = conn.execute("SELECT pg_relation_size(%s::regclass)", (name,)).fetchone()[0]
+
+    report = {"mode": mode, "index": name, "size_bytes": size, "build_seconds": round(build_s, 2)}
+    print(f"[COMPACT_INDEX] Built: {report}")
+    return report
+
+
+def rerank(query_vector: np.ndarray, rows: list, top_k: int) -> list:
+    """
+    Rerank (random_key, persian_name, full_embedding) rows by exact cosine similarity.
+    Returns [(random_key, persian_name, similarity), ...] like similarity_search.
+    """
+    if not rows:
+        return []
+    matrix = np.stack([as_vector(row[2]) for row in rows])
+    query = as_vector(query_vector)
+    scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+    order = np.argsort(-scores)[:top_k]
+    return [(rows[i][0], rows[i][1], float(scores[i])) for i in order]
+
+
+async def compact_search(cur, query_vector: np.ndarray, top_k: int, mode: str = COMPACT_SEARCH_MODE,
+                         candidates: int = COMPACT_CANDIDATES, probes: Optional[int] = None) -> list:
+    """Fetch `candidates` rows from the compact index of `mode`, rerank them with full precision."""
+    expr = compact_expressions(mode)
+    candidates = max(candidates, top_k)
+    # HNSW returns at most ef_search rows per scan
+    await apply_search_settings(cur, probes=probes, ef_search=candidates)
+    await cur.execute(f"""
+        SELECT random_key, persian_name, embedding
+        FROM product_embed
+        ORDER BY {expr['column']} {expr['operator']} {expr['query']}
+        LIMIT %(candidates)s
+    """, {"query_vector": query_vector, "candidates": candidates}, binary=True)
+    return rerank(query_vector, await cur.fetchall(), top_k)
+
+
+def compact_index_status() -> list[dict]:
+    """Compact indexes on product_embed with their size."""
+    with psycopg.connect(**DB_CONFIG) as conn:
+        rows = conn.execute(
+            """
+            SELECT indexname, pg_relation_size(indexname::regclass)
+            FROM pg_indexes
+            WHERE tablename = 'product_embed' AND indexname LIKE ANY(%s)
+            ORDER BY indexname
+            """,
+            ([f"product_embed_{mode}_%" for mode in COMPACT_MODES],),
+        ).fetchall()
+    return [{"index": name, "size_bytes": size} for name, size in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact ANN indexes on product_embed")
+    parser.add_argument("command", choices=["build", "status"])
+    parser.add_argument("--mode", choices=COMPACT_MODES, action="append",
+                        help="Compact mode to build (repeatable, default: COMPACT_SEARCH_MODE)")
+    parser.add_argument("--type", choices=INDEX_TYPES, default=VECTOR_INDEX_TYPE)
+    parser.add_argument("--blocking", action="store_true",
+                        help="Do not use CONCURRENTLY (faster, but locks the table)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        modes = args.mode or ([COMPACT_SEARCH_MODE] if COMPACT_SEARCH_MODE else [])
+        if not modes:
+            parser.error("pass --mode or set COMPACT_SEARCH_MODE")
+        for mode in modes:
+            build_compact_index(mode, args.type, concurrently=not args.blocking)
+    for row in compact_index_status():
+        print(row)
@@ -0,0 +1,91 @@
+# db_pool.py
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+from dotenv import load_dotenv
+from psycopg_pool import AsyncConnectionPool
+from sql.vector_adapter import register_vector_types
+
+load_dotenv()
+
+# --- Configuration ---
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": int(os.getenv("DB_PORT", 5432)),
+    "dbname": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+}
+
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))        # seconds to wait for a free connection
+POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 300))     # close idle connections above min_size
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 3600))
+
+_pool: Optional[AsyncConnectionPool] = None
+_pool_lock = asyncio.Lock()
+
+
+async def _configure_connection(conn):
+    """Register pgvector types when the pool opens a new connection.
+    ANN settings (probes / ef_search) are set per transaction by `sql.vector_index.apply_search_settings`."""
+    await conn.set_autocommit(True)
+    await register_vector_types(conn)
+    await conn.set_autocommit(False)
+
+
+async def init_pool(min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE) -> AsyncConnectionPool:
+    """
+    Create and open the shared connection pool (idempotent).
+    Called from the FastAPI lifespan hook; also opened lazily on first use.
+    """
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            return _pool
+        pool = AsyncConnectionPool(
+            conninfo="",
+            kwargs=DB_CONFIG,
+            min_size=min_size,
+            max_size=max_size,
+            timeout=POOL_TIMEOUT,
+            max_idle=POOL_MAX_IDLE,
+            max_lifetime=POOL_MAX_LIFETIME,
+            configure=_configure_connection,
+            check=AsyncConnectionPool.check_connection,  # health check on checkout
+            name="torob-db",
+            open=False,
+        )
+        await pool.open(wait=True)
+        _pool = pool
+        print(f"[DB] Connection pool opened (min={min_size}, max={max_size})")
+        return _pool
+
+
+async def close_pool():
+    """Close the shared pool. Safe to call if it was never opened."""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            return
+        await _pool.close()
+        _pool = None
+        print("[DB] Connection pool closed")
+
+
+@asynccontextmanager
+async def connection():
+    """
+    Borrow a connection from the shared pool.
+    The transaction is committed on exit, or rolled back if an exception is raised.
+    """
+    pool = _pool or await init_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+def pool_stats() -> dict:
+    """Return the pool counters (size, waiting, requests, errors, ...)."""
+    return _pool.get_stats() if _pool is not None else {}
@@ -0,0 +1,180 @@
+# embedding_cache.py
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+from sql.db_pool import connection
+from sql.vector_adapter import as_vector
+from utils.utils import preprocess_persian
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 5000))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", 24 * 3600))  # seconds
+EMBEDDING_CACHE_PERSIST = os.getenv("EMBEDDING_CACHE_PERSIST", "0") == "1"
+EMBEDDING_CACHE_FLUSH_BATCH = 100
+
+
+def normalize_embedding_text(text: str) -> str:
+    """Cache key text: Persian-normalized, whitespace-collapsed."""
+    return preprocess_persian(text or "")
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings, keyed by (model, normalized text).
+
+    1. In-memory LRU bounded by `max_size` entries and `ttl` seconds. Lookups
+       only ever touch this tier, so a miss costs just the embeddings call.
+    2. Optional Postgres table `embedding_cache` (EMBEDDING_CACHE_PERSIST=1).
+       New entries are written in the background (batched, off the request
+       path); the newest rows are loaded into the LRU at startup.
+
+    The table is a warm-start store, not a lookup tier: it is read only by
+    `preload`, so an entry embedded by another worker is seen here after the
+    next restart. A per-miss SELECT would add a round trip to every miss for
+    the rare query that another worker embedded since startup.
+    """
+
+    def __init__(self, max_size: int = EMBEDDING_CACHE_SIZE, ttl: float = EMBEDDING_CACHE_TTL,
+                 persist: bool = EMBEDDING_CACHE_PERSIST):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist = persist
+        self._lru: OrderedDict[tuple[str, str], tuple[float, np.ndarray]] = OrderedDict()
+        self._unsaved: list[tuple[str, str, str, np.ndarray]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.memory_hits = 0
+        self.misses = 0
+        self.preloaded = 0
+        self.rows_persisted = 0
+        self.persist_failures = 0
+
+    # ------ Memory tier ------
+    def get_memory(self, model: str, text: str) -> Optional[np.ndarray]:
+        key = (model, text)
+        item = self._lru.get(key)
+        if item is None:
+            return None
+        stored_at, embedding = item
+        if time.monotonic() - stored_at > self.ttl:
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return embedding
+
+    def put_memory(self, model: str, text: str, embedding: np.ndarray, stored_at: Optional[float] = None):
+        key = (model, text)
+        self._lru[key] = (time.monotonic() if stored_at is None else stored_at, embedding)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    # ------ Both tiers ------
+    async def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        embedding = self.get_memory(model, text)
+        if embedding is not None:
+            self.memory_hits += 1
+            return embedding
+        self.misses += 1
+        return None
+
+    async def put(self, model: str, text: str, embedding: np.ndarray):
+        """Store in memory now; the table insert is queued for the background flusher."""
+        self.put_memory(model, text, embedding)
+        if not self.persist:
+            return
+        self._unsaved.append((model, _text_hash(text), text, as_vector(embedding)))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush(), name="embedding-cache-flush")
+
+    async def _flush(self):
+        while self._unsaved:
+            batch = self._unsaved[:EMBEDDING_CACHE_FLUSH_BATCH]
+            self._unsaved = self._unsaved[EMBEDDING_CACHE_FLUSH_BATCH:]
+            try:
+                async with connection() as conn:
+                    async with conn.cursor() as cur:
+                        await cur.executemany(
+                            """
+                            INSERT INTO embedding_cache (model, text_hash, text, embedding)
+                            VALUES (%s, %s, %s, %b)
+                            ON CONFLICT (model, text_hash) DO NOTHING
+                            """,
+                            batch,
+                        )
+                self.rows_persisted += len(batch)
+            except Exception as e:
+                self.persist_failures += len(batch)
+                print(f"[ERROR] Embedding cache insert failed: {e}")
+
+    async def drain(self):
+        """Wait for queued inserts (called at shutdown, before the pool closes)."""
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._unsaved:
+            await self._flush()
+
+    async def preload(self):
+        """Fill the LRU with the newest unexpired rows of the table."""
+        if not self.persist:
+            return
+        async with connection() as conn:
+            cur = await conn.execute(
+                """
+                SELECT model, text, embedding, EXTRACT(EPOCH FROM now() - created_at)
+                FROM embedding_cache
+                WHERE created_at > now() - make_interval(secs => %s)
+                ORDER BY created_at DESC
+                LIMIT %s
+                """,
+                (self.ttl, self.max_size),
+                binary=True,  # decoded directly into numpy arrays
+            )
+            rows = await cur.fetchall()
+        now = time.monotonic()
+        for model, text, embedding, age in reversed(rows):  # oldest first, newest ends most recent
+            self.put_memory(model, text, as_vector(embedding), stored_at=now - float(age))
+        self.preloaded = len(rows)
+        print(f"[EMBEDDING_CACHE] Preloaded {len(rows)} embeddings")
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.misses
+        return {
+            "size": len(self._lru),
+            "memory_hits": self.memory_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.memory_hits / lookups, 4) if lookups else 0.0,
+            "preloaded": self.preloaded,
+            "unsaved": len(self._unsaved),
+            "rows_persisted": self.rows_persisted,
+            "persist_failures": self.persist_failures,
+        }
+
+
+async def init_embedding_cache_table():
+    if not EMBEDDING_CACHE_PERSIST:
+        return
+    async with connection() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                embedding vector NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT now(),
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        # `preload` reads the newest rows
+        await conn.execute("CREATE INDEX IF NOT EXISTS embedding_cache_created_at_idx ON embedding_cache (created_at)")
+
+
+# Process-wide cache used by get_embedding
+embedding_cache = EmbeddingCache()
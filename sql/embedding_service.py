@@ -0,0 +1,111 @@
+# embedding_service.py
+import os
+import asyncio
+from typing import Optional, List
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+from utils.http_client import get_http_client
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("API_KEY")
+BASE_URL = os.getenv("BASE_URL")
+
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 64))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", 5))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+
+
+class EmbeddingBatcher:
+    """
+    Async embedding client that micro-batches concurrent requests.
+
+    Calls to `embed` from all in-flight chats are collected for up to
+    `max_wait_ms` (or until `max_batch_size` texts are waiting) and sent as a
+    single `embeddings.create(input=[...])` call. Each caller gets its own
+    vector back. At most `max_concurrency` batch requests are in flight.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_batch_size: int = EMBEDDING_MAX_BATCH_SIZE,
+        max_wait_ms: float = EMBEDDING_MAX_WAIT_MS,
+        max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrency = max_concurrency
+
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: set[asyncio.Task] = set()
+        self._client: Optional[AsyncOpenAI] = None
+        self._http_client = None
+
+        self.requests = 0
+        self.batches_sent = 0
+        self.texts_sent = 0
+
+    def _get_client(self) -> AsyncOpenAI:
+        # Follow the shared HTTP client if it was recreated (e.g. after shutdown)
+        http_client = get_http_client()
+        if self._client is None or self._http_client is not http_client:
+            self._client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=BASE_URL, http_client=http_client)
+            self._http_client = http_client
+        return self._client
+
+    async def embed(self, text: str) -> List[float]:
+        """Return the embedding of one text, batched with concurrent callers."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._dispatch)
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts; they are queued together so they share a batch."""
+        return list(await asyncio.gather(*(self.embed(t) for t in texts)))
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        while batch:
+            chunk, batch = batch[:self.max_batch_size], batch[self.max_batch_size:]
+            task = asyncio.create_task(self._send(chunk))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future]]):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        texts = list(dict.fromkeys(text for text, _ in batch))  # dedupe, keep order
+        try:
+            async with self._semaphore:
+                response = await self._get_client().embeddings.create(model=self.model, input=texts)
+            by_text = {texts[item.index]: item.embedding for item in response.data}
+            self.batches_sent += 1
+            self.texts_sent += len(texts)
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(by_text[text])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches_sent": self.batches_sent,
+            "texts_sent": self.texts_sent,
+            "avg_batch_size": round(self.texts_sent / self.batches_sent, 2) if self.batches_sent else 0.0,
+        }
@@ -0,0 +1,153 @@
+# hybrid_search.py
+"""
+Hybrid lexical + vector retrieval over product_embed.
+
+Exact model numbers and brand tokens ("A55", "SM-G991", "ایسوس") are often
+ranked poorly by the embedding alone. The hybrid query takes the top
+HYBRID_POOL products from the vector ANN index and the top HYBRID_POOL from
+a trigram index on the normalized persian_name, and fuses the two rankings
+with reciprocal-rank fusion (score = sum 1 / (HYBRID_RRF_K + rank)) in a
+single statement.
+
+Names are normalized in SQL (`normalize_persian_name`, mirroring
+utils.preprocess_persian: Arabic letter variants, Persian/Arabic digits,
+ZWNJ, case), so the expression index matches the normalized query.
+
+Usage:
+    python -m sql.hybrid_search setup     # normalize function + trigram index
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import argparse
+from time import perf_counter
+from typing import Optional
+import numpy as np
+import psycopg
+from sql.db_pool import DB_CONFIG
+from sql.vector_index import apply_search_settings, HNSW_EF_SEARCH
+from utils.utils import NORMALIZATION_MAP, PERSIAN_DIGITS, ARABIC_DIGITS, ENGLISH_DIGITS
+
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "0") == "1"
+HYBRID_POOL = int(os.getenv("HYBRID_POOL", 50))                 # candidates taken from each ranking
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+HYBRID_LEXICAL_THRESHOLD = float(os.getenv("HYBRID_LEXICAL_THRESHOLD", 0.4))  # pg_trgm word_similarity
+
+# Same mapping as utils.preprocess_persian; ZWNJ becomes a space, tatweel is dropped
+_NORMALIZE_FROM = "".join(NORMALIZATION_MAP) + PERSIAN_DIGITS + ARABIC_DIGITS + "\u200c" + "ـ"
+_NORMALIZE_TO = "".join(NORMALIZATION_MAP.values()) + ENGLISH_DIGITS * 2 + " "
+
+HYBRID_SETUP_DDL = f"""
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION normalize_persian_name(name TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT lower(btrim(regexp_replace(
+        translate(coalesce(name, ''), '{_NORMALIZE_FROM}', '{_NORMALIZE_TO}'),
+        '\\s+', ' ', 'g')))
+$$;
+"""
+
+# Built separately: CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+HYBRID_INDEX = ("product_embed_name_trgm_idx",
+                "INDEX {name} ON product_embed USING gin (normalize_persian_name(persian_name) gin_trgm_ops)")
+
+HYBRID_SQL = """
+WITH q AS (
+    SELECT normalize_persian_name(%(query)s) AS text
+),
+vec AS (
+    SELECT random_key, row_number() OVER (ORDER BY dist) AS rank
+    FROM (
+        SELECT pe.random_key, pe.embedding <=> %(query_vector)b AS dist
+        FROM product_embed pe
+        ORDER BY pe.embedding <=> %(query_vector)b
+        LIMIT %(pool)s
+    ) ann
+),
+lex AS (
+    SELECT random_key, row_number() OVER (ORDER BY score DESC) AS rank
+    FROM (
+        SELECT pe.random_key,
+               word_similarity(q.text, normalize_persian_name(pe.persian_name)) AS score
+        FROM product_embed pe, q
+        WHERE q.text <%% normalize_persian_name(pe.persian_name)
+        ORDER BY score DESC
+        LIMIT %(pool)s
+    ) trgm
+),
+fused AS (
+    SELECT random_key, sum(1.0 / (%(rrf_k)s + rank)) AS rrf
+    FROM (SELECT * FROM vec UNION ALL SELECT * FROM lex) ranks
+    GROUP BY random_key
+    ORDER BY rrf DESC
+    LIMIT %(top_k)s
+)
+SELECT pe.random_key,
+       pe.persian_name,
+       1 - (pe.embedding <=> %(query_vector)b) AS similarity
+FROM fused f
+JOIN product_embed pe ON pe.random_key = f.random_key
+ORDER BY f.rrf DESC
+"""
+
+hybrid_stats = {
+    "searches": 0,
+    "total_ms": 0.0,
+}
+
+
+def setup_hybrid_search(concurrently: bool = True):
+    """Create the normalize function and the trigram index on the normalized names."""
+    with psycopg.connect(**DB_CONFIG, autocommit=True) as conn:
+        conn.execute(HYBRID_SETUP_DDL)
+        name, definition = HYBRID_INDEX
+        create = "CREATE " + definition.format(name=name).replace(
+            "INDEX", "INDEX CONCURRENTLY IF NOT EXISTS" if concurrently else "INDEX IF NOT EXISTS", 1)
+        t0 = perf_counter()
+        conn.execute(create)
+        print(f"[HYBRID] {name} ready in {perf_counter() - t0:.1f}s")
+        conn.execute("ANALYZE product_embed")
+
+
+async def hybrid_search(cur, query: str, query_vector: np.ndarray, top_k: int,
+                        probes: Optional[int] = None, ef_search: Optional[int] = None) -> list:
+    """
+    Reciprocal-rank fusion of the vector ANN and trigram rankings.
+    Returns [(random_key, persian_name, similarity), ...] ordered by fused rank;
+    `similarity` is still the cosine similarity, so thresholds on it keep working.
+    """
+    t0 = perf_counter()
+    pool = max(HYBRID_POOL, top_k)
+    # HNSW returns at most ef_search rows per scan
+    await apply_search_settings(cur, probes=probes, ef_search=max(ef_search or HNSW_EF_SEARCH, pool))
+    await cur.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                      (str(HYBRID_LEXICAL_THRESHOLD),))
+    await cur.execute(HYBRID_SQL, {
+        "query": query,
+        "query_vector": query_vector,
+        "pool": pool,
+        "rrf_k": HYBRID_RRF_K,
+        "top_k": top_k,
+    })
+    results = await cur.fetchall()
+    hybrid_stats["searches"] += 1
+    hybrid_stats["total_ms"] += (perf_counter() - t0) * 1000
+    return results
+
+
+def hybrid_search_stats() -> dict:
+    n = hybrid_stats["searches"]
+    return {
+        "enabled": HYBRID_SEARCH,
+        "searches": n,
+        "avg_ms": round(hybrid_stats["total_ms"] / n, 2) if n else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hybrid lexical + vector search setup")
+    parser.add_argument("command", choices=["setup"])
+    parser.add_argument("--blocking", action="store_true",
+                        help="Do not use CONCURRENTLY (faster, but locks the table)")
+    args = parser.parse_args()
+    setup_hybrid_search(concurrently=not args.blocking)
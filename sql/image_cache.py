@@ -0,0 +1,189 @@
+# image_cache.py
+import os
+import json
+import time
+import asyncio
+import threading
+import hashlib
+from collections import OrderedDict
+from typing import Optional, Hashable
+import numpy as np
+
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", 2000))
+IMAGE_CACHE_RESULT_TTL = float(os.getenv("IMAGE_CACHE_RESULT_TTL", 3600))  # seconds
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "")                          # "" = memory only
+
+
+class _LRU:
+    """Bounded LRU with a per-entry TTL (None = no expiry)."""
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict[Hashable, tuple[float, object]] = OrderedDict()
+
+    def get(self, key: Hashable):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        stored_at, value = item
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value):
+        self._items[key] = (time.monotonic(), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def _file_key(*parts) -> str:
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """
+    Cache for the image path, keyed by the content hash of the decoded image bytes
+    (`IngestedImage.content_hash`), so retries and the same photo in other chats
+    skip the CLIP forward pass and the image_embedding query.
+
+    - embeddings: (encoder, content hash) -> CLIP vector; never expires.
+    - results: (content hash, search parameters) -> top-k rows; expire after
+      `result_ttl` seconds so catalogue changes show up.
+
+    Both live in an in-memory LRU. With `disk_dir` set they are also written to
+    `<disk_dir>/embeddings/*.npy` and `<disk_dir>/results/*.json` (atomic
+    replace), shared by all workers and kept across restarts; disk hits are
+    promoted to memory.
+    """
+
+    def __init__(self, max_size: int = IMAGE_CACHE_SIZE, result_ttl: float = IMAGE_CACHE_RESULT_TTL,
+                 disk_dir: str = IMAGE_CACHE_DIR):
+        self.result_ttl = result_ttl
+        self.disk_dir = disk_dir
+        self._embeddings = _LRU(max_size)
+        self._results = _LRU(max_size, ttl=result_ttl)
+        if disk_dir:
+            os.makedirs(os.path.join(disk_dir, "embeddings"), exist_ok=True)
+            os.makedirs(os.path.join(disk_dir, "results"), exist_ok=True)
+
+        self.embedding_hits = 0
+        self.embedding_disk_hits = 0
+        self.embedding_misses = 0
+        self.result_hits = 0
+        self.result_disk_hits = 0
+        self.result_misses = 0
+
+    # ------ Disk tier ------
+    def _path(self, kind: str, key: tuple) -> str:
+        return os.path.join(self.disk_dir, kind, _file_key(*key) + (".npy" if kind == "embeddings" else ".json"))
+
+    @staticmethod
+    def _write_atomic(path: str, write):
+        # Unique per thread: concurrent asyncio.to_thread writes of the same key must not share a temp file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+
+    def _load_embedding(self, key: tuple) -> Optional[np.ndarray]:
+        try:
+            return np.load(self._path("embeddings", key))
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+    def _store_embedding(self, key: tuple, embedding: np.ndarray):
+        self._write_atomic(self._path("embeddings", key), lambda f: np.save(f, embedding))
+
+    def _load_results(self, key: tuple) -> Optional[list]:
+        try:
+            with open(self._path("results", key), encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        if time.time() - data["stored_at"] > self.result_ttl:
+            return None
+        return [tuple(row) for row in data["rows"]]
+
+    def _store_results(self, key: tuple, rows: list):
+        payload = json.dumps({"stored_at": time.time(), "rows": [list(row) for row in rows]},
+                             ensure_ascii=False, default=float).encode("utf-8")
+        self._write_atomic(self._path("results", key), lambda f: f.write(payload))
+
+    # ------ Embeddings ------
+    async def get_embedding(self, encoder: str, content_hash: str) -> Optional[np.ndarray]:
+        key = (encoder, content_hash)
+        embedding = self._embeddings.get(key)
+        if embedding is not None:
+            self.embedding_hits += 1
+            return embedding
+        if self.disk_dir:
+            embedding = await asyncio.to_thread(self._load_embedding, key)
+            if embedding is not None:
+                self._embeddings.put(key, embedding)
+                self.embedding_disk_hits += 1
+                return embedding
+        self.embedding_misses += 1
+        return None
+
+    async def put_embedding(self, encoder: str, content_hash: str, embedding: np.ndarray):
+        key = (encoder, content_hash)
+        self._embeddings.put(key, embedding)
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._store_embedding, key, embedding)
+            except OSError as e:
+                print(f"[ERROR] Image cache write failed: {e}")
+
+    # ------ Search results ------
+    async def get_results(self, content_hash: str, params: tuple) -> Optional[list]:
+        key = (content_hash, params)
+        rows = self._results.get(key)
+        if rows is not None:
+            self.result_hits += 1
+            return rows
+        if self.disk_dir:
+            rows = await asyncio.to_thread(self._load_results, key)
+            if rows is not None:
+                self._results.put(key, rows)
+                self.result_disk_hits += 1
+                return rows
+        self.result_misses += 1
+        return None
+
+    async def put_results(self, content_hash: str, params: tuple, rows: list):
+        key = (content_hash, params)
+        self._results.put(key, rows)
+        if self.disk_dir:
+            try:
+                await asyncio.to_thread(self._store_results, key, rows)
+            except OSError as e:
+                print(f"[ERROR] Image cache write failed: {e}")
+
+    def stats(self) -> dict:
+        embedding_lookups = self.embedding_hits + self.embedding_disk_hits + self.embedding_misses
+        result_lookups = self.result_hits + self.result_disk_hits + self.result_misses
+        return {
+            "embeddings": len(self._embeddings),
+            "results": len(self._results),
+            "embedding_hits": self.embedding_hits,
+            "embedding_disk_hits": self.embedding_disk_hits,
+            "embedding_misses": self.embedding_misses,
+            "embedding_hit_rate": (round((self.embedding_hits + self.embedding_disk_hits) / embedding_lookups, 4)
+                                   if embedding_lookups else 0.0),
+            "result_hits": self.result_hits,
+            "result_disk_hits": self.result_disk_hits,
+            "result_misses": self.result_misses,
+            "result_hit_rate": (round((self.result_hits + self.result_disk_hits) / result_lookups, 4)
+                                if result_lookups else 0.0),
+        }
+
+
+# Process-wide cache used by similarity_search_image
+image_cache = ImageCache()
@@ -0,0 +1,285 @@
+# local_index.py
+"""
+In-process IVF index over product_embed, stored as memory-mapped files.
+
+Built offline from product_embed:
+    python -m sql.local_index build [--lists 1000]
+    python -m sql.local_index status
+
+Layout of LOCAL_INDEX_DIR:
+    CURRENT                 name of the published version (replaced atomically)
+    v<timestamp>-<pid>/
+        meta.json           rows, dim, lists, build time
+        centroids.npy       (lists, dim) float32, unit length
+        list_offsets.npy    (lists + 1,) int64; rows of list i are [off[i], off[i+1])
+        vectors.npy         (rows, dim) float32, unit length, grouped by list
+        keys.bin / keys_offsets.npy     UTF-8 random_keys
+        names.bin / names_offsets.npy   UTF-8 persian_names
+
+Every file is opened with mmap, so several uvicorn workers share one copy
+through the page cache. A new build is written to a fresh version directory
+and published by replacing CURRENT; workers notice the new pointer within
+LOCAL_INDEX_CHECK_INTERVAL seconds and swap to it between searches.
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import json
+import shutil
+import argparse
+import threading
+from time import time, monotonic, perf_counter
+from typing import Optional, List, Tuple
+import numpy as np
+import psycopg
+from pgvector.psycopg import register_vector
+from sql.db_pool import DB_CONFIG
+from sql.vector_adapter import as_vector
+
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "")                    # "" = disabled
+LOCAL_INDEX_CHECK_INTERVAL = float(os.getenv("LOCAL_INDEX_CHECK_INTERVAL", 30))  # seconds
+LOCAL_INDEX_DEFAULT_PROBES = int(os.getenv("LOCAL_INDEX_PROBES", 20))
+LOCAL_INDEX_KEEP_VERSIONS = 2
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+
+
+# ------ Offline build ------
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12)
+
+
+def _write_strings(path: str, values: List[str]):
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    with open(path + ".bin", "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(path + "_offsets.npy", offsets)
+
+
+def _kmeans(vectors: np.ndarray, lists: int, seed: int = 42) -> np.ndarray:
+    """Spherical k-means on a sample of `vectors`. Returns unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), lists * KMEANS_SAMPLE_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(lists):
+            members = sample[assign == i]
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+            else:  # re-seed empty lists
+                centroids[i] = sample[rng.integers(len(sample))]
+        centroids = _normalize(centroids)
+    return centroids.astype(np.float32)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    return np.concatenate([
+        np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1)
+        for i in range(0, len(vectors), chunk)
+    ])
+
+
+def build_local_index(root: str = LOCAL_INDEX_DIR, lists: int = 0) -> dict:
+    """Build a new index version from product_embed and publish it."""
+    if not root:
+        raise ValueError("LOCAL_INDEX_DIR is not set")
+    t0 = perf_counter()
+    with psycopg.connect(**DB_CONFIG) as conn:
+        register_vector(conn)
+        with conn.cursor(binary=True) as cur:
+            cur.execute("""
+                SELECT random_key, persian_name, embedding
+                FROM product_embed
+                WHERE embedding IS NOT NULL
+            """)
+            rows = cur.fetchall()
+    keys = [row[0] for row in rows]
+    names = [row[1] or "" for row in rows]
+    vectors = _normalize(np.stack([as_vector(row[2]) for row in rows])).astype(np.float32)
+    del rows
+
+    n, dim = vectors.shape
+    if not lists:
+        lists = max(1, int(n ** 0.5)) if n > 1_000_000 else max(1, n // 1000)
+    centroids = _kmeans(vectors, lists)
+    assign = _assign(vectors, centroids)
+    order = np.argsort(assign, kind="stable")
+    list_offsets = np.zeros(lists + 1, dtype=np.int64)
+    list_offsets[1:] = np.cumsum(np.bincount(assign, minlength=lists))
+
+    # pid suffix: two builds in the same second get distinct names that still sort by time
+    version = f"v{int(time())}-{os.getpid():07d}"
+    tmp_dir = os.path.join(root, f".{version}.tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "centroids.npy"), centroids)
+    np.save(os.path.join(tmp_dir, "list_offsets.npy"), list_offsets)
+    np.save(os.path.join(tmp_dir, "vectors.npy"), vectors[order])
+    _write_strings(os.path.join(tmp_dir, "keys"), [keys[i] for i in order])
+    _write_strings(os.path.join(tmp_dir, "names"), [names[i] for i in order])
+    meta = {"version": version, "rows": n, "dim": dim, "lists": lists,
+            "built_at": int(time()), "build_seconds": round(perf_counter() - t0, 2)}
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+    os.replace(tmp_dir, os.path.join(root, version))
+    publish_version(root, version)
+    _prune_versions(root, keep=LOCAL_INDEX_KEEP_VERSIONS)
+    print(f"[LOCAL_INDEX] Built and published: {meta}")
+    return meta
+
+
+def publish_version(root: str, version: str):
+    """Point CURRENT at `version` atomically (readers see either the old or the new name)."""
+    tmp = os.path.join(root, "CURRENT.tmp")
+    with open(tmp, "w") as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(root, "CURRENT"))
+
+
+def _prune_versions(root: str, keep: int):
+    # Workers still mapping an old version keep their pages after the files are unlinked
+    versions = sorted(d for d in os.listdir(root) if d.startswith("v") and os.path.isdir(os.path.join(root, d)))
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+
+# ------ Search ------
+class _IndexVersion:
+    """One mapped index version (read-only, shared by all threads)."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self.centroids = np.asarray(load("centroids.npy"))  # small, keep in memory
+        self.list_offsets = np.asarray(load("list_offsets.npy"))
+        self.vectors = load("vectors.npy")
+        self.keys, self.key_offsets = self._map_strings(path, "keys")
+        self.names, self.name_offsets = self._map_strings(path, "names")
+
+    @staticmethod
+    def _map_strings(path: str, name: str):
+        blob_path = os.path.join(path, name + ".bin")
+        # np.memmap cannot map an empty file
+        blob = (np.memmap(blob_path, dtype=np.uint8, mode="r")
+                if os.path.getsize(blob_path) else np.zeros(0, np.uint8))
+        return blob, np.load(os.path.join(path, name + "_offsets.npy"), mmap_mode="r")
+
+    @staticmethod
+    def _string(blob, offsets, i: int) -> str:
+        return bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+    def search(self, query_vector: np.ndarray, top_k: int, probes: int) -> List[Tuple[str, str, float]]:
+        query = as_vector(query_vector)
+        query = query / (np.linalg.norm(query) + 1e-12)
+        probes = min(max(1, probes), len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+
+        rows, scores = [], []
+        for i in lists:
+            start, end = self.list_offsets[i], self.list_offsets[i + 1]
+            if end > start:
+                rows.append(np.arange(start, end))
+                scores.append(self.vectors[start:end] @ query)
+        if not rows:
+            return []
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [
+            (self._string(self.keys, self.key_offsets, r),
+             self._string(self.names, self.name_offsets, r),
+             float(scores[b]))
+            for b, r in ((b, rows[b]) for b in best)
+        ]
+
+
+class LocalProductIndex:
+    """Memory-mapped product index that follows the CURRENT pointer of `root`."""
+
+    def __init__(self, root: str = LOCAL_INDEX_DIR, check_interval: float = LOCAL_INDEX_CHECK_INTERVAL):
+        self.root = root
+        self.check_interval = check_interval
+        self._current: Optional[_IndexVersion] = None
+        self._version: Optional[str] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.swaps = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def _published_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, "CURRENT")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def maybe_reload(self, force: bool = False) -> bool:
+        """Map the published version if it changed. Returns True when a swap happened."""
+        if not self.enabled or (not force and monotonic() < self._next_check):
+            return False
+        with self._lock:
+            self._next_check = monotonic() + self.check_interval
+            version = self._published_version()
+            if version is None or version == self._version:
+                return False
+            try:
+                loaded = _IndexVersion(os.path.join(self.root, version))
+            except Exception as e:
+                print(f"[LOCAL_INDEX] Failed to load {version}: {e}")
+                return False
+            # Single reference swap: in-flight searches keep using the old version
+            self._current, self._version = loaded, version
+            self.swaps += 1
+            print(f"[LOCAL_INDEX] Using {version} ({loaded.meta['rows']} rows)")
+            return True
+
+    @property
+    def ready(self) -> bool:
+        self.maybe_reload()
+        return self._current is not None
+
+    def search(self, query_vector: np.ndarray, top_k: int = 5,
+               probes: Optional[int] = None) -> List[Tuple[str, str, float]]:
+        """Same result shape as similarity_search: [(random_key, persian_name, similarity), ...]."""
+        self.maybe_reload()
+        index = self._current
+        if index is None:
+            raise RuntimeError("local index is not loaded")
+        self.searches += 1
+        return index.search(query_vector, top_k, probes or LOCAL_INDEX_DEFAULT_PROBES)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "version": self._version,
+            "rows": self._current.meta["rows"] if self._current is not None else 0,
+            "searches": self.searches,
+            "swaps": self.swaps,
+        }
+
+
+local_product_index = LocalProductIndex()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process product index")
+    parser.add_argument("command", choices=["build", "status"])
+    parser.add_argument("--dir", default=LOCAL_INDEX_DIR)
+    parser.add_argument("--lists", type=int, default=0, help="IVF lists (0 = rows / 1000)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        os.makedirs(args.dir, exist_ok=True)
+        build_local_index(args.dir, args.lists)
+    index = LocalProductIndex(args.dir)
+    index.maybe_reload(force=True)
+    print(index.stats())
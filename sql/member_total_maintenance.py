@@ -0,0 +1,127 @@
+# member_total_maintenance.py
+"""
+Indexes and refresh for the member_total materialized view.
+
+Usage:
+    python -m sql.member_total_maintenance create-indexes
+    python -m sql.member_total_maintenance refresh
+    python -m sql.member_total_maintenance stats
+
+The app can also refresh on a schedule: set MEMBER_TOTAL_REFRESH_INTERVAL
+(seconds, 0 = disabled) and `refresh_loop` is started from the lifespan hook.
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import asyncio
+import argparse
+from time import perf_counter
+import psycopg
+from sql.db_pool import DB_CONFIG
+
+MEMBER_TOTAL_REFRESH_INTERVAL = float(os.getenv("MEMBER_TOTAL_REFRESH_INTERVAL", 0))
+
+# (name, definition). The unique index is what allows REFRESH ... CONCURRENTLY.
+MEMBER_TOTAL_INDEXES = [
+    ("member_total_member_key_uidx", "UNIQUE INDEX {name} ON member_total (member_random_key)"),
+    ("member_total_base_price_idx", "INDEX {name} ON member_total (base_random_key, price)"),
+    ("member_total_price_idx", "INDEX {name} ON member_total (price)"),
+    ("member_total_city_price_idx", "INDEX {name} ON member_total (city, price)"),
+    ("member_total_brand_price_idx", "INDEX {name} ON member_total (brand_title, price)"),
+    ("member_total_shop_price_idx", "INDEX {name} ON member_total (shop_id, price)"),
+    ("member_total_warranty_score_idx", "INDEX {name} ON member_total (has_warranty, score)"),
+    # Key existence (extra_features ? key)
+    ("member_total_features_gin_idx", "INDEX {name} ON member_total USING gin (extra_features)"),
+    # Substring match on feature values (extra_features::text ILIKE '%value%')
+    ("member_total_features_trgm_idx", "INDEX {name} ON member_total USING gin ((extra_features::text) gin_trgm_ops)"),
+]
+
+
+def _connect():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    return psycopg.connect(**DB_CONFIG, autocommit=True)
+
+
+def create_member_total_indexes(concurrently: bool = True) -> list[str]:
+    """Create every index in MEMBER_TOTAL_INDEXES that does not exist yet. Returns the names created."""
+    created = []
+    with _connect() as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        existing = {
+            row[0] for row in conn.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'member_total'"
+            ).fetchall()
+        }
+        for name, definition in MEMBER_TOTAL_INDEXES:
+            if name in existing:
+                continue
+            create = "CREATE " + definition.format(name=name)
+            if concurrently:
+                create = create.replace(" INDEX ", " INDEX CONCURRENTLY ", 1)
+            t0 = perf_counter()
+            conn.execute(create)
+            print(f"[MEMBER_TOTAL] Created {name} in {perf_counter() - t0:.1f}s")
+            created.append(name)
+        conn.execute("ANALYZE member_total")
+    return created
+
+
+def refresh_member_total(concurrently: bool = True) -> dict:
+    """
+    Refresh member_total and re-analyze it (the candidate-shop planner relies on its statistics).
+    Returns duration, row count and size.
+    """
+    with _connect() as conn:
+        t0 = perf_counter()
+        conn.execute(
+            "REFRESH MATERIALIZED VIEW CONCURRENTLY member_total"
+            if concurrently else "REFRESH MATERIALIZED VIEW member_total"
+        )
+        refresh_s = perf_counter() - t0
+        conn.execute("ANALYZE member_total")
+        report = member_total_stats(conn)
+    report["refresh_seconds"] = round(refresh_s, 2)
+    report["concurrently"] = concurrently
+    print(f"[MEMBER_TOTAL] Refreshed: {report}")
+    return report
+
+
+def member_total_stats(conn=None) -> dict:
+    """Row count, total size and index count of member_total."""
+    own_conn = conn is None
+    conn = conn or _connect()
+    try:
+        rows = conn.execute("SELECT count(*) FROM member_total").fetchone()[0]
+        size, n_indexes = conn.execute("""
+            SELECT pg_size_pretty(pg_total_relation_size('member_total')),
+                   (SELECT count(*) FROM pg_indexes WHERE tablename = 'member_total')
+        """).fetchone()
+        return {"rows": rows, "total_size": size, "indexes": n_indexes}
+    finally:
+        if own_conn:
+            conn.close()
+
+
+async def refresh_loop(interval: float = MEMBER_TOTAL_REFRESH_INTERVAL):
+    """Refresh member_total every `interval` seconds (run as a background task)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(refresh_member_total)
+        except Exception as e:
+            print(f"[ERROR] member_total refresh failed: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="member_total maintenance")
+    parser.add_argument("command", choices=["create-indexes", "refresh", "stats"])
+    parser.add_argument("--blocking", action="store_true",
+                        help="Do not use CONCURRENTLY (faster, but locks the view)")
+    args = parser.parse_args()
+
+    if args.command == "create-indexes":
+        create_member_total_indexes(concurrently=not args.blocking)
+        print(member_total_stats())
+    elif args.command == "refresh":
+        refresh_member_total(concurrently=not args.blocking)
+    else:
+        print(member_total_stats())
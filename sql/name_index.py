@@ -0,0 +1,251 @@
+# name_index.py
+"""
+In-process trigram index over base_products.persian_name.
+
+Users often paste the exact Torob title. Those messages are answered from
+memory without an embedding request or a vector search:
+- exact: 64-bit hash of the normalized name, looked up with searchsorted;
+- near-exact: character trigrams of the query select candidates through an
+  inverted index (CSR arrays), which are scored by trigram Dice similarity,
+  or by how much of the title is contained in the message (for a title pasted
+  inside a question, when the title is at least NAME_INDEX_MIN_LENGTH_RATIO of
+  the message).
+
+Trigram scores are not cosine similarities: callers that compare scores with
+similarity_search thresholds must rescore near-exact candidates (see
+`TorobHybridAgent._initial_similarity_search`).
+
+The arrays are stored in a compact .npz snapshot (NAME_INDEX_SNAPSHOT) that is
+built offline and loaded at startup; without a snapshot the index stays off.
+
+Usage:
+    python -m sql.name_index build     # (re)build the snapshot from base_products
+    python -m sql.name_index lookup "<text>"
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import re
+import asyncio
+import argparse
+import hashlib
+from time import perf_counter
+from typing import Optional, List, Tuple
+import numpy as np
+import psycopg
+from sql.db_pool import DB_CONFIG
+from utils.utils import preprocess_persian
+
+NAME_INDEX_ENABLED = os.getenv("NAME_INDEX", "1") == "1"
+NAME_INDEX_SNAPSHOT = os.getenv("NAME_INDEX_SNAPSHOT", "name_index.npz")
+NAME_INDEX_MIN_SCORE = float(os.getenv("NAME_INDEX_MIN_SCORE", 0.9))
+NAME_INDEX_MIN_TITLE_CHARS = 12     # shorter titles must match the whole message, not be contained in it
+NAME_INDEX_MIN_LENGTH_RATIO = 0.5   # a contained title must also cover this share of the message
+NAME_INDEX_MAX_POSTING = 20000      # trigrams more common than this do not select candidates
+NAME_INDEX_MAX_CANDIDATES = 200
+
+
+def normalize_name(text: str) -> str:
+    text = preprocess_persian(text or "").replace("\u200c", " ").lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def trigrams(text: str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def _pack_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+# ------ Snapshot ------
+def build_snapshot(rows: List[Tuple[str, str]], path: str = NAME_INDEX_SNAPSHOT) -> dict:
+    """Build the index arrays from (random_key, persian_name) rows and save them to `path` (atomic replace)."""
+    t0 = perf_counter()
+    keys = [row[0] for row in rows]
+    names = [row[1] or "" for row in rows]
+    normalized = [normalize_name(n) for n in names]
+
+    vocab: dict = {}
+    tids, docs = [], []
+    for doc_id, text in enumerate(normalized):
+        for tg in trigrams(text):
+            tids.append(vocab.setdefault(tg, len(vocab)))
+            docs.append(doc_id)
+    tids = np.asarray(tids, dtype=np.int32)
+    order = np.argsort(tids, kind="stable")
+    post_docs = np.asarray(docs, dtype=np.int32)[order]
+    post_off = np.zeros(len(vocab) + 1, dtype=np.int64)
+    post_off[1:] = np.cumsum(np.bincount(tids, minlength=len(vocab)))
+
+    hashes = np.asarray([name_hash(t) for t in normalized], dtype=np.int64)
+    hash_order = np.argsort(hashes, kind="stable")
+
+    keys_blob, keys_off = _pack_strings(keys)
+    names_blob, names_off = _pack_strings(names)
+    norm_blob, norm_off = _pack_strings(normalized)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            keys_blob=keys_blob, keys_off=keys_off,
+            names_blob=names_blob, names_off=names_off,
+            norm_blob=norm_blob, norm_off=norm_off,
+            hashes=hashes[hash_order], hash_docs=hash_order.astype(np.int32),
+            vocab=np.asarray(list(vocab), dtype="<U3"), post_off=post_off, post_docs=post_docs,
+        )
+    os.replace(tmp, path)
+    report = {"rows": len(rows), "trigrams": len(vocab), "seconds": round(perf_counter() - t0, 2),
+              "bytes": os.path.getsize(path)}
+    print(f"[NAME_INDEX] Snapshot written to {path}: {report}")
+    return report
+
+
+def fetch_base_products() -> List[Tuple[str, str]]:
+    with psycopg.connect(**DB_CONFIG) as conn:
+        return conn.execute(
+            "SELECT random_key, persian_name FROM base_products WHERE persian_name IS NOT NULL"
+        ).fetchall()
+
+
+# ------ Lookup ------
+class NameIndex:
+    def __init__(self, snapshot: str = NAME_INDEX_SNAPSHOT, min_score: float = NAME_INDEX_MIN_SCORE):
+        self.snapshot = snapshot
+        self.min_score = min_score
+        self._data = None
+        self._vocab: dict = {}
+        self.lookups = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.total_us = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._data is not None
+
+    def load_snapshot(self, path: Optional[str] = None):
+        with np.load(path or self.snapshot) as npz:
+            data = {name: npz[name] for name in npz.files}
+        vocab = {tg: i for i, tg in enumerate(data["vocab"].tolist())}
+        self._data, self._vocab = data, vocab
+        print(f"[NAME_INDEX] Loaded {len(data['hashes'])} names, {len(vocab)} trigrams")
+
+    async def load(self):
+        """Load the snapshot written by `python -m sql.name_index build` (the index stays off without one)."""
+        if not NAME_INDEX_ENABLED:
+            return
+        if not os.path.exists(self.snapshot):
+            print(f"[NAME_INDEX] {self.snapshot} not found, run `python -m sql.name_index build`; index disabled")
+            return
+        await asyncio.to_thread(self.load_snapshot)
+
+    def _string(self, field: str, i: int) -> str:
+        blob, off = self._data[f"{field}_blob"], self._data[f"{field}_off"]
+        return blob[off[i]:off[i + 1]].tobytes().decode("utf-8")
+
+    def _result(self, doc: int, score: float) -> tuple:
+        return (self._string("keys", doc), self._string("names", doc), round(score, 4))
+
+    def lookup(self, text: str, top_k: int = 5) -> Tuple[List[tuple], bool]:
+        """
+        Best title matches for `text` as ([(random_key, persian_name, score), ...], exact).
+        `exact` is True only for normalized-hash hits (score 1.0); otherwise the scores are
+        trigram scores in [0, 1].
+        """
+        if self._data is None:
+            return [], False
+        data = self._data
+        query = normalize_name(text)
+        if not query:
+            return [], False
+
+        h = name_hash(query)
+        lo = np.searchsorted(data["hashes"], h, side="left")
+        hi = np.searchsorted(data["hashes"], h, side="right")
+        exact = [int(d) for d in data["hash_docs"][lo:hi] if self._string("norm", int(d)) == query]
+        if exact:
+            return [self._result(d, 1.0) for d in exact[:top_k]], True
+
+        query_tris = trigrams(query)
+        post_off, post_docs = data["post_off"], data["post_docs"]
+        postings = []
+        for tg in query_tris:
+            tid = self._vocab.get(tg)
+            if tid is not None and post_off[tid + 1] - post_off[tid] <= NAME_INDEX_MAX_POSTING:
+                postings.append(post_docs[post_off[tid]:post_off[tid + 1]])
+        if not postings:
+            return [], False
+        docs, counts = np.unique(np.concatenate(postings), return_counts=True)
+        if len(docs) > NAME_INDEX_MAX_CANDIDATES:
+            keep = np.argpartition(-counts, NAME_INDEX_MAX_CANDIDATES - 1)[:NAME_INDEX_MAX_CANDIDATES]
+            docs = docs[keep]
+
+        scored = []
+        for doc in docs.tolist():
+            title = self._string("norm", doc)
+            title_tris = trigrams(title)
+            shared = len(query_tris & title_tris)
+            score = 2 * shared / (len(query_tris) + len(title_tris))
+            if len(title) >= max(NAME_INDEX_MIN_TITLE_CHARS, NAME_INDEX_MIN_LENGTH_RATIO * len(query)):
+                score = max(score, shared / len(title_tris))  # title pasted inside a longer message
+            scored.append((score, len(title), doc))
+        scored.sort(reverse=True)  # ties: the longer (more specific) title first
+        return [self._result(doc, score) for score, _, doc in scored[:top_k]], False
+
+    def match(self, text: str, top_k: int = 5) -> Optional[Tuple[List[tuple], bool]]:
+        """`lookup` results if the best one is a confident match (score >= min_score), else None."""
+        if self._data is None:
+            return None
+        t0 = perf_counter()
+        results, exact = self.lookup(text, top_k)
+        self.lookups += 1
+        self.total_us += (perf_counter() - t0) * 1e6
+        if not results or results[0][2] < self.min_score:
+            return None
+        if exact:
+            self.exact_hits += 1
+        else:
+            self.near_hits += 1
+        return results, exact
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.near_hits
+        return {
+            "names": len(self._data["hashes"]) if self._data is not None else 0,
+            "lookups": self.lookups,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "hit_rate": round(hits / self.lookups, 4) if self.lookups else 0.0,
+            "avg_us": round(self.total_us / self.lookups, 1) if self.lookups else 0.0,
+        }
+
+
+name_index = NameIndex()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process product name index")
+    parser.add_argument("command", choices=["build", "lookup"])
+    parser.add_argument("text", nargs="?")
+    parser.add_argument("--snapshot", default=NAME_INDEX_SNAPSHOT)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_snapshot(fetch_base_products(), args.snapshot)
+    else:
+        index = NameIndex(args.snapshot)
+        index.load_snapshot()
+        t0 = perf_counter()
+        results, exact = index.lookup(args.text or "")
+        print(f"{(perf_counter() - t0) * 1e6:.0f} us, {'exact' if exact else 'trigram'}")
+        for row in results:
+            print(row)
@@ -0,0 +1,212 @@
+# offer_stats.py
+"""
+Per-product price and offer statistics (product_offer_stats).
+
+One row per base_random_key with min/max/avg/median price, member count,
+shop count, warranty-shop count and per-city counts. The table is kept up to
+date incrementally by triggers on `members` (insert/update/delete) and on
+`shops` (has_warranty / city_id updates): only the affected products are
+recomputed.
+
+Usage:
+    python -m sql.offer_stats setup     # create table, function, triggers and fill it
+    python -m sql.offer_stats rebuild   # recompute every product
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import argparse
+from time import perf_counter
+from typing import Optional
+import psycopg
+from psycopg.rows import dict_row
+from sql.db_pool import DB_CONFIG, connection
+
+OFFER_STATS_DDL = """
+CREATE TABLE IF NOT EXISTS product_offer_stats (
+    base_random_key TEXT PRIMARY KEY,
+    min_price BIGINT,
+    max_price BIGINT,
+    avg_price DOUBLE PRECISION,
+    median_price DOUBLE PRECISION,
+    member_count INTEGER NOT NULL,
+    shop_count INTEGER NOT NULL,
+    warranty_shop_count INTEGER NOT NULL,
+    city_member_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    city_shop_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Recompute the stats of `keys` (all products when NULL)
+CREATE OR REPLACE FUNCTION refresh_product_offer_stats(keys TEXT[]) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF keys IS NOT NULL THEN
+        DELETE FROM product_offer_stats pos
+        WHERE pos.base_random_key = ANY(keys)
+          AND NOT EXISTS (SELECT 1 FROM members m WHERE m.base_random_key = pos.base_random_key);
+    END IF;
+
+    INSERT INTO product_offer_stats AS pos (
+        base_random_key, min_price, max_price, avg_price, median_price,
+        member_count, shop_count, warranty_shop_count,
+        city_member_counts, city_shop_counts, updated_at
+    )
+    SELECT
+        agg.base_random_key, agg.min_price, agg.max_price, agg.avg_price, agg.median_price,
+        agg.member_count, agg.shop_count, agg.warranty_shop_count,
+        COALESCE(cc.city_member_counts, '{}'::jsonb), COALESCE(cc.city_shop_counts, '{}'::jsonb), now()
+    FROM (
+        SELECT
+            m.base_random_key,
+            MIN(m.price) AS min_price,
+            MAX(m.price) AS max_price,
+            AVG(m.price)::double precision AS avg_price,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY m.price) AS median_price,
+            COUNT(*) AS member_count,
+            COUNT(DISTINCT m.shop_id) AS shop_count,
+            COUNT(DISTINCT m.shop_id) FILTER (WHERE s.has_warranty) AS warranty_shop_count
+        FROM members m
+        LEFT JOIN shops s ON s.id = m.shop_id
+        WHERE keys IS NULL OR m.base_random_key = ANY(keys)
+        GROUP BY m.base_random_key
+    ) agg
+    LEFT JOIN (
+        SELECT
+            base_random_key,
+            jsonb_object_agg(city, members) AS city_member_counts,
+            jsonb_object_agg(city, shops) AS city_shop_counts
+        FROM (
+            SELECT m.base_random_key, ci.name AS city,
+                   COUNT(*) AS members, COUNT(DISTINCT m.shop_id) AS shops
+            FROM members m
+            JOIN shops s ON s.id = m.shop_id
+            JOIN cities ci ON ci.id = s.city_id
+            WHERE keys IS NULL OR m.base_random_key = ANY(keys)
+            GROUP BY m.base_random_key, ci.name
+        ) per_city
+        GROUP BY base_random_key
+    ) cc ON cc.base_random_key = agg.base_random_key
+    ON CONFLICT (base_random_key) DO UPDATE SET
+        min_price = EXCLUDED.min_price,
+        max_price = EXCLUDED.max_price,
+        avg_price = EXCLUDED.avg_price,
+        median_price = EXCLUDED.median_price,
+        member_count = EXCLUDED.member_count,
+        shop_count = EXCLUDED.shop_count,
+        warranty_shop_count = EXCLUDED.warranty_shop_count,
+        city_member_counts = EXCLUDED.city_member_counts,
+        city_shop_counts = EXCLUDED.city_shop_counts,
+        updated_at = EXCLUDED.updated_at;
+END $$;
+
+CREATE OR REPLACE FUNCTION product_offer_stats_members_trg() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_product_offer_stats(ARRAY(SELECT DISTINCT base_random_key FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_product_offer_stats(ARRAY(SELECT DISTINCT base_random_key FROM old_rows));
+    ELSE
+        PERFORM refresh_product_offer_stats(ARRAY(
+            SELECT base_random_key FROM new_rows UNION SELECT base_random_key FROM old_rows
+        ));
+    END IF;
+    RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION product_offer_stats_shops_trg() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM refresh_product_offer_stats(ARRAY(
+        SELECT DISTINCT m.base_random_key FROM members m JOIN new_rows s ON s.id = m.shop_id
+    ));
+    RETURN NULL;
+END $$;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS product_offer_stats_members_ins ON members;
+CREATE TRIGGER product_offer_stats_members_ins AFTER INSERT ON members
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_offer_stats_members_trg();
+
+DROP TRIGGER IF EXISTS product_offer_stats_members_upd ON members;
+CREATE TRIGGER product_offer_stats_members_upd AFTER UPDATE ON members
+    REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_offer_stats_members_trg();
+
+DROP TRIGGER IF EXISTS product_offer_stats_members_del ON members;
+CREATE TRIGGER product_offer_stats_members_del AFTER DELETE ON members
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_offer_stats_members_trg();
+
+DROP TRIGGER IF EXISTS product_offer_stats_shops_upd ON shops;
+CREATE TRIGGER product_offer_stats_shops_upd AFTER UPDATE ON shops
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_offer_stats_shops_trg();
+"""
+
+
+def setup_offer_stats(rebuild: bool = True):
+    """Create table, refresh function and triggers; optionally fill the table."""
+    with psycopg.connect(**DB_CONFIG) as conn:
+        conn.execute(OFFER_STATS_DDL)
+        conn.commit()
+    if rebuild:
+        rebuild_offer_stats()
+
+
+def rebuild_offer_stats() -> dict:
+    """Recompute the stats of every product. Returns duration and row count."""
+    with psycopg.connect(**DB_CONFIG) as conn:
+        t0 = perf_counter()
+        conn.execute("SELECT refresh_product_offer_stats(NULL)")
+        conn.execute("DELETE FROM product_offer_stats pos WHERE NOT EXISTS "
+                     "(SELECT 1 FROM members m WHERE m.base_random_key = pos.base_random_key)")
+        rows = conn.execute("SELECT count(*) FROM product_offer_stats").fetchone()[0]
+        conn.commit()
+    report = {"rows": rows, "seconds": round(perf_counter() - t0, 2)}
+    print(f"[OFFER_STATS] Rebuilt: {report}")
+    return report
+
+
+async def get_offer_stats(base_random_key: str) -> Optional[dict]:
+    """
+    Price/offer statistics of one base product in a single indexed read.
+    Returns None if the product has no members.
+    """
+    async with connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(
+                """
+                SELECT base_random_key, min_price, max_price, avg_price, median_price,
+                       member_count, shop_count, warranty_shop_count,
+                       city_member_counts, city_shop_counts
+                FROM product_offer_stats
+                WHERE base_random_key = %s
+                """,
+                (base_random_key,),
+            )
+            return await cur.fetchone()
+
+
+async def get_product_offer_stats(base_random_key: str) -> dict | str:
+    """
+    Return precomputed price and offer statistics of a base product:
+    min_price, max_price, avg_price, median_price, member_count, shop_count,
+    warranty_shop_count, city_member_counts and city_shop_counts.
+    """
+    try:
+        stats = await get_offer_stats(base_random_key)
+        return stats if stats is not None else f"No members found for base_random_key={base_random_key}"
+    except Exception as e:
+        return f"-- ERROR reading offer stats: {str(e)}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="product_offer_stats maintenance")
+    parser.add_argument("command", choices=["setup", "rebuild"])
+    args = parser.parse_args()
+    if args.command == "setup":
+        setup_offer_stats()
+    else:
+        rebuild_offer_stats()
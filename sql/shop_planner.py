@@ -0,0 +1,219 @@
+# shop_planner.py
+"""
+Query planning for find_candidate_shops.
+
+Two strategies:
+- filter_first: filter member_total, then compute the exact cosine distance
+  for every surviving row. Best when the filters keep few rows.
+- ann_first: take the top-N nearest products from the product_embed ANN index,
+  then join/filter member_total. N is widened until `top_k` rows survive;
+  if it never gets there we fall back to filter_first.
+
+The choice is made from the planner's row estimate for the filters
+(EXPLAIN, no execution), so no extra table scan is paid.
+"""
+import os
+import json
+from typing import Optional, List, Dict, Any, Tuple
+from sql.vector_index import apply_search_settings
+
+SELECTIVE_ROWS = int(os.getenv("CANDIDATE_SHOPS_SELECTIVE_ROWS", 20000))
+ANN_INITIAL_LIMIT = int(os.getenv("CANDIDATE_SHOPS_ANN_INITIAL", 100))
+ANN_MAX_LIMIT = int(os.getenv("CANDIDATE_SHOPS_ANN_MAX", 10000))
+ANN_GROWTH = 4
+
+STRATEGIES = ("filter_first", "ann_first")
+
+MEMBER_COLUMNS = """
+            mt.base_random_key,
+            mt.persian_name AS product_name,
+            mt.shop_id,
+            mt.price,
+            mt.city,
+            mt.has_warranty,
+            mt.score,
+            mt.extra_features,
+            mt.member_random_key,
+            mt.brand_title"""
+
+planner_stats = {
+    "filter_first": 0,
+    "ann_first": 0,
+    "ann_widenings": 0,
+    "ann_fallbacks": 0,
+}
+
+
+def build_member_filters(
+    price_min: Optional[int] = None,
+    price_max: Optional[int] = None,
+    has_warranty: Optional[bool] = None,
+    score: Optional[int] = None,
+    city: Optional[str] = None,
+    brand_title: Optional[str] = None,
+    shop_id: Optional[int] = None,
+    base_random_key: Optional[str] = None,
+    member_random_key: Optional[str] = None,
+    feature_keys: Optional[List[str]] = None,
+    feature_values: Optional[List[str]] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Build the WHERE clause over member_total (alias `mt`) and its parameters.
+    - score → mt.score >= %(score)s
+    - price_min/price_max → BETWEEN with ±5% tolerance when equal
+    - feature_keys/feature_values → ILIKE on JSONB extra_features
+    """
+    price_min_default, price_max_default = 10000, 100000000
+    price_min = price_min if price_min is not None else price_min_default
+    price_max = price_max if price_max is not None else price_max_default
+
+    if price_min == price_max:
+        price_min = int(price_min * 0.95)
+        price_max = int(price_max * 1.05)
+
+    params: Dict[str, Any] = {
+        "price_min": price_min,
+        "price_max": price_max,
+    }
+    where = "mt.price BETWEEN %(price_min)s AND %(price_max)s"
+
+    # Only apply filters if value is set
+    if city:
+        where += " AND mt.city = %(city)s"
+        params["city"] = city
+
+    if score is not None:
+        where += " AND mt.score >= %(score)s"
+        params["score"] = score
+
+    if has_warranty is not None:
+        where += " AND mt.has_warranty = %(has_warranty)s"
+        params["has_warranty"] = has_warranty
+
+    if brand_title:
+        where += " AND mt.brand_title = %(brand_title)s"
+        params["brand_title"] = brand_title
+
+    if shop_id:
+        where += " AND mt.shop_id = %(shop_id)s"
+        params["shop_id"] = shop_id
+
+    if base_random_key:
+        where += " AND mt.base_random_key = %(base_random_key)s"
+        params["base_random_key"] = base_random_key
+
+    if member_random_key:
+        where += " AND mt.member_random_key = %(member_random_key)s"
+        params["member_random_key"] = member_random_key
+
+    # JSONB feature filters
+    if feature_keys and feature_values and len(feature_keys) == len(feature_values):
+        for i, (fk, fv) in enumerate(zip(feature_keys, feature_values)):
+            # `?` and `::text ILIKE` are implied by the ->> match; they only let the
+            # GIN / trigram indexes on extra_features narrow the rows first.
+            where += f" AND mt.extra_features ? %(feature_key_{i})s"
+            if '"' not in fv and "\\" not in fv:  # escaped in the JSON text, would not match
+                where += f" AND mt.extra_features::text ILIKE %(feature_value_{i})s"
+            where += f" AND mt.extra_features ->> %(feature_key_{i})s ILIKE %(feature_value_{i})s"
+            params[f"feature_key_{i}"] = fk
+            params[f"feature_value_{i}"] = f"%{fv}%"
+
+    return where, params
+
+
+async def estimate_filter_rows(cur, where: str, params: Dict[str, Any]) -> float:
+    """Planner row estimate for the filters (EXPLAIN only, nothing is executed)."""
+    await cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM member_total mt WHERE {where}", params)
+    plan = (await cur.fetchone())[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return float(plan[0]["Plan"]["Plan Rows"])
+
+
+async def choose_strategy(cur, where: str, params: Dict[str, Any]) -> Tuple[str, Optional[float]]:
+    """Return (strategy, estimated_rows)."""
+    # Key filters pin the result to a handful of rows; no need to ask the planner
+    if any(k in params for k in ("base_random_key", "member_random_key", "shop_id")):
+        return "filter_first", None
+    est_rows = await estimate_filter_rows(cur, where, params)
+    return ("filter_first" if est_rows <= SELECTIVE_ROWS else "ann_first"), est_rows
+
+
+def filter_first_sql(where: str) -> str:
+    return f"""
+    WITH filtered AS (
+        SELECT {MEMBER_COLUMNS}
+        FROM member_total mt
+        WHERE {where}
+    ),
+    ranked AS (
+        SELECT
+            f.*,
+            1 - (pe.embedding <=> %(query_vector)b) AS similarity
+        FROM filtered f
+        JOIN product_embed pe ON f.base_random_key = pe.random_key
+    )
+    SELECT *
+    FROM ranked
+    ORDER BY similarity DESC
+    LIMIT %(limit)s;
+    """
+
+
+def ann_first_sql(where: str) -> str:
+    return f"""
+    WITH ann AS (
+        SELECT
+            pe.random_key,
+            1 - (pe.embedding <=> %(query_vector)b) AS similarity
+        FROM product_embed pe
+        ORDER BY pe.embedding <=> %(query_vector)b
+        LIMIT %(ann_limit)s
+    )
+    SELECT {MEMBER_COLUMNS},
+        ann.similarity
+    FROM ann
+    JOIN member_total mt ON mt.base_random_key = ann.random_key
+    WHERE {where}
+    ORDER BY ann.similarity DESC
+    LIMIT %(limit)s;
+    """
+
+
+async def run_candidate_query(cur, where: str, params: Dict[str, Any], top_k: int,
+                              strategy: Optional[str] = None) -> Tuple[list, dict]:
+    """
+    Execute the candidate query with the chosen (or forced) strategy.
+    Returns (rows, plan_info).
+    """
+    # filter_first computes exact distances over the filtered rows, so scans stay allowed
+    await apply_search_settings(cur, force_index=False)
+
+    est_rows = None
+    if strategy is None:
+        strategy, est_rows = await choose_strategy(cur, where, params)
+    elif strategy not in STRATEGIES:
+        raise ValueError(f"strategy must be one of {STRATEGIES}")
+    plan_info = {"strategy": strategy, "estimated_rows": est_rows, "ann_limit": None}
+
+    if strategy == "ann_first":
+        ann_limit = max(ANN_INITIAL_LIMIT, top_k * 10)
+        while True:
+            await cur.execute(ann_first_sql(where), {**params, "ann_limit": ann_limit, "limit": top_k})
+            rows = await cur.fetchall()
+            plan_info["ann_limit"] = ann_limit
+            if len(rows) >= top_k or ann_limit >= ANN_MAX_LIMIT:
+                break
+            ann_limit = min(ann_limit * ANN_GROWTH, ANN_MAX_LIMIT)
+            planner_stats["ann_widenings"] += 1
+        if len(rows) >= top_k:
+            planner_stats["ann_first"] += 1
+            return rows, plan_info
+        # Filters were more selective than estimated: exact search is both cheap and complete
+        planner_stats["ann_fallbacks"] += 1
+        plan_info["strategy"] = "filter_first"
+
+    await cur.execute(filter_first_sql(where), {**params, "limit": top_k})
+    rows = await cur.fetchall()
+    planner_stats["filter_first"] += 1
+    return rows, plan_info
@@ -1,138 +1,331 @@
 # similarity_search.py
 
 import os
-import psycopg2
-from openai import OpenAI
+import asyncio
 from dotenv import load_dotenv
-from typing import Optional, List, Tuple
-from psycopg2.extras import RealDictCursor
-import base64
-from io import BytesIO
-from PIL import Image
-import logging
-import torch
-from transformers import CLIPModel, CLIPProcessor
+from typing import Optional, List, Tuple, Dict, Union
+from psycopg import sql
+from time import perf_counter
+import numpy as np
+from sql.db_pool import connection
+from sql.embedding_cache import embedding_cache, normalize_embedding_text
+from sql.embedding_service import EmbeddingBatcher
+from sql.vector_adapter import as_vector
+from sql.clip_provider import clip_batcher, clip_provider  # torch is imported on first use
+from sql.image_cache import image_cache
+from utils.image_ingest import IngestedImage, ingest_data_uri
+from sql.shop_planner import build_member_filters, run_candidate_query
+from sql.compact_embeddings import compact_search, COMPACT_SEARCH_MODE
+from sql.local_index import local_product_index
+from sql.category_index import category_index
+from sql.hybrid_search import hybrid_search, HYBRID_SEARCH
+from sql.category_partitions import (
+    partition_search, merge_results, partition_stats, PARTITIONED_SEARCH, PARTITION_MIN_MARGIN,
+)
+from sql.vector_index import (
+    apply_search_settings, escalation_reason, ADAPTIVE_SEARCH,
+    ADAPTIVE_CHEAP_PROBES, ADAPTIVE_CHEAP_EF_SEARCH, ADAPTIVE_WIDE_PROBES, ADAPTIVE_WIDE_EF_SEARCH,
+)
 
 load_dotenv()
 
 
 # --- Configuration ---
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST"),
-    "port": int(os.getenv("DB_PORT", 5432)),
-    "dbname": os.getenv("DB_NAME"),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-}
 
 OPENAI_API_KEY = os.getenv("API_KEY")
 BASE_URL = os.getenv("BASE_URL")
 MODEL = "text-embedding-3-small"
 
-# --- Initialize OpenAI client ---
-client = OpenAI(api_key=OPENAI_API_KEY, base_url = BASE_URL)
-
-def load_clip_model(model_name="openai/clip-vit-base-patch32"):
-    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Using device: {DEVICE}")
-    try:
-        logging.info(f"Loading model: {model_name}...")
-        model = CLIPModel.from_pretrained(model_name).to(DEVICE)
-        processor = CLIPProcessor.from_pretrained(model_name)
-        EMBEDDING_DIM = model.config.projection_dim
-        print(f"✅ Model initialized successfully. Embedding Dim: {EMBEDDING_DIM}")
-        return model, processor, DEVICE, EMBEDDING_DIM
-    except Exception as e:
-        print(f"❌ Failed to initialize model: {e}", exc_info=True)
-
-clip_model, clip_processor, DEVICE, EMBEDDING_DIM = load_clip_model()
-
-def embed_base64_image(data_uri):
-    """
-    Convert a single base64 image string to a normalized CLIP embedding.
-    Returns a 1D numpy array of shape (EMBEDDING_DIM,).
-    """
-    _, encoded = data_uri.split(",", 1)
-    image_bytes = base64.b64decode(encoded)
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
-
-    with torch.no_grad():
-        inputs = clip_processor(
-            images=[image],
-            return_tensors="pt",
-            padding=True
-        ).to(DEVICE)
-
-        embedding = clip_model.get_image_features(**inputs)
-        embedding = embedding / embedding.norm(dim=-1, keepdim=True)
-        return embedding.cpu().numpy()[0]
-
-def get_embedding(text):
-    """Generate embedding vector for a given text using OpenAI."""
-    response = client.embeddings.create(
-        model=MODEL,
-        input=text
-    )
-    return response.data[0].embedding
+# --- Initialize OpenAI embedding client (async, micro-batched across requests) ---
+embedding_batcher = EmbeddingBatcher(MODEL)
 
-def similarity_search_image(data_uri, top_k: int = 5):
-    query_vector = embed_base64_image(data_uri)
-    query_vector = query_vector.flatten().tolist()
-    query_vector_str = "[" + ",".join(map(str, query_vector)) + "]"
+# Adaptive similarity_search counters (see `search_stats()`)
+adaptive_stats = {
+    "searches": 0,
+    "escalations": 0,
+    "reasons": {},
+    "cheap_ms": 0.0,
+    "escalated_ms": 0.0,
+}
 
-    with psycopg2.connect(**DB_CONFIG) as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT random_key,
-                       persian_name,
-                       category,
-                       1 - (embedding <=> %s) AS similarity
-                FROM image_embedding
-                ORDER BY embedding <=> %s
-                LIMIT %s
-            """, (query_vector_str, query_vector_str, top_k))
+async def get_embedding(text):
+    """
+    Generate embedding vector for a given text using OpenAI.
+    Results are cached by (model, normalized text) in `embedding_cache`; the
+    normalized text is only the cache key, the original text is embedded.
+    Returns a float32 numpy array.
+    """
+    key = normalize_embedding_text(text)
+    cached = await embedding_cache.get(MODEL, key)
+    if cached is not None:
+        return cached
 
-            results = cur.fetchall()
+    embedding = as_vector(await embedding_batcher.embed(text))
+    await embedding_cache.put(MODEL, key, embedding)
+    return embedding
 
+async def get_embeddings(texts: List[str]) -> List[np.ndarray]:
+    """
+    Embeddings of several texts, in input order. Cache misses are sent
+    together, so they go out in a single embeddings request.
+    """
+    keys = [normalize_embedding_text(t) for t in texts]
+    cached = await asyncio.gather(*(embedding_cache.get(MODEL, k) for k in keys))
+    misses = {}  # normalized key -> first original text with that key (the one embedded)
+    for key, text, c in zip(keys, texts, cached):
+        if c is None:
+            misses.setdefault(key, text)
+    fresh = {}
+    if misses:
+        for key, values in zip(misses, await embedding_batcher.embed_many(list(misses.values()))):
+            fresh[key] = as_vector(values)
+            await embedding_cache.put(MODEL, key, fresh[key])
+    return [c if c is not None else fresh[k] for k, c in zip(keys, cached)]
+
+PRODUCT_SELECT = sql.SQL("random_key, persian_name, 1 - (embedding <=> %(query_vector)b) AS similarity")
+IMAGE_SELECT = sql.SQL("random_key, persian_name, category, 1 - (embedding <=> %(query_vector)b) AS similarity")
+
+async def _select_partition(query_vector, category: Optional[Union[str, int]]) -> Tuple[Optional[int], bool]:
+    """
+    (top-level category id to search, whether the global search must run too) — (None, False) = global search.
+    A predicted partition is uncertain when the category prediction margin is below PARTITION_MIN_MARGIN.
+    """
+    if not PARTITIONED_SEARCH:
+        return None, False
+    await category_index.ensure_fresh()
+    if category:
+        return category_index.resolve_top_category(category), False
+    if query_vector is None:
+        return None, False
+    top_category_id, margin = category_index.predict_top_category(query_vector)
+    return top_category_id, margin < PARTITION_MIN_MARGIN
+
+async def similarity_search_image(data_uri, top_k: int = 5, probes: Optional[int] = None,
+                                  ef_search: Optional[int] = None, category: Optional[str] = None):
+    """
+    Search image_embedding with the CLIP embedding of a base64 image
+    (data URI, or an `IngestedImage` already decoded by `utils.image_ingest`).
+    `category` (title or id, any level) restricts the search to its top-level
+    category partition when PARTITIONED_SEARCH is on.
+    The embedding and the result are cached by the image content hash (see `sql.image_cache`).
+    """
+    image = data_uri if isinstance(data_uri, IngestedImage) else await asyncio.to_thread(ingest_data_uri, data_uri)
+    params = (top_k, probes, ef_search, category)
+    cached = await image_cache.get_results(image.content_hash, params)
+    if cached is not None:
+        return list(cached)
+
+    encoder = f"{clip_provider.model_name}:{clip_provider.backend}"
+    query_vector = await image_cache.get_embedding(encoder, image.content_hash)
+    if query_vector is None:
+        query_vector = as_vector(await clip_batcher.embed(image))
+        await image_cache.put_embedding(encoder, image.content_hash, query_vector)
+    # CLIP vectors cannot be compared with the text category embeddings: no prediction here
+    top_category_id, _ = await _select_partition(None, category)
+
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            if top_category_id is not None:
+                results = await partition_search(cur, "image_embedding", IMAGE_SELECT, query_vector, top_k,
+                                                 top_category_id, probes=probes, ef_search=ef_search)
+            else:
+                await apply_search_settings(cur, probes=probes, ef_search=ef_search)
+                await cur.execute("""
+                    SELECT random_key,
+                           persian_name,
+                           category,
+                           1 - (embedding <=> %(query_vector)b) AS similarity
+                    FROM image_embedding
+                    ORDER BY embedding <=> %(query_vector)b
+                    LIMIT %(top_k)s
+                """, {"query_vector": query_vector, "top_k": top_k})
+                results = await cur.fetchall()
+
+    await image_cache.put_results(image.content_hash, params, results)
     return results
 
-def similarity_search(query, top_k: int = 5, probes: int = 20):
+async def similarity_search(query, top_k: int = 5, probes: Optional[int] = None, ef_search: Optional[int] = None,
+                            category: Optional[str] = None):
     """
-    Perform a similarity search in the product_embed table using pgvector IVFFlat index.
+    Perform a similarity search in the product_embed table using its pgvector ANN index
+    (IVFFlat or HNSW, see `sql.vector_index`).
 
     Args:
         query (str): The query text.
         top_k (int): Number of similar items to return.
         probes (int): Number of IVF lists to probe (higher = better recall, slower).
+        ef_search (int): HNSW candidate list size (higher = better recall, slower).
+        When neither is given and ADAPTIVE_SEARCH is on, a cheap pass runs first and is
+        re-run with the wide setting only if the top score is low or the top-1/top-2
+        margin is small (see `sql.vector_index.escalation_reason`).
+        With COMPACT_SEARCH_MODE set, candidates come from the compact index and are
+        reranked with full precision instead (see `sql.compact_embeddings`).
+        With LOCAL_INDEX_DIR set and an index published, the search runs in-process on the
+        memory-mapped index (see `sql.local_index`) and no DB connection is used.
+        With HYBRID_SEARCH on, the vector ranking is fused with a trigram ranking of the
+        product names (see `sql.hybrid_search`); this takes precedence over the modes above.
+        category (str): Category title or id. With PARTITIONED_SEARCH on, only its top-level
+            category partition is searched (see `sql.category_partitions`); without it the
+            partition is predicted from the query; when the prediction margin is below
+            PARTITION_MIN_MARGIN the partition result is merged with the modes above.
 
     Returns:
         List of tuples: [(random_key, persian_name, similarity_score), ...]
     """
-    query_vector = get_embedding(query)  # list[float]
-    query_vector_str = "[" + ",".join(map(str, query_vector)) + "]"
+    query_vector = await get_embedding(query)  # np.ndarray[float32]
+    top_category_id, uncertain = await _select_partition(query_vector, category)
+    if top_category_id is not None:
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                results = await partition_search(cur, "product_embed", PRODUCT_SELECT, query_vector, top_k,
+                                                 top_category_id, probes=probes, ef_search=ef_search)
+        if not uncertain:
+            if not category:
+                partition_stats["predicted"] += 1
+            return results
+        # Close call between top-level categories: keep the partition rows, but let the global search compete
+        partition_stats["merged"] += 1
+        global_results = await _global_search(query, query_vector, top_k, probes, ef_search)
+        return merge_results(results, global_results, top_k)
+    return await _global_search(query, query_vector, top_k, probes, ef_search)
+
+
+async def _global_search(query, query_vector, top_k: int, probes: Optional[int], ef_search: Optional[int]) -> list:
+    """similarity_search over all of product_embed (hybrid, local, compact, adaptive or plain ANN)."""
+    if HYBRID_SEARCH:
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                return await hybrid_search(cur, query, query_vector, top_k, probes=probes, ef_search=ef_search)
+    if local_product_index.ready:
+        return await asyncio.to_thread(local_product_index.search, query_vector, top_k, probes)
+    if COMPACT_SEARCH_MODE:
+        async with connection() as conn:
+            async with conn.cursor() as cur:
+                return await compact_search(cur, query_vector, top_k, probes=probes)
+
+    adaptive = ADAPTIVE_SEARCH and probes is None and ef_search is None
+    if adaptive:
+        probes, ef_search = ADAPTIVE_CHEAP_PROBES, ADAPTIVE_CHEAP_EF_SEARCH
+
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            t0 = perf_counter()
+            # Force use of the ANN index (transaction-local, the connection is pooled)
+            await apply_search_settings(cur, probes=probes, ef_search=ef_search)
+            if not adaptive:
+                return await _product_ann_query(cur, query_vector, top_k)
+
+            # The top-1/top-2 margin needs two rows even when top_k == 1
+            results = await _product_ann_query(cur, query_vector, max(top_k, 2))
+            reason = escalation_reason([row[2] for row in results])
+            adaptive_stats["searches"] += 1
+            if reason is None:
+                adaptive_stats["cheap_ms"] += (perf_counter() - t0) * 1000
+                return results[:top_k]
+
+            await apply_search_settings(cur, probes=ADAPTIVE_WIDE_PROBES, ef_search=ADAPTIVE_WIDE_EF_SEARCH)
+            results = await _product_ann_query(cur, query_vector, top_k)
+            adaptive_stats["escalations"] += 1
+            adaptive_stats["reasons"][reason] = adaptive_stats["reasons"].get(reason, 0) + 1
+            adaptive_stats["escalated_ms"] += (perf_counter() - t0) * 1000
 
-    with psycopg2.connect(**DB_CONFIG) as conn:
-        with conn.cursor() as cur:
-            # Force use of IVFFlat index
-            cur.execute("SET enable_seqscan = off;")
-            cur.execute("SET ivfflat.probes = %s;", (probes,))
+    return results
+
+
+async def _product_ann_query(cur, query_vector, top_k: int) -> list:
+    await cur.execute("""
+        SELECT random_key,
+               persian_name,
+               1 - (embedding <=> %(query_vector)b) AS similarity
+        FROM product_embed
+        ORDER BY embedding <=> %(query_vector)b
+        LIMIT %(top_k)s
+    """, {"query_vector": query_vector, "top_k": top_k})
+    return await cur.fetchall()
 
-            cur.execute("""
+
+async def similarity_by_keys(query, random_keys: List[str]) -> list:
+    """
+    Cosine similarity of `query` to the given products only (exact, no ANN scan), best first.
+    Same result shape as similarity_search; used to put name-index candidates on its scale.
+    """
+    query_vector = await get_embedding(query)
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
                 SELECT random_key,
                        persian_name,
-                       1 - (embedding <=> %s) AS similarity
+                       1 - (embedding <=> %(query_vector)b) AS similarity
                 FROM product_embed
-                ORDER BY embedding <=> %s
-                LIMIT %s
-            """, (query_vector_str, query_vector_str, top_k))
+                WHERE random_key = ANY(%(random_keys)s)
+                ORDER BY embedding <=> %(query_vector)b
+            """, {"query_vector": query_vector, "random_keys": list(random_keys)})
+            return await cur.fetchall()
+
+
+def search_stats() -> dict:
+    """Escalation rate and mean latency of adaptive similarity_search."""
+    n, escalated = adaptive_stats["searches"], adaptive_stats["escalations"]
+    cheap = n - escalated
+    total_ms = adaptive_stats["cheap_ms"] + adaptive_stats["escalated_ms"]
+    return {
+        "searches": n,
+        "escalations": escalated,
+        "escalation_rate": round(escalated / n, 4) if n else 0.0,
+        "reasons": dict(adaptive_stats["reasons"]),
+        "avg_ms": round(total_ms / n, 2) if n else 0.0,
+        "avg_cheap_ms": round(adaptive_stats["cheap_ms"] / cheap, 2) if cheap else 0.0,
+        "avg_escalated_ms": round(adaptive_stats["escalated_ms"] / escalated, 2) if escalated else 0.0,
+    }
 
-            results = cur.fetchall()
+async def similarity_search_many(queries: List[str], top_k: int = 5,
+                                 probes: Optional[int] = None) -> List[List[tuple]]:
+    """
+    Run `similarity_search` for several queries at once.
+    All queries are embedded in one request and searched in one SQL round trip.
+
+    Args:
+        queries (List[str]): The query texts (e.g. one per product mentioned).
+        top_k (int): Number of similar items to return per query.
+        probes (int): Number of IVF lists to probe (higher = better recall, slower).
 
+    Returns:
+        One list per query, in input order: [[(random_key, persian_name, similarity_score), ...], ...]
+    """
+    if not queries:
+        return []
+    vectors = await get_embeddings(queries)
+    if local_product_index.ready:
+        return [await asyncio.to_thread(local_product_index.search, v, top_k, probes) for v in vectors]
+
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            await apply_search_settings(cur, probes=probes)
+            if COMPACT_SEARCH_MODE:
+                return [await compact_search(cur, v, top_k, probes=probes) for v in vectors]
+            await cur.execute("""
+                SELECT q.ord, r.random_key, r.persian_name, r.similarity
+                FROM unnest(%(query_vectors)b::vector[]) WITH ORDINALITY AS q(vec, ord)
+                CROSS JOIN LATERAL (
+                    SELECT pe.random_key,
+                           pe.persian_name,
+                           1 - (pe.embedding <=> q.vec) AS similarity
+                    FROM product_embed pe
+                    ORDER BY pe.embedding <=> q.vec
+                    LIMIT %(top_k)s
+                ) r
+                ORDER BY q.ord, r.similarity DESC
+            """, {"query_vectors": vectors, "top_k": top_k})
+            rows = await cur.fetchall()
+
+    results = [[] for _ in queries]
+    for ord_, random_key, persian_name, similarity in rows:
+        results[ord_ - 1].append((random_key, persian_name, similarity))
     return results
 
-def similarity_search_cat(query, top_k: int = 5):
+async def similarity_search_cat(query, top_k: int = 5):
     """
-    Perform a similarity search in the categories table using pgvector.
+    Perform a similarity search over the category embeddings (in-memory, see `sql.category_index`).
 
     Args:
         query (str): The query text.
@@ -143,35 +336,21 @@ def similarity_search_cat(query, top_k: int = 5):
             {"category": str, "similarity": float}, ...
         ]
     """
-    query_vector = get_embedding(query)  # list[float]
-    query_vector_str = "[" + ",".join(map(str, query_vector)) + "]"
-
-    with psycopg2.connect(**DB_CONFIG) as conn:
-        with conn.cursor() as cur:
-            # Force use of IVFFlat index
-            cur.execute("""
-                SELECT c.title,
-                       1 - (c.embedding <=> %s) AS similarity
-                FROM categories c
-                ORDER BY c.embedding <=> %s
-                LIMIT %s
-            """, (query_vector_str, query_vector_str, top_k))
-
-            results = cur.fetchall()
+    query_vector = await get_embedding(query)  # np.ndarray[float32]
+    await category_index.ensure_fresh()
+    return category_index.search(query_vector, top_k)
 
-    results = [
-        {"category": row[0], "similarity": round(row[1], 4)}
-        for row in results
-    ]
-    return results
+async def similarity_search_cat_many(queries: List[str], top_k: int = 5) -> List[List[Dict]]:
+    """Batched `similarity_search_cat`: one result list per query, in order."""
+    vectors = await get_embeddings(queries)
+    await category_index.ensure_fresh()
+    return category_index.search_many(np.stack(vectors), top_k) if vectors else []
 
 from typing import List, Optional, Any, Dict
-import psycopg2
 from typing import Optional, List, Dict, Any
-import psycopg2
 
 
-def find_candidate_shops(
+async def find_candidate_shops(
     query: str,
     top_k: int = 1,
     price_min: Optional[int] = None,
@@ -195,100 +374,35 @@ def find_candidate_shops(
         * price_min/price_max → BETWEEN with ±5% tolerance
         * feature_keys/feature_values → filter by JSONB extra_features
     """
+    results, _ = await search_candidate_shops(
+        query, top_k=top_k, price_min=price_min, price_max=price_max,
+        has_warranty=has_warranty, score=score, city=city, brand_title=brand_title,
+        shop_id=shop_id, base_random_key=base_random_key, member_random_key=member_random_key,
+        feature_keys=feature_keys, feature_values=feature_values,
+    )
+    return results
 
-    query_vector = get_embedding(query)
-    query_vector_str = "[" + ",".join(map(str, query_vector)) + "]"
-
-    price_min_default, price_max_default = 10000, 100000000
-    price_min = price_min if price_min is not None else price_min_default
-    price_max = price_max if price_max is not None else price_max_default
-
-    if price_min == price_max:
-        price_min = int(price_min * 0.95)
-        price_max = int(price_max * 1.05)
-
-    params: Dict[str, Any] = {
-        "query_vector": query_vector_str,
-        "price_min": price_min,
-        "price_max": price_max,
-        "limit": top_k,
-    }
 
-    sql = """
-    WITH filtered AS (
-        SELECT 
-            mt.base_random_key,
-            mt.persian_name AS product_name,
-            mt.shop_id,
-            mt.price,
-            mt.city,
-            mt.has_warranty,
-            mt.score,
-            mt.extra_features,
-            mt.member_random_key,
-            mt.brand_title
-        FROM member_total mt
-        WHERE mt.price BETWEEN %(price_min)s AND %(price_max)s
+async def search_candidate_shops(
+    query: str,
+    top_k: int = 1,
+    strategy: Optional[str] = None,
+    **filters,
+) -> Tuple[List[dict], dict]:
     """
+    Implementation of `find_candidate_shops` (kept out of the tool signature).
 
-    # Only apply filters if value is set
-    if city:
-        sql += " AND mt.city = %(city)s"
-        params["city"] = city
-
-    if score is not None:
-        sql += " AND mt.score >= %(score)s"
-        params["score"] = score
-
-    if has_warranty is not None:
-        sql += " AND mt.has_warranty = %(has_warranty)s"
-        params["has_warranty"] = has_warranty
-
-    if brand_title:
-        sql += " AND mt.brand_title = %(brand_title)s"
-        params["brand_title"] = brand_title
-
-    if shop_id:
-        sql += " AND mt.shop_id = %(shop_id)s"
-        params["shop_id"] = shop_id
-
-    if base_random_key:
-        sql += " AND mt.base_random_key = %(base_random_key)s"
-        params["base_random_key"] = base_random_key
-
-    if member_random_key:
-        sql += " AND mt.member_random_key = %(member_random_key)s"
-        params["member_random_key"] = member_random_key
-
-    # JSONB feature filters
-    if feature_keys and feature_values and len(feature_keys) == len(feature_values):
-        for i, (fk, fv) in enumerate(zip(feature_keys, feature_values)):
-            sql += f"""
-                AND mt.extra_features ->> %(feature_key_{i})s ILIKE %(feature_value_{i})s
-            """
-            params[f"feature_key_{i}"] = fk
-            params[f"feature_value_{i}"] = f"%{fv}%"
-
-    sql += """
-        ),
-        ranked AS (
-            SELECT 
-                f.*,
-                1 - (pe.embedding <=> %(query_vector)s::vector) AS similarity
-            FROM filtered f
-            JOIN product_embed pe ON f.base_random_key = pe.random_key
-        )
-        SELECT *
-        FROM ranked
-        ORDER BY similarity DESC
-        LIMIT %(limit)s;
+    `strategy` forces "filter_first" or "ann_first"; by default the planner in
+    `sql.shop_planner` picks one from the estimated filter selectivity.
+    Returns (results, plan_info).
     """
+    query_vector = await get_embedding(query)
+    where, params = build_member_filters(**filters)
+    params["query_vector"] = query_vector
 
-    with psycopg2.connect(**DB_CONFIG) as conn:
-        with conn.cursor() as cur:
-            cur.execute("SET ivfflat.probes = %s;", (20,))
-            cur.execute(sql, params)
-            rows = cur.fetchall()
+    async with connection() as conn:
+        async with conn.cursor() as cur:
+            rows, plan_info = await run_candidate_query(cur, where, params, top_k, strategy=strategy)
 
     results = [
         {   
@@ -306,4 +420,4 @@ def find_candidate_shops(
         }
         for row in rows
     ]
-    return results
+    return results, plan_info
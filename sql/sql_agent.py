@@ -1,10 +1,10 @@
 from pydantic_ai import Agent, ModelSettings
-import httpx
 from pydantic_ai.models.openai import OpenAIChatModel
 from pydantic_ai.providers.openai import OpenAIProvider
 import os
 from sql.sql_utils import extract_sql
 from prompt.prompts import system_prompt_sql
+from utils.http_client import get_http_client
 
 OPENAI_API_KEY = os.environ['API_KEY']
 BASE_URL = os.environ['BASE_URL']
@@ -18,7 +18,7 @@ client = OpenAIChatModel(
     provider=OpenAIProvider(
         base_url=BASE_URL,
         api_key=OPENAI_API_KEY,
-        http_client=httpx.AsyncClient()
+        http_client=get_http_client()
     ),
     settings=ModelSettings(temperature=0.001, max_tokens=1024)
 )
@@ -1,33 +1,28 @@
 import os, sys
 from typing import Optional
 sys.path.append(os.path.abspath(".."))
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg
+from psycopg.rows import dict_row
 import os, re
 import random
 import string
 from datetime import datetime, timedelta
 import json
 from dotenv import load_dotenv
+from sql.db_pool import DB_CONFIG, connection
+from sql.write_queue import chat_writer
 
 # Load environment variables
 load_dotenv()
 
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST"),
-    "port": os.getenv("DB_PORT"),
-    "dbname": os.getenv("DB_NAME"),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-}
-
 def create_member_total_view():
     """
     Create the member_total view combining base_products, members, shops, brands, cities,
     and extra_features_products (feature_key, feature_value).
     Ensures all members are preserved, even if brand, shop, or city is missing.
+    Indexes are created afterwards (see sql/member_total_maintenance.py).
     """
-    with psycopg2.connect(**DB_CONFIG) as conn:
+    with psycopg.connect(**DB_CONFIG) as conn:
         with conn.cursor() as cur:
             # cur.execute("DROP VIEW IF EXISTS member_total CASCADE;")
             cur.execute("""
@@ -51,36 +46,34 @@ def create_member_total_view():
             """)
         conn.commit()
 
+    from sql.member_total_maintenance import create_member_total_indexes
+    create_member_total_indexes()
+
 # ------ Database Helpers ------
 def get_db_conn():
-    return psycopg2.connect(**DB_CONFIG)
-
-def init_logs_table():
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS logs (
-            id SERIAL PRIMARY KEY,
-            time TIMESTAMP NOT NULL,
-            input JSONB,
-            output JSONB
-        )
-    """)
-    conn.commit()
-    cur.close()
-    conn.close()
+    """Borrow a pooled connection: `async with get_db_conn() as conn: ...`"""
+    return connection()
+
+async def init_logs_table():
+    async with get_db_conn() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS logs (
+                id SERIAL PRIMARY KEY,
+                time TIMESTAMP NOT NULL,
+                input JSONB,
+                output JSONB
+            )
+        """)
 
-def insert_log(input_data: dict, output_data: dict):
+async def insert_log(input_data: dict, output_data: dict):
+    """Queue a log row; it is written in bulk by `chat_writer`."""
     try:
-        conn = get_db_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO logs (time, input, output) VALUES (%s, %s, %s)",
-            (datetime.utcnow(), json.dumps(input_data), json.dumps(output_data))
-        )
-        conn.commit()
-        cur.close()
-        conn.close()
+        row = {
+            "time": datetime.utcnow(),
+            "input": json.dumps(input_data),
+            "output": json.dumps(output_data),
+        }
+        await chat_writer.put("logs", row)
     except Exception as e:
         print(f"[ERROR] Failed to insert log: {e}")
 
@@ -88,7 +81,7 @@ def generate_base_id(length: int = 32) -> str:
     """Generate a random 12-character base_id."""
     return "".join(random.choices(string.ascii_letters + string.digits, k=length))
 
-def get_base_id_and_index(chat_id: str, time_limit_hours: int = 0.5) -> tuple[str, int]:
+async def get_base_id_and_index(chat_id: str, time_limit_hours: int = 0.5) -> tuple[str, int]:
     """
     Determine the base_id and chat_index for a given chat_id.
     
@@ -99,18 +92,19 @@ def get_base_id_and_index(chat_id: str, time_limit_hours: int = 0.5) -> tuple[st
     """
     cutoff_time = datetime.utcnow() - timedelta(hours=time_limit_hours)
 
-    conn = get_db_conn()
-    cur = conn.cursor()
+    # Make sure the previous turn of this chat is not still sitting in the write buffer
+    await chat_writer.flush_chat(chat_id)
 
-    # Fetch the most recent message for this chat_id within the time limit
-    cur.execute("""
-        SELECT base_id, chat_index, finished
-        FROM chats
-        WHERE chat_id = %s AND timestamp >= %s
-        ORDER BY timestamp DESC
-        LIMIT 1
-    """, (chat_id, cutoff_time))
-    row = cur.fetchone()
+    async with get_db_conn() as conn:
+        # Fetch the most recent message for this chat_id within the time limit
+        cur = await conn.execute("""
+            SELECT base_id, chat_index, finished
+            FROM chats
+            WHERE chat_id = %s AND timestamp >= %s
+            ORDER BY timestamp DESC
+            LIMIT 1
+        """, (chat_id, cutoff_time))
+        row = await cur.fetchone()
 
     if row is None or row[2]:  # No previous rows OR finished=True
         base_id = generate_base_id()
@@ -119,17 +113,23 @@ def get_base_id_and_index(chat_id: str, time_limit_hours: int = 0.5) -> tuple[st
         base_id = row[0]
         chat_index = row[1] + 1
 
-    conn.commit()
-    cur.close()
-    conn.close()
-
     return base_id, chat_index
 # ------ DB Insert Helper ------
-def insert_chat(input_dict: dict, output_dict: dict, extra_info: dict = None):
+async def insert_chat(
+    input_dict: dict,
+    output_dict: dict,
+    extra_info: dict = None,
+    base_id: Optional[str] = None,
+    chat_index: Optional[int] = None,
+):
     """
     Insert a chat message into the 'chats' table.
     Each row represents the last user message + model response at this index.
     Also stores `extra_info` as JSON.
+
+    The row is queued on `chat_writer` and written in bulk.
+    Pass `base_id`/`chat_index` when the caller already resolved them to skip
+    the extra lookup.
     """
     chat_id = input_dict["chat_id"]   # treat chat_id as base_id
 
@@ -142,10 +142,12 @@ def insert_chat(input_dict: dict, output_dict: dict, extra_info: dict = None):
 
     finished = output_dict.get("finished", False)
 
-    base_id, chat_index = get_base_id_and_index(chat_id=chat_id)
+    if base_id is None or chat_index is None:
+        base_id, chat_index = await get_base_id_and_index(chat_id=chat_id)
 
     # --- Prepare row ---
     row = {
+        "timestamp": datetime.utcnow(),
         "chat_id": chat_id,
         "base_id": base_id,
         "user_text": user_text,
@@ -158,34 +160,15 @@ def insert_chat(input_dict: dict, output_dict: dict, extra_info: dict = None):
         "finished": finished,
         "extra_info": json.dumps(extra_info, ensure_ascii=False) if extra_info else None,
     }
+    await chat_writer.put("chats", row, chat_id=chat_id)
 
-    sql = """
-    INSERT INTO chats (
-        chat_id, base_id, user_text, user_image_url, chat_index,
-        model_text, model_image_url, base_random_keys, member_random_keys, finished, extra_info
-    )
-    VALUES (
-        %(chat_id)s, %(base_id)s, %(user_text)s, %(user_image_url)s, %(chat_index)s,
-        %(model_text)s, %(model_image_url)s, %(base_random_keys)s, %(member_random_keys)s,
-        %(finished)s, %(extra_info)s
-    )
-    """
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute(sql, row)
-    conn.commit()
-    cur.close()
-    conn.close()
-
-def load_extra_info(base_id: int, index_chat: int) -> dict:
+async def load_extra_info(base_id: int, index_chat: int) -> dict:
     """
     Load chats.extra_info directly as a dict.
     Returns {} if no data exists.
     """
-    conn = get_db_conn()
-    cur = conn.cursor()
-    try:
-        cur.execute(
+    async with get_db_conn() as conn:
+        cur = await conn.execute(
             """
             SELECT extra_info
             FROM chats
@@ -193,9 +176,9 @@ def load_extra_info(base_id: int, index_chat: int) -> dict:
             """,
             (base_id, index_chat),
         )
-        row = cur.fetchone()
+        row = await cur.fetchone()
         if row and row[0]:
-            # row[0] could already be a dict (psycopg2.extras.RealDictCursor)
+            # row[0] is already a dict when the column is JSONB
             return row[0] if isinstance(row[0], dict) else json.loads(row[0])
         return None
         # return {
@@ -209,11 +192,8 @@ def load_extra_info(base_id: int, index_chat: int) -> dict:
         #     "candidate_member": None,
         #     "shop_id": None,
         #     }
-    finally:
-        cur.close()
-        conn.close()
 
-def get_chat_history(base_id: str) -> list[dict]:
+async def get_chat_history(base_id: str) -> list[dict]:
     """
     Retrieve all chat messages for a given base_id.
     
@@ -223,19 +203,14 @@ def get_chat_history(base_id: str) -> list[dict]:
         
     Messages are ordered by chat_index ascending (1 → N).
     """
-    conn = get_db_conn()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT user_text, model_text
-        FROM chats
-        WHERE base_id = %s
-        ORDER BY chat_index ASC
-    """, (base_id,))
-    rows = cur.fetchall()
-
-    cur.close()
-    conn.close()
+    async with get_db_conn() as conn:
+        cur = await conn.execute("""
+            SELECT user_text, model_text
+            FROM chats
+            WHERE base_id = %s
+            ORDER BY chat_index ASC
+        """, (base_id,))
+        rows = await cur.fetchall()
 
     history = []
     for row in rows:
@@ -274,7 +249,7 @@ def build_exact_query_and_execute(
 
     Returns
     -------
-    list[RealDictRow] | str
+    list[dict] | str
         Query results if successful, or error string if execution fails.
     """
     if limit < 3:
@@ -294,8 +269,8 @@ def build_exact_query_and_execute(
     params = (variable_query, limit)
 
     try:
-        with psycopg2.connect(**DB_CONFIG) as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with psycopg.connect(**DB_CONFIG) as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
                 cur.execute(query, params)
                 return cur.fetchall()
     except Exception as e:
@@ -328,7 +303,7 @@ def build_like_query_and_execute(
 
     Returns
     -------
-    list[RealDictRow] | str
+    list[dict] | str
         Query results if successful, or error string if execution fails.
     """
     if limit < 3:
@@ -349,8 +324,8 @@ def build_like_query_and_execute(
     params = (pattern, limit)
 
     try:
-        with psycopg2.connect(**DB_CONFIG) as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with psycopg.connect(**DB_CONFIG) as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
                 cur.execute(query, params)
                 return cur.fetchall()
     except Exception as e:
@@ -360,12 +335,12 @@ def build_like_query_and_execute(
 # -------------------------------
 # Helper: execute SQL safely
 # -------------------------------
-def execute_sql(query: str):
+async def execute_sql(query: str):
     try:
-        with psycopg2.connect(**DB_CONFIG) as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(query)
-                return cur.fetchall()
+        async with get_db_conn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(query)
+                return await cur.fetchall()
     except Exception as e:
         return f"-- ERROR executing query: {str(e)}"
 
@@ -391,15 +366,12 @@ def extract_sql(text: str) -> str:
     # 3. Otherwise, assume text is already SQL
     return text.strip().rstrip(";") + ";"
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
-
-def get_latest_chat_history(chat_id: str):
-    conn = psycopg2.connect(**DB_CONFIG)
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+async def get_latest_chat_history(chat_id: str):
+    await chat_writer.flush_chat(chat_id)
+    async with get_db_conn() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
             # Step 1: get latest base_id for this chat_id
-            cur.execute(
+            await cur.execute(
                 """
                 SELECT base_id
                 FROM chats
@@ -409,14 +381,14 @@ def get_latest_chat_history(chat_id: str):
                 """,
                 (chat_id,)
             )
-            row = cur.fetchone()
+            row = await cur.fetchone()
             if not row:
                 return []
 
             latest_base_id = row["base_id"]
 
             # Step 2: get full conversation for that base_id
-            cur.execute(
+            await cur.execute(
                 """
                 SELECT *
                 FROM chats
@@ -425,10 +397,8 @@ def get_latest_chat_history(chat_id: str):
                 """,
                 (chat_id, latest_base_id)
             )
-            rows = cur.fetchall()
+            rows = await cur.fetchall()
             return [dict(r) for r in rows]
-    finally:
-        conn.close()
 
 def top_features_summary():
     query = """
@@ -442,7 +412,7 @@ def top_features_summary():
     LIMIT 10;
     """
     
-    with psycopg2.connect(**DB_CONFIG) as conn:
+    with psycopg.connect(**DB_CONFIG) as conn:
         with conn.cursor() as cur:
             cur.execute(query)
             rows = cur.fetchall()
@@ -0,0 +1,22 @@
+# vector_adapter.py
+"""
+Shared pgvector adapter.
+
+Query vectors are passed as contiguous float32 NumPy arrays and bound with a
+`%(name)b` placeholder, so psycopg sends pgvector's binary format (a 4-byte
+header plus raw floats) instead of a stringified float list. Reusing the same
+named placeholder in one statement sends the vector only once. Vectors read
+back with `binary=True` are decoded straight into NumPy arrays.
+"""
+import numpy as np
+from pgvector.psycopg import register_vector_async
+
+
+async def register_vector_types(conn):
+    """Register the vector dumpers/loaders on a connection (called once per pooled connection)."""
+    await register_vector_async(conn)
+
+
+def as_vector(values) -> np.ndarray:
+    """Return `values` as a flat, contiguous float32 array (no copy if it already is one)."""
+    return np.ascontiguousarray(values, dtype=np.float32).reshape(-1)
@@ -0,0 +1,165 @@
+# vector_index.py
+"""
+ANN index management and per-query search settings for the embedding tables.
+
+Every table in VECTOR_TABLES can be indexed with IVFFlat or HNSW (pgvector,
+cosine distance). VECTOR_INDEX_TYPE selects the type that `build` creates;
+the other type's index is dropped so the planner cannot pick the wrong one.
+
+Per query, `apply_search_settings` sets `ivfflat.probes` and `hnsw.ef_search`
+transaction-locally in a single round trip. Only the setting of the index
+that exists is used by the executor, so callers do not need to know the type.
+
+Usage:
+    python -m sql.vector_index build [--type hnsw] [--table product_embed]
+    python -m sql.vector_index status
+"""
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import argparse
+from time import perf_counter
+from typing import Optional, Iterable
+import psycopg
+from sql.db_pool import DB_CONFIG
+
+INDEX_TYPES = ("ivfflat", "hnsw")
+
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "ivfflat").lower()
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", 0))        # 0 = rows / 1000 (sqrt(rows) above 1M rows)
+HNSW_M = int(os.getenv("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 64))
+
+# Per-query defaults
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", 20))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 40))
+
+# Adaptive search (similarity_search without explicit probes/ef_search): a cheap
+# pass first, re-run with the wide setting only when the result looks uncertain.
+# Off by default: the cheap setting and the thresholds below are placeholders until
+# benchmarks/bench_vector_index.py shows their recall@k is acceptable on this data.
+ADAPTIVE_SEARCH = os.getenv("ADAPTIVE_SEARCH", "0") == "1"
+ADAPTIVE_CHEAP_PROBES = int(os.getenv("ADAPTIVE_CHEAP_PROBES", 5))
+ADAPTIVE_CHEAP_EF_SEARCH = int(os.getenv("ADAPTIVE_CHEAP_EF_SEARCH", 20))
+ADAPTIVE_WIDE_PROBES = int(os.getenv("ADAPTIVE_WIDE_PROBES", 40))
+ADAPTIVE_WIDE_EF_SEARCH = int(os.getenv("ADAPTIVE_WIDE_EF_SEARCH", 160))
+ADAPTIVE_MIN_SCORE = float(os.getenv("ADAPTIVE_MIN_SCORE", 0.6))    # escalate if top-1 similarity is below
+ADAPTIVE_MIN_MARGIN = float(os.getenv("ADAPTIVE_MIN_MARGIN", 0.02))  # escalate if top-1 minus top-2 is below
+
+# table -> embedding column
+VECTOR_TABLES = {
+    "product_embed": "embedding",
+    "image_embedding": "embedding",
+    "categories": "embedding",
+}
+
+
+def index_name(table: str, index_type: str) -> str:
+    return f"{table}_embedding_{index_type}_idx"
+
+
+async def apply_search_settings(cur, probes: Optional[int] = None, ef_search: Optional[int] = None,
+                                force_index: bool = True):
+    """
+    Set the ANN search parameters for the current transaction.
+    `force_index` disables sequential scans so the ANN index is used even
+    when the planner would rather scan (the results are then approximate).
+    """
+    await cur.execute(
+        "SELECT set_config('ivfflat.probes', %s, true), set_config('hnsw.ef_search', %s, true), "
+        "set_config('enable_seqscan', %s, true)",
+        (str(probes or IVFFLAT_PROBES), str(ef_search or HNSW_EF_SEARCH), "off" if force_index else "on"),
+    )
+
+
+def escalation_reason(similarities: list) -> Optional[str]:
+    """Why a cheap ANN result should be re-run with the wide setting (None = keep it)."""
+    if not similarities:
+        return "empty"
+    if similarities[0] < ADAPTIVE_MIN_SCORE:
+        return "low_score"
+    if len(similarities) > 1 and similarities[0] - similarities[1] < ADAPTIVE_MIN_MARGIN:
+        return "small_margin"
+    return None
+
+
+def _default_lists(conn, table: str) -> int:
+    rows = conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+    if rows > 1_000_000:
+        return max(1, int(rows ** 0.5))
+    return max(1, rows // 1000)
+
+
+def build_vector_index(table: str, index_type: str = VECTOR_INDEX_TYPE,
+                       concurrently: bool = True, drop_other: bool = True) -> dict:
+    """
+    Create the `index_type` ANN index on `table` (if missing) and drop the other type.
+    Returns the index name and build time.
+    """
+    if table not in VECTOR_TABLES:
+        raise ValueError(f"table must be one of {tuple(VECTOR_TABLES)}")
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"index_type must be one of {INDEX_TYPES}")
+    column = VECTOR_TABLES[table]
+    name = index_name(table, index_type)
+    concurrent = " CONCURRENTLY" if concurrently else ""
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with psycopg.connect(**DB_CONFIG, autocommit=True) as conn:
+        if index_type == "ivfflat":
+            lists = IVFFLAT_LISTS or _default_lists(conn, table)
+            options = f"(lists = {lists})"
+        else:
+            options = f"(m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+
+        t0 = perf_counter()
+        conn.execute(
+            f"CREATE INDEX{concurrent} IF NOT EXISTS {name} ON {table} "
+            f"USING {index_type} ({column} vector_cosine_ops) WITH {options}"
+        )
+        build_s = perf_counter() - t0
+
+        if drop_other:
+            for other in INDEX_TYPES:
+                if other != index_type:
+                    conn.execute(f"DROP INDEX{concurrent} IF EXISTS {index_name(table, other)}")
+        conn.execute(f"ANALYZE {table}")
+
+    report = {"table": table, "index": name, "options": options, "build_seconds": round(build_s, 2)}
+    print(f"[VECTOR_INDEX] Built: {report}")
+    return report
+
+
+def vector_index_status(tables: Iterable[str] = VECTOR_TABLES) -> list[dict]:
+    """ANN indexes (name, type, size) on the embedding tables."""
+    with psycopg.connect(**DB_CONFIG) as conn:
+        rows = conn.execute(
+            """
+            SELECT i.tablename, i.indexname, am.amname, pg_size_pretty(pg_relation_size(c.oid))
+            FROM pg_indexes i
+            JOIN pg_class c ON c.relname = i.indexname
+            JOIN pg_am am ON am.oid = c.relam
+            WHERE i.tablename = ANY(%s) AND am.amname = ANY(%s)
+            ORDER BY i.tablename
+            """,
+            (list(tables), list(INDEX_TYPES)),
+        ).fetchall()
+    return [{"table": t, "index": n, "type": a, "size": s} for t, n, a, s in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ANN index maintenance for the embedding tables")
+    parser.add_argument("command", choices=["build", "status"])
+    parser.add_argument("--type", choices=INDEX_TYPES, default=VECTOR_INDEX_TYPE)
+    parser.add_argument("--table", choices=list(VECTOR_TABLES), action="append",
+                        help="Table to index (repeatable, default: all)")
+    parser.add_argument("--blocking", action="store_true",
+                        help="Do not use CONCURRENTLY (faster, but locks the table)")
+    parser.add_argument("--keep-other", action="store_true",
+                        help="Keep the index of the other type (e.g. to benchmark both)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        for table in args.table or VECTOR_TABLES:
+            build_vector_index(table, args.type, concurrently=not args.blocking, drop_other=not args.keep_other)
+    for row in vector_index_status():
+        print(row)
@@ -0,0 +1,154 @@
+# write_queue.py
+import os
+import asyncio
+from collections import defaultdict
+from typing import Optional
+from sql.db_pool import connection
+
+WRITE_QUEUE_MAX_SIZE = int(os.getenv("WRITE_QUEUE_MAX_SIZE", 10000))
+WRITE_QUEUE_BATCH_SIZE = int(os.getenv("WRITE_QUEUE_BATCH_SIZE", 200))
+WRITE_QUEUE_FLUSH_INTERVAL = float(os.getenv("WRITE_QUEUE_FLUSH_INTERVAL", 0.5))  # seconds
+
+
+class WriteBehindQueue:
+    """
+    In-process write-behind buffer for append-only rows (chats, logs).
+
+    - `put` only appends to memory; a background task flushes rows in bulk (COPY)
+      every `flush_interval` seconds or as soon as `batch_size` rows are buffered.
+    - At most `max_size` rows are held; `put` waits (backpressure) when full.
+    - Rows are tagged with their chat_id so readers can call `flush_chat` to
+      see their own writes before querying the chats table.
+    - `stop` drains everything that is still buffered.
+    """
+
+    def __init__(
+        self,
+        max_size: int = WRITE_QUEUE_MAX_SIZE,
+        batch_size: int = WRITE_QUEUE_BATCH_SIZE,
+        flush_interval: float = WRITE_QUEUE_FLUSH_INTERVAL,
+    ):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._buffer: list[tuple[str, dict, Optional[str]]] = []
+        self._pending_chats: dict[str, int] = defaultdict(int)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.rows_written = 0
+        self.batches_written = 0
+        self.rows_failed = 0
+
+    # ------ Lifecycle ------
+    def start(self):
+        if self._task is not None:
+            return
+        self._slots = asyncio.Semaphore(self.max_size)
+        self._wakeup = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._task = asyncio.create_task(self._run(), name="write-behind-queue")
+
+    async def stop(self):
+        """Stop the background flusher and write every buffered row."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+        print(f"[WRITE_QUEUE] Drained. rows_written={self.rows_written} rows_failed={self.rows_failed}")
+
+    # ------ Producers ------
+    async def put(self, table: str, row: dict, chat_id: Optional[str] = None):
+        """
+        Buffer one row for `table`. Waits if `max_size` rows are already buffered.
+        Falls back to a direct write when the queue was never started (scripts, notebooks).
+        """
+        if self._task is None:
+            await self._write([(table, row, chat_id)])
+            return
+        await self._slots.acquire()
+        self._buffer.append((table, row, chat_id))
+        if chat_id is not None:
+            self._pending_chats[chat_id] += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    # ------ Flushing ------
+    async def flush(self):
+        """Write everything currently buffered."""
+        if self._write_lock is None:
+            return
+        async with self._write_lock:
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                self._buffer = self._buffer[self.batch_size:]
+                try:
+                    await self._write(batch)
+                finally:
+                    for _, _, chat_id in batch:
+                        if chat_id is not None:
+                            self._pending_chats[chat_id] -= 1
+                            if self._pending_chats[chat_id] <= 0:
+                                del self._pending_chats[chat_id]
+                        self._slots.release()
+
+    async def flush_chat(self, chat_id: str):
+        """Flush only if rows for `chat_id` are still buffered (read-your-writes)."""
+        if chat_id in self._pending_chats:
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "max_size": self.max_size,
+            "rows_written": self.rows_written,
+            "batches_written": self.batches_written,
+            "rows_failed": self.rows_failed,
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                # Shielded so that stop() never cancels a batch halfway through
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                print(f"[ERROR] Write-behind flush failed: {e}")
+
+    async def _write(self, batch: list[tuple[str, dict, Optional[str]]]):
+        # Group rows by (table, columns) so each group is one COPY
+        groups: dict[tuple[str, tuple[str, ...]], list[tuple]] = defaultdict(list)
+        for table, row, _ in batch:
+            columns = tuple(row.keys())
+            groups[(table, columns)].append(tuple(row[c] for c in columns))
+
+        for attempt in range(2):
+            try:
+                async with connection() as conn:
+                    async with conn.cursor() as cur:
+                        for (table, columns), rows in groups.items():
+                            async with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+                                for values in rows:
+                                    await copy.write_row(values)
+                self.rows_written += len(batch)
+                self.batches_written += 1
+                return
+            except Exception as e:
+                print(f"[ERROR] Failed to write {len(batch)} buffered rows (attempt {attempt + 1}): {e}")
+        self.rows_failed += len(batch)
+
+
+# Process-wide queue for chats/logs persistence
+chat_writer = WriteBehindQueue()
@@ -0,0 +1,135 @@
+# image_ingest.py
+"""
+Shared ingestion stage for user images (base64 data URIs).
+
+Every incoming image is decoded once, here:
+- the size of the payload and the pixel count (read from the header, before
+  any pixel is decoded) are checked against IMAGE_MAX_BYTES / IMAGE_MAX_PIXELS;
+- JPEGs are decoded with `draft()` directly at a reduced DCT scale, other
+  formats are shrunk with `reduce`-based resampling (`reducing_gap`), to the
+  smallest size both consumers need;
+- `clip_image` is that image downscaled to CLIP resolution (shortest side
+  IMAGE_CLIP_SIZE), and `llm_bytes` a JPEG with the longest side at most
+  IMAGE_LLM_MAX_SIDE for the image LLM call, which also bounds image tokens.
+
+Usage:
+    image = ingest_data_uri(data_uri)          # ValueError if invalid or too large
+    clip_batcher.embed(image)                  # uses image.clip_image
+    BinaryContent(data=image.llm_bytes, media_type=image.llm_media_type)
+"""
+import os
+import math
+import base64
+import hashlib
+from io import BytesIO
+from time import perf_counter
+from typing import Optional, Tuple
+from PIL import Image
+
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 10 * 2**20))          # decoded payload
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 40_000_000))
+IMAGE_CLIP_SIZE = int(os.getenv("IMAGE_CLIP_SIZE", 224))                 # CLIP input resolution
+IMAGE_LLM_MAX_SIDE = int(os.getenv("IMAGE_LLM_MAX_SIDE", 768))
+IMAGE_LLM_JPEG_QUALITY = int(os.getenv("IMAGE_LLM_JPEG_QUALITY", 85))
+
+ingest_stats = {
+    "images": 0,
+    "rejected": 0,
+    "bytes_in": 0,
+    "llm_bytes_out": 0,
+    "total_ms": 0.0,
+}
+
+
+def _scaled(size: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    return max(1, math.ceil(size[0] * scale)), max(1, math.ceil(size[1] * scale))
+
+
+def _working_size(size: Tuple[int, int]) -> Tuple[int, int]:
+    """Smallest size that still serves both consumers (never larger than the original)."""
+    w, h = size
+    scale = max(IMAGE_LLM_MAX_SIDE / max(w, h), IMAGE_CLIP_SIZE / min(w, h))
+    return _scaled(size, min(1.0, scale))
+
+
+class IngestedImage:
+    """One decoded user image, shared by the CLIP embedding and the LLM call."""
+
+    llm_media_type = "image/jpeg"
+
+    def __init__(self, image: Image.Image, original_size: Tuple[int, int], original_bytes: int,
+                 content_hash: str):
+        self.image = image                  # RGB, at `_working_size(original_size)`
+        self.original_size = original_size
+        self.original_bytes = original_bytes
+        self.content_hash = content_hash    # sha256 of the decoded file bytes (see `sql.image_cache`)
+        self._clip_image: Optional[Image.Image] = None
+        self._llm_bytes: Optional[bytes] = None
+
+    @property
+    def clip_image(self) -> Image.Image:
+        if self._clip_image is None:
+            w, h = self.image.size
+            scale = IMAGE_CLIP_SIZE / min(w, h)
+            self._clip_image = (self.image.resize(_scaled((w, h), scale), Image.Resampling.BICUBIC,
+                                                  reducing_gap=2.0)
+                                if scale < 1 else self.image)
+        return self._clip_image
+
+    @property
+    def llm_bytes(self) -> bytes:
+        if self._llm_bytes is None:
+            image = self.image
+            if max(image.size) > IMAGE_LLM_MAX_SIDE:
+                image = image.copy()
+                image.thumbnail((IMAGE_LLM_MAX_SIDE, IMAGE_LLM_MAX_SIDE), Image.Resampling.BICUBIC)
+            buffer = BytesIO()
+            image.save(buffer, format="JPEG", quality=IMAGE_LLM_JPEG_QUALITY, optimize=True)
+            self._llm_bytes = buffer.getvalue()
+            ingest_stats["llm_bytes_out"] += len(self._llm_bytes)
+        return self._llm_bytes
+
+
+def ingest_data_uri(data_uri: str) -> IngestedImage:
+    """Validate, decode and downscale a base64 image data URI. Raises ValueError on bad input."""
+    t0 = perf_counter()
+    try:
+        if not data_uri.startswith("data:") or "," not in data_uri:
+            raise ValueError("Invalid data URI format")
+        _, encoded = data_uri.split(",", 1)
+        if len(encoded) * 3 // 4 > IMAGE_MAX_BYTES:
+            raise ValueError(f"Image is larger than {IMAGE_MAX_BYTES} bytes")
+        raw = base64.b64decode(encoded)
+
+        try:
+            image = Image.open(BytesIO(raw))  # reads the header only
+        except Exception as e:
+            raise ValueError(f"Unreadable image: {e}") from e
+        original_size = image.size
+        if original_size[0] * original_size[1] > IMAGE_MAX_PIXELS:
+            raise ValueError(f"Image has more than {IMAGE_MAX_PIXELS} pixels")
+
+        target = _working_size(original_size)
+        image.draft("RGB", target)  # JPEG: decode at 1/2, 1/4 or 1/8 scale; no-op for other formats
+        image = image.convert("RGB")
+        if image.size[0] > target[0] or image.size[1] > target[1]:
+            image = image.resize(target, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    except ValueError:
+        ingest_stats["rejected"] += 1
+        raise
+
+    ingest_stats["images"] += 1
+    ingest_stats["bytes_in"] += len(raw)
+    ingest_stats["total_ms"] += (perf_counter() - t0) * 1000
+    return IngestedImage(image, original_size, len(raw), hashlib.sha256(raw).hexdigest())
+
+
+def image_ingest_stats() -> dict:
+    n = ingest_stats["images"]
+    return {
+        "images": n,
+        "rejected": ingest_stats["rejected"],
+        "bytes_in": ingest_stats["bytes_in"],
+        "llm_bytes_out": ingest_stats["llm_bytes_out"],
+        "avg_ms": round(ingest_stats["total_ms"] / n, 2) if n else 0.0,
+    }
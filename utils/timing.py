@@ -0,0 +1,32 @@
+# timing.py
+from time import perf_counter
+from typing import Awaitable, TypeVar
+
+T = TypeVar("T")
+
+
+class StageTimer:
+    """
+    Record wall-clock time (ms) of named pipeline stages.
+
+    `sequential_ms` is what the stages would cost one after another;
+    comparing it with `wall_ms` shows how much running them concurrently saved.
+    """
+
+    def __init__(self):
+        self._start = perf_counter()
+        self.timings: dict[str, float] = {}
+
+    async def run(self, name: str, aw: Awaitable[T]) -> T:
+        t0 = perf_counter()
+        try:
+            return await aw
+        finally:
+            self.timings[name] = round((perf_counter() - t0) * 1000, 1)
+
+    def summary(self) -> dict:
+        return {
+            "stages_ms": dict(self.timings),
+            "sequential_ms": round(sum(self.timings.values()), 1),
+            "wall_ms": round((perf_counter() - self._start) * 1000, 1),
+        }